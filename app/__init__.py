@@ -1,10 +1,8 @@
 import os
 from flask import Flask, send_from_directory, jsonify
 from flask_cors import CORS
-from flask_migrate import Migrate
-from .app_extensions import db, jwt, swagger_ui, cache
-from .app_config import Config
-from .models import User
+from .app_extensions import db, jwt, cache, swagger_ui_blueprint
+from .app_config import CONFIGS
 from .config.redis_config import init_redis
 
 def create_app(config_name=None):
@@ -17,7 +15,7 @@ def create_app(config_name=None):
                  "origins": ["http://127.0.0.1:5001", "http://localhost:5001"],
                  "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
                  "allow_headers": ["Content-Type", "Authorization", "Accept"],
-                 "expose_headers": ["Content-Type", "Authorization"],
+                 "expose_headers": ["Content-Type", "Authorization", "Server-Timing"],
                  "supports_credentials": True,
                  "max_age": 3600
              }
@@ -33,10 +31,11 @@ def create_app(config_name=None):
         app.config['CACHE_TYPE'] = 'simple'  # Use simple cache for testing
         app.config['CACHE_DEFAULT_TIMEOUT'] = 2  # 2 seconds timeout for testing
     else:
-        app.config.from_object(Config)
-        app.config['DEBUG'] = True  # Enable debug mode
-        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        app.config['SQLALCHEMY_ECHO'] = True  # Enable SQL query logging
+        # 'development' (debug, SQL echo), 'production' or a config class
+        config = config_name or os.environ.get('APP_CONFIG', 'development')
+        app.config.from_object(CONFIGS[config] if isinstance(config, str) else config)
+        if app.config.get('LOG_LEVEL'):
+            app.logger.setLevel(app.config['LOG_LEVEL'])
         # Initialize Redis cache
         init_redis(app)
 
@@ -48,10 +47,18 @@ def create_app(config_name=None):
     app.config['JWT_HEADER_TYPE'] = 'Bearer'
     app.config['JWT_IDENTITY_CLAIM'] = 'sub'
 
+    # Pooling, read-replica binds and SQLite pragmas (WAL, synchronous=NORMAL, ...)
+    from .database import init_database
+    init_database(app)
+
     # Initialize extensions
     db.init_app(app)
-    migrate = Migrate(app, db)
     jwt.init_app(app)
+    # Flask-Migrate imports alembic, which takes longer than the rest of startup;
+    # only `flask ...` commands need it
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
 
     # Set up authentication
     from .auth import init_auth
@@ -60,36 +67,37 @@ def create_app(config_name=None):
     # Initialize cache
     cache.init_app(app)
 
-    # Setup DB file and create test user
-    with app.app_context():
-        try:
-            db.create_all()
-            # Create test users if they don't exist
-            if not User.query.filter_by(username='dr_smith').first():
-                test_user = User(username='dr_smith', role='doctor')
-                test_user.set_password('password123')
-                db.session.add(test_user)
-                print("✅ dr_smith created successfully!")
-
-            if not User.query.filter_by(username='dr_smith_2').first():
-                test_user2 = User(username='dr_smith_2', role='doctor')
-                test_user2.set_password('password1234')
-                db.session.add(test_user2)
-                print("✅ dr_smith_2 created successfully!")
-
-            if not User.query.filter_by(username='dr_smith_3').first():
-                test_user3 = User(username='dr_smith_3', role='doctor')
-                test_user3.set_password('password12345')
-                db.session.add(test_user3)
-                print("✅ dr_smith_3 created successfully!")
-
-            db.session.commit()
-            print("✅ Database tables created successfully!")
-        except Exception as e:
-            print(f"❌ Error creating database tables: {str(e)}")
+    # Per-request Server-Timing instrumentation (DB, cache, serialization)
+    from .timing import init_timing
+    init_timing(app)
+
+    # Prometheus request, DB pool and cache metrics at /metrics
+    from .metrics import init_metrics
+    init_metrics(app)
+
+    # Opt-in sampling profiler (PROFILER_ENABLED); no hooks when it is off
+    from .profiling import init_profiling
+    init_profiling(app)
+
+    # Slow-query log with query plans (SLOW_QUERY_MS, 0 = off)
+    from .slow_queries import init_slow_queries
+    init_slow_queries(app)
+
+    # Register the dashboard rollup CLI commands
+    from .rollups import init_rollups
+    init_rollups(app)
+
+    # Register the synthetic data CLI (flask datagen load)
+    from .datagen import init_datagen
+    init_datagen(app)
+
+    # Schema and default users (flask setup db / flask setup users); startup doesn't touch the database
+    from .bootstrap import init_bootstrap
+    init_bootstrap(app)
 
     # Register blueprints
-    app.register_blueprint(swagger_ui)
+    if app.config.get('SWAGGER_UI', True):
+        app.register_blueprint(swagger_ui_blueprint())
     from .routes import bp
     app.register_blueprint(bp)
 
@@ -135,33 +143,15 @@ def create_app(config_name=None):
 
     return app
 
-def initialize_database(app):
-    """Ensure DB folder exists and initialize."""
-    db_uri = app.config['SQLALCHEMY_DATABASE_URI']
-    print(f"📍 DB URI: {db_uri}")
-
-    if db_uri.startswith("sqlite:///"):
-        db_file = db_uri.replace("sqlite:///", "")
-        db_dir = os.path.dirname(db_file)
-
-        print(f"📂 Ensuring directory exists: {db_dir}")
-        try:
-            os.makedirs(db_dir, exist_ok=True)
-        except Exception as e:
-            print(f"❌ Could not create DB directory: {e}")
-            return
-
-        print(f"🧪 Checking write permissions...")
-        if not os.access(db_dir, os.W_OK):
-            print(f"❌ No write permissions to: {db_dir}")
-            return
-
-    else:
-        print("⚠️ Not using SQLite — skipping dir creation.")
-
-    try:
-        with app.app_context():
-            db.create_all()
-            print(f"✅ Database initialized successfully!")
-    except Exception as e:
-        print(f"❌ Failed to initialize database: {e}")
\ No newline at end of file
+def reset_after_fork(app):
+    """
+    Called in each pre-forked worker (gunicorn.conf.py): connections must not
+    be shared with the master process or other workers, so drop any pooled
+    database connections and Redis connection pools inherited from the fork.
+    """
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+            db.get_engine(app, bind=bind).dispose()
+    for backend in app.extensions.get('cache', {}).values():
+        for client in {getattr(backend, '_write_client', None), getattr(backend, '_read_client', None)} - {None}:
+            client.connection_pool.reset()
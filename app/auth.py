@@ -1,33 +1,156 @@
-from flask import current_app
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app, g, has_app_context
+from app.app_extensions import db
+from app.database import listen_once
 from app.models import User
 from functools import wraps
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity, verify_jwt_in_request
+
+class CachedUser(namedtuple('CachedUser', 'user_id username role')):
+    """Read-only snapshot of a User, as kept by the identity cache; query User to change one"""
+    __slots__ = ()
+
+    def to_dict(self):
+        return dict(self._asdict())
+
+class IdentityCache:
+    """
+    CachedUsers by user id, for at most `ttl` seconds and `max_size` users
+    (least recently used go first). Each worker has its own, so a change made
+    in another worker shows up here after the TTL at the latest.
+    """
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return a fresh CachedUser, or None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, user):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (user, time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Forget one user, or all of them"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.user_id)
 
 def init_auth(app):
-    pass
+    app.extensions['identity_cache'] = IdentityCache(
+        max_size=int(app.config.get('IDENTITY_CACHE_SIZE', 1024)),
+        ttl=float(app.config.get('IDENTITY_CACHE_TTL', 60))
+    )
+    listen_once(User, ('after_insert', _user_changed), ('after_update', _user_changed),
+                ('after_delete', _user_changed))
+
+def invalidate_user(user_id):
+    """Drop a user from this worker's identity cache; User inserts, updates and deletes do it on flush"""
+    if has_app_context():
+        cache = current_app.extensions.get('identity_cache')
+        if cache is not None:
+            cache.invalidate(int(user_id))
+
+def load_user(user_id):
+    """The CachedUser for user_id from the identity cache, or the database on a miss; None if there is none"""
+    user_id = int(user_id)
+    cache = current_app.extensions.get('identity_cache')
+    user = cache.get(user_id) if cache is not None else None
+    if user is None:
+        row = db.session.query(User.user_id, User.username, User.role).filter_by(user_id=user_id).first()
+        if row is None:
+            return None
+        user = CachedUser(*row)
+        if cache is not None:
+            cache.set(user_id, user)
+    return user
+
+def current_identity():
+    """The JWT identity of the current request; the token is verified and decoded once per request"""
+    if 'jwt_identity' not in g:
+        verify_jwt_in_request()
+        g.jwt_identity = get_jwt_identity()
+    return g.jwt_identity
+
+def current_role():
+    """
+    Role of the authenticated user, from the token's role claim without a
+    database query. Tokens issued before the claim existed fall back to the
+    (cached) user record.
+    """
+    role = get_jwt().get('role')
+    if role is None:
+        user = get_current_user()
+        role = user.role if user is not None else None
+    return role
 
 def login_required(f):
+    """Verify the JWT once, then run the view once; errors in the view are not authentication errors"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         try:
-            jwt_required()(f)(*args, **kwargs)
+            current_identity()
         except Exception as e:
             current_app.logger.error(f"Authentication error: {str(e)}")
             return {'error': 'Authentication required'}, 401
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    """
+    Like jwt_required, but the token must carry the admin role. The claim is
+    fixed when the token is issued: a role change applies from the next login.
+    """
+    @wraps(f)
+    @jwt_required()
+    def decorated_function(*args, **kwargs):
+        if current_role() != 'admin':
+            return {'error': 'Admin access required'}, 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 def create_session(user):
-    access_token = create_access_token(identity=str(user.user_id))
+    access_token = create_access_token(identity=str(user.user_id), additional_claims={'role': user.role})
+    cache = current_app.extensions.get('identity_cache')
+    if cache is not None:
+        cache.set(user.user_id, CachedUser(user.user_id, user.username, user.role))
     return {
         'access_token': access_token,
         'user': user.to_dict()
     }
 
 def get_current_user():
+    """The authenticated user as a CachedUser (see load_user), or None"""
     try:
-        user_id = get_jwt_identity()
-        return User.query.get(int(user_id))
+        user_id = g.jwt_identity if 'jwt_identity' in g else get_jwt_identity()
+        return load_user(user_id)
     except:
         return None
 
@@ -0,0 +1,56 @@
+"""
+Schema creation and the default users, as explicit CLI commands so that
+create_app() itself doesn't touch the database:
+
+    flask setup db      # create missing tables (or use `flask db upgrade`)
+    flask setup users   # add the dr_smith accounts if they don't exist
+"""
+import os
+import click
+from .app_extensions import db
+from .models import User
+
+# Username, password
+DEFAULT_USERS = (
+    ('dr_smith', 'password123'),
+    ('dr_smith_2', 'password1234'),
+    ('dr_smith_3', 'password12345')
+)
+
+def create_tables():
+    """Create the SQLite directory if needed, then any missing tables"""
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        os.makedirs(os.path.dirname(url.database), exist_ok=True)
+    db.create_all()
+
+def seed_users():
+    """Add the missing default doctors; returns their usernames"""
+    existing = {name for (name,) in db.session.query(User.username).filter(
+        User.username.in_([username for username, _ in DEFAULT_USERS]))}
+    created = []
+    for username, password in DEFAULT_USERS:
+        if username not in existing:
+            user = User(username=username, role='doctor')
+            user.set_password(password)
+            db.session.add(user)
+            created.append(username)
+    db.session.commit()
+    return created
+
+def init_bootstrap(app):
+    @app.cli.group()
+    def setup():
+        """Create the database schema and default users."""
+
+    @setup.command('db')
+    def db_command():
+        """Create missing tables."""
+        create_tables()
+        click.echo(f"✅ Database tables created in {db.engine.url!r}")
+
+    @setup.command('users')
+    def users_command():
+        """Add the default doctor accounts."""
+        created = seed_users()
+        click.echo(f"✅ Created {', '.join(created)}" if created else "✅ Default users already exist")
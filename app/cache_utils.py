@@ -1,6 +1,8 @@
 from functools import wraps
-from flask import current_app
+from flask import current_app, request, Response
 from .app_extensions import cache
+from .timing import measure
+from .metrics import CACHE_REQUESTS
 
 def cache_response(timeout=None):
     """
@@ -14,21 +16,40 @@ def cache_response(timeout=None):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
+            # Query-string variants are not cached: writes only invalidate
+            # the canonical key, so filtered results would go stale.
+            # Streamed (NDJSON) responses cannot be cached either.
+            if request.args or wants_ndjson():
+                return f(*args, **kwargs)
+
             # Generate cache key from function name and arguments
             cache_key = f"{f.__name__}:{str(args)}:{str(kwargs)}"
             
             # Try to get cached response
-            cached_response = cache.get(cache_key)
+            with measure('cache'):
+                cached_response = cache.get(cache_key)
             if cached_response is not None:
+                CACHE_REQUESTS.labels(f.__name__, 'hit').inc()
                 return cached_response
+            CACHE_REQUESTS.labels(f.__name__, 'miss').inc()
             
             # If not cached, execute function and cache result
             response = f(*args, **kwargs)
-            cache.set(cache_key, response, timeout=timeout or current_app.config['CACHE_DEFAULT_TIMEOUT'])
+            if isinstance(response, Response) and response.status_code == 200:
+                # Store the ETag with the response so hits don't rehash the body
+                response.add_etag()
+            with measure('cache'):
+                cache.set(cache_key, response, timeout=timeout or current_app.config['CACHE_DEFAULT_TIMEOUT'])
             return response
+        # Lets tooling (e.g. benchmarks/run.py) tell cached routes apart
+        decorated_function.cached_response = True
         return decorated_function
     return decorator
 
+def wants_ndjson():
+    """True when the client prefers a newline-delimited JSON stream"""
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
 def invalidate_cache(*cache_keys):
     """
     Function to invalidate specific cache keys.
@@ -36,7 +57,8 @@ def invalidate_cache(*cache_keys):
         invalidate_cache('some_route:arg1:arg2')
     """
     for key in cache_keys:
-        cache.delete(key)
+        with measure('cache'):
+            cache.delete(key)
 
 def clear_all_cache():
     """Clear all cached data."""
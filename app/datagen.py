@@ -0,0 +1,289 @@
+"""
+Bulk synthetic data for load and scale testing.
+
+`flask datagen load --visits 1000000` adds referentially consistent users,
+patients, visits, prescriptions and reports to the configured database:
+
+- ids are assigned explicitly after the current maximum, so rows can
+  reference each other without reading them back, and loading into a
+  non-empty database is fine
+- visits per patient are skewed (lognormal weights: most patients come
+  a few times, some dozens of times), drug names and diagnoses follow a
+  Zipf distribution, and every visit happens after its patient was
+  registered
+- rows go in with Core executemany batches in one transaction, each
+  batch after the batches of the rows it references; on SQLite the load
+  runs with synchronous=OFF, no foreign key checks and (unless the
+  database is in WAL mode) an in-memory journal, and the previous pragma
+  values are restored afterwards; on Postgres the id sequences are moved
+  past the generated ids
+- the dashboard rollups are rebuilt at the end
+
+The same --seed produces the same data (dates relative to the time of
+the load). 1M visits (and about as
+many prescriptions) load in well under a minute on SQLite.
+"""
+import random
+import time
+from bisect import bisect
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import accumulate
+import click
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+from . import rollups
+from .app_extensions import db
+from .models import User, Patient, Visit, Prescription, Report
+
+# Password of every generated user
+PASSWORD = 'password123'
+
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William',
+               'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Aino', 'Eero', 'Helmi', 'Onni', 'Sofia', 'Leo', 'Olivia', 'Elias', 'Aada', 'Matti')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Wilson',
+              'Anderson', 'Taylor', 'Thomas', 'Moore', 'Martin', 'Korhonen', 'Virtanen', 'Nieminen',
+              'Mäkinen', 'Hämäläinen', 'Laine', 'Heikkinen', 'Koskinen', 'Järvinen', 'Lehtonen')
+# Most common first: Zipf weights follow this order
+DIAGNOSES = ('Common cold', 'Hypertension', 'Back pain', 'Flu', 'Headache', 'Type 2 diabetes', 'Anxiety',
+             'Allergic rhinitis', 'Asthma', 'Bronchitis', 'Urinary tract infection', 'Migraine',
+             'Sinusitis', 'Gastroenteritis', 'Dermatitis', 'Insomnia', 'Depression', 'Otitis media',
+             'Tonsillitis', 'Osteoarthritis')
+DRUGS = ('Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Lisinopril', 'Metformin', 'Atorvastatin', 'Omeprazole',
+         'Amlodipine', 'Cetirizine', 'Salbutamol', 'Aspirin', 'Sertraline', 'Levothyroxine', 'Prednisolone',
+         'Doxycycline', 'Losartan', 'Simvastatin', 'Citalopram', 'Tamiflu', 'Naproxen', 'Clopidogrel',
+         'Warfarin', 'Furosemide', 'Gabapentin', 'Tramadol', 'Azithromycin', 'Montelukast', 'Fluoxetine',
+         'Bisoprolol', 'Codeine')
+DOSAGES = ('5mg', '10mg', '20mg', '50mg', '100mg', '250mg', '400mg', '500mg', '1g')
+DURATIONS = (3, 5, 7, 10, 14, 30, 90)
+REPORT_TYPES = ('Blood Test', 'X-Ray', 'MRI', 'ECG', 'Ultrasound', 'Urine Test')
+REPORT_TEXTS = ('Within normal limits', 'Minor abnormalities, follow up in 3 months',
+                'No abnormalities detected', 'Results pending specialist review')
+
+# Prescriptions written per visit, with their probabilities (about one on average)
+PRESCRIPTIONS_PER_VISIT = ((0, 0.35), (1, 0.35), (2, 0.2), (3, 0.1))
+
+# Skew of visits per patient (lognormal sigma) and of names (Zipf exponent)
+PATIENT_SKEW = 1.0
+ZIPF_EXPONENT = 1.1
+
+# SQLite pragmas for the duration of a load
+BULK_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'journal_mode': 'MEMORY',
+    'cache_size': '-262144',  # 256 MiB
+    'temp_store': 'MEMORY',
+    # Rows reference each other by construction; skip checking them one by one
+    'foreign_keys': 'OFF'
+}
+
+def zipf_weights(n, exponent=ZIPF_EXPONENT):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+class Sampler:
+    """Weighted choices from cumulative weights, drawn one at a time"""
+
+    def __init__(self, rng, values, cum_weights):
+        self.rng = rng
+        self.values = values
+        self.cum_weights = cum_weights
+        self.total = cum_weights[-1]
+
+    def __call__(self):
+        return self.values[bisect(self.cum_weights, self.rng.random() * self.total)]
+
+@contextmanager
+def sqlite_bulk_load(connection):
+    """Relax durability on SQLite while loading; other databases are left alone"""
+    if connection.dialect.name != 'sqlite':
+        yield
+        return
+    previous = {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in BULK_LOAD_PRAGMAS}
+    if previous['journal_mode'] == 'wal':
+        # Leaving WAL needs the database to ourselves, and WAL is cheap enough with synchronous=OFF
+        del previous['journal_mode']
+    for name in previous:
+        connection.exec_driver_sql(f'PRAGMA {name} = {BULK_LOAD_PRAGMAS[name]}')
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            connection.exec_driver_sql(f'PRAGMA {name} = {value}')
+
+def _next_id(connection, column):
+    return (connection.execute(db.select(func.max(column))).scalar() or 0) + 1
+
+def _advance_sequences(connection, columns):
+    """Move the Postgres sequences behind `columns` past their explicitly inserted ids"""
+    if connection.dialect.name != 'postgresql':
+        return
+    quote = connection.dialect.identifier_preparer
+    for column in columns:
+        # setval() ignores the NULL max of an empty table
+        connection.execute(db.select(func.setval(
+            func.pg_get_serial_sequence(quote.format_table(column.table), column.name),
+            db.select(func.max(column)).scalar_subquery()
+        )))
+
+class _BatchInserter:
+    """
+    Buffers rows for one table and inserts them batch_size at a time; the
+    pending rows of `parents` (tables these rows reference) go in first.
+    """
+    def __init__(self, connection, model, batch_size, parents=()):
+        self.connection = connection
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.parents = parents
+        self.rows = []
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for parent in self.parents:
+            parent.flush()
+        if self.rows:
+            self.connection.execute(self.table.insert(), self.rows)
+            self.rows = []
+
+def generate(visits, patients=None, doctors=None, nurses=None, reports=None, seed=0, days=730,
+             batch_size=20_000, now=None):
+    """
+    Load synthetic rows into the current app's database and rebuild the
+    rollups. Returns the number of rows written per table, plus the id
+    ranges of the generated doctors and admin.
+    """
+    rng = random.Random(seed)
+    patients = max(1, visits // 4) if patients is None else patients
+    doctors = max(5, visits // 20_000) if doctors is None else doctors
+    nurses = max(1, doctors // 2) if nurses is None else nurses
+    reports = patients // 2 if reports is None else reports
+    now = now or datetime.utcnow().replace(microsecond=0)
+    password_hash = generate_password_hash(PASSWORD)
+    span = days * 24 * 3600
+
+    with db.engine.connect() as connection, sqlite_bulk_load(connection), connection.begin():
+        first_user = _next_id(connection, User.user_id)
+        first_patient = _next_id(connection, Patient.id)
+        first_visit = _next_id(connection, Visit.visit_id)
+        first_prescription = _next_id(connection, Prescription.prescription_id)
+        first_report = _next_id(connection, Report.report_id)
+
+        # Users: doctors, then nurses, then one admin
+        roles = ['doctor'] * doctors + ['nurse'] * nurses + ['admin']
+        users = _BatchInserter(connection, User, batch_size)
+        for offset, role in enumerate(roles):
+            user_id = first_user + offset
+            users.add({'user_id': user_id, 'username': f'{role}_{user_id}',
+                       'password_hash': password_hash, 'role': role})
+        users.flush()
+
+        # Patients, registered some time in the window
+        registered = []
+        rows = _BatchInserter(connection, Patient, batch_size)
+        for offset in range(patients):
+            created_at = now - timedelta(seconds=rng.randrange(span))
+            registered.append(created_at)
+            rows.add({
+                'id': first_patient + offset,
+                'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                'age': int(rng.triangular(0, 100, 45)),
+                'contact_info': f'patient{first_patient + offset}@example.com',
+                'created_at': created_at,
+                'updated_at': created_at
+            })
+        rows.flush()
+
+        patient_sampler = Sampler(rng, range(patients), list(accumulate(
+            rng.lognormvariate(0, PATIENT_SKEW) for _ in range(patients))))
+        doctor_sampler = Sampler(rng, range(first_user, first_user + doctors), list(accumulate(
+            rng.uniform(0.5, 1.5) for _ in range(doctors))))
+        diagnosis_sampler = Sampler(rng, DIAGNOSES, zipf_weights(len(DIAGNOSES)))
+        drug_sampler = Sampler(rng, DRUGS, zipf_weights(len(DRUGS)))
+        prescription_counts = Sampler(rng, [n for n, _ in PRESCRIPTIONS_PER_VISIT],
+                                      list(accumulate(p for _, p in PRESCRIPTIONS_PER_VISIT)))
+
+        # Visits after the patient's registration, each with a few prescriptions
+        visit_rows = _BatchInserter(connection, Visit, batch_size)
+        prescription_rows = _BatchInserter(connection, Prescription, batch_size, parents=[visit_rows])
+        prescription_id = first_prescription
+        for offset in range(visits):
+            visit_id = first_visit + offset
+            patient = patient_sampler()
+            patient_id = first_patient + patient
+            doctor_id = doctor_sampler()
+            since = (now - registered[patient]).total_seconds()
+            visit_rows.add({
+                'visit_id': visit_id,
+                'patient_id': patient_id,
+                'doctor_id': doctor_id,
+                'visit_date': now - timedelta(seconds=rng.random() * since),
+                'diagnosis': diagnosis_sampler()
+            })
+            for _ in range(prescription_counts()):
+                prescription_rows.add({
+                    'prescription_id': prescription_id,
+                    'patient_id': patient_id,
+                    'doctor_id': doctor_id,
+                    'visit_id': visit_id,
+                    'drug_name': drug_sampler(),
+                    'dosage': rng.choice(DOSAGES),
+                    'duration': rng.choice(DURATIONS)
+                })
+                prescription_id += 1
+        visit_rows.flush()
+        prescription_rows.flush()
+
+        report_rows = _BatchInserter(connection, Report, batch_size)
+        for offset in range(reports):
+            patient = rng.randrange(patients)
+            since = (now - registered[patient]).total_seconds()
+            report_rows.add({
+                'report_id': first_report + offset,
+                'patient_id': first_patient + patient,
+                'report_type': rng.choice(REPORT_TYPES),
+                'report_data': rng.choice(REPORT_TEXTS),
+                'created_at': now - timedelta(seconds=rng.random() * since)
+            })
+        report_rows.flush()
+
+        _advance_sequences(connection, [User.user_id, Patient.id, Visit.visit_id,
+                                        Prescription.prescription_id, Report.report_id])
+
+    rollups.rebuild()
+    db.session.commit()
+    return {
+        'users': len(roles),
+        'patients': patients,
+        'visits': visits,
+        'prescriptions': prescription_id - first_prescription,
+        'reports': reports,
+        'doctor_ids': [first_user, first_user + doctors - 1],
+        'admin_id': first_user + len(roles) - 1
+    }
+
+def init_datagen(app):
+    @app.cli.group()
+    def datagen():
+        """Synthetic data for load and scale testing."""
+
+    @datagen.command('load')
+    @click.option('--visits', type=int, default=100_000, show_default=True, help='Visits to generate.')
+    @click.option('--patients', type=int, help='Patients to generate (default: visits / 4).')
+    @click.option('--doctors', type=int, help='Doctors to generate (default: visits / 20000, at least 5).')
+    @click.option('--reports', type=int, help='Reports to generate (default: patients / 2).')
+    @click.option('--seed', type=int, default=0, show_default=True, help='Random seed.')
+    @click.option('--batch-size', type=int, default=20_000, show_default=True, help='Rows per executemany.')
+    def load_command(visits, patients, doctors, reports, seed, batch_size):
+        """Bulk-load synthetic users, patients, visits, prescriptions and reports."""
+        db.create_all()
+        started = time.perf_counter()
+        counts = generate(visits, patients=patients, doctors=doctors, reports=reports, seed=seed,
+                          batch_size=batch_size)
+        click.echo(f"✅ Loaded {counts['users']} users, {counts['patients']} patients, {counts['visits']} visits, "
+                   f"{counts['prescriptions']} prescriptions and {counts['reports']} reports "
+                   f"in {time.perf_counter() - started:.1f}s (password for all users: {PASSWORD})")
@@ -0,0 +1,89 @@
+"""
+Prometheus metrics for the main API, served at /metrics.
+
+init_metrics(app) records, for every request:
+
+- http_requests_total and http_request_duration_seconds, by method, route
+  template and status
+- http_requests_in_progress, by method
+
+plus DB pool usage (checked-out connections and new connections, from
+SQLAlchemy pool events) and response cache hits/misses (cache_utils).
+
+Collection only bumps counters in place; the text format is produced when
+/metrics is scraped. With several worker processes, set
+PROMETHEUS_MULTIPROC_DIR to an empty, writable directory before the
+workers start: every process then writes its values to files there and
+/metrics aggregates them, whichever worker serves the scrape. Under
+gunicorn the preloaded app already writes there before any hook runs, so
+gunicorn.conf.py creates the directory when the config is read; empty it
+on deploys. Files of workers that exited stay merged in (child_exit marks
+their live gauges dead).
+"""
+import os
+from time import perf_counter
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy.pool import Pool
+from app.database import listen_once
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests', ['method', 'route', 'status'])
+LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency', ['method', 'route', 'status'])
+IN_PROGRESS = Gauge('http_requests_in_progress', 'HTTP requests being served', ['method'],
+                    multiprocess_mode='livesum')
+
+DB_CHECKED_OUT = Gauge('db_pool_checked_out_connections', 'DB connections checked out of the pool',
+                       multiprocess_mode='livesum')
+DB_CONNECTS = Counter('db_pool_connections_total', 'New DB connections opened by the pool')
+
+CACHE_REQUESTS = Counter('cache_requests_total', 'Response cache lookups', ['view', 'result'])
+
+def metrics_payload():
+    """Current metrics in the Prometheus text format, merged across processes when configured"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+def _route():
+    # Route templates keep the label set bounded (no ids)
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_CHECKED_OUT.inc()
+
+def _on_checkin(dbapi_connection, connection_record):
+    DB_CHECKED_OUT.dec()
+
+def _on_connect(dbapi_connection, connection_record):
+    DB_CONNECTS.inc()
+
+def init_metrics(app):
+    listen_once(Pool, ('checkout', _on_checkout), ('checkin', _on_checkin), ('connect', _on_connect))
+
+    @app.before_request
+    def start_request_metrics():
+        g._metrics_started = perf_counter()
+        IN_PROGRESS.labels(request.method).inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('_metrics_started')
+        if started is not None:
+            labels = (request.method, _route(), response.status_code)
+            REQUESTS.labels(*labels).inc()
+            LATENCY.labels(*labels).observe(perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        # Runs even when the response could not be built
+        if g.pop('_metrics_started', None) is not None:
+            IN_PROGRESS.labels(request.method).dec()
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(metrics_payload(), content_type=CONTENT_TYPE_LATEST)
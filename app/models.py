@@ -55,7 +55,7 @@ class Visit(db.Model):
     visit_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
-    visit_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    visit_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     diagnosis = db.Column(db.Text)
     
     prescriptions = db.relationship('Prescription', backref='visit', lazy=True)
@@ -109,3 +109,36 @@ class Report(db.Model):
             'report_data': self.report_data,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+# ------------------- Dashboard Rollups ------------------- #
+# Maintained incrementally by the write routes (see app/rollups.py)
+
+class MetricRollup(db.Model):
+    __tablename__ = 'metric_rollup'
+    name = db.Column(db.String(50), primary_key=True)  # 'total_patients', 'total_age', ...
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class AgeBucketRollup(db.Model):
+    __tablename__ = 'age_bucket_rollup'
+    bucket = db.Column(db.String(10), primary_key=True)  # '0-18', '19-30', ...
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyVisitRollup(db.Model):
+    __tablename__ = 'daily_visit_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class DoctorRollup(db.Model):
+    __tablename__ = 'doctor_rollup'
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+    prescriptions = db.Column(db.Integer, nullable=False, default=0)
+
+class DrugRollup(db.Model):
+    __tablename__ = 'drug_rollup'
+    drug_name = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Set up the backrefs (Visit.doctor, Prescription.prescribing_doctor, ...) now rather than on first query,
+# so that modules can refer to them at import time
+db.configure_mappers()
@@ -0,0 +1,144 @@
+"""
+On-demand sampling profiler for production requests.
+
+Off by default (PROFILER_ENABLED). When it is off init_profiling registers
+no hooks at all, so requests pay nothing for it. When it is on, a request
+is profiled if:
+
+- it carries the `X-Profile: 1` header and an admin's access token, or
+- it is one of every PROFILER_SAMPLE_EVERY requests handled by this
+  process (0 disables sampling)
+
+A profiled request is sampled by a background thread that records the
+request thread's stack every PROFILER_INTERVAL_MS. The stacks are written
+in the collapsed format (`outer;inner;leaf count`, one per line) used by
+flamegraph.pl and speedscope, to PROFILER_DIR; only the newest
+PROFILER_MAX_CAPTURES files are kept. The capture name is returned in
+the X-Profile-Capture response header; admins can list and download
+captures from /api/admin/profiles.
+"""
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import current_app, g, request
+from flask_jwt_extended import verify_jwt_in_request
+
+CAPTURE_SUFFIX = '.collapsed'
+_CAPTURE_NAME = re.compile(r'^[\w.-]+\.collapsed$')
+
+class StackSampler:
+    """Counts the collapsed stacks of one thread, sampled from a background thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+def collapse(frame):
+    """`outermost;...;innermost` for a frame and its callers"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def list_captures(directory):
+    """Saved captures, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    captures = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and _CAPTURE_NAME.match(entry.name):
+            stat = entry.stat()
+            captures.append({
+                'name': entry.name,
+                'size': stat.st_size,
+                'created_at': stat.st_mtime
+            })
+    return sorted(captures, key=lambda capture: capture['created_at'], reverse=True)
+
+def is_capture_name(name):
+    return bool(_CAPTURE_NAME.match(name))
+
+def _save(directory, name, data, keep):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write(data)
+    for old in list_captures(directory)[keep:]:
+        try:
+            os.remove(os.path.join(directory, old['name']))
+        except OSError:
+            pass
+
+def _requested_by_admin():
+    """Honor X-Profile only for an admin's token, so it cannot be used to load the server"""
+    from .auth import current_role
+    try:
+        verify_jwt_in_request(optional=True)
+    except Exception:
+        return False
+    return current_role() == 'admin'
+
+def init_profiling(app):
+    app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+    if not app.config.get('PROFILER_ENABLED', False):
+        return
+
+    sample_every = int(app.config.get('PROFILER_SAMPLE_EVERY', 0))
+    interval = float(app.config.get('PROFILER_INTERVAL_MS', 5)) / 1000
+    requests_seen = itertools.count(1)
+
+    @app.before_request
+    def start_profiling():
+        sampled = sample_every > 0 and next(requests_seen) % sample_every == 0
+        if sampled or (request.headers.get('X-Profile') == '1' and _requested_by_admin()):
+            g._stack_sampler = StackSampler(threading.get_ident(), interval)
+            g._stack_sampler.start()
+
+    @app.after_request
+    def finish_profiling(response):
+        sampler = g.pop('_stack_sampler', None)
+        if sampler is None:
+            return response
+        sampler.stop()
+
+        endpoint = (request.endpoint or 'unmatched').replace('.', '-')
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}{CAPTURE_SUFFIX}"
+        try:
+            _save(current_app.config['PROFILER_DIR'], name, sampler.collapsed(),
+                  int(current_app.config.get('PROFILER_MAX_CAPTURES', 100)))
+            response.headers['X-Profile-Capture'] = name
+        except OSError as e:
+            current_app.logger.error(f"Could not save profile {name}: {str(e)}")
+        return response
+
+    @app.teardown_request
+    def stop_profiling(exc):
+        # The response was never built; do not leave the sampler running
+        sampler = g.pop('_stack_sampler', None)
+        if sampler is not None:
+            sampler.stop()
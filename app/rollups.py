@@ -0,0 +1,219 @@
+"""
+Incrementally maintained rollups for the dashboard metrics.
+
+The write routes call the record_* / forget_patient helpers before they
+commit, so every rollup change lands in the same transaction as the row
+it describes. Counters are bumped with UPDATE ... SET col = col + delta,
+which keeps concurrent writers from losing increments.
+
+`flask rollups rebuild` recomputes everything from the base tables, e.g.
+after a backfill or a bulk import that bypassed the routes. The migration
+that adds the rollup tables runs the same rebuild, so existing databases
+start out with counters that match their rows.
+"""
+from collections import Counter
+from datetime import date, timedelta
+import click
+from sqlalchemy import bindparam, func
+from sqlalchemy.dialects import postgresql, sqlite
+from .app_extensions import db
+from .models import (Patient, Visit, Prescription, MetricRollup, AgeBucketRollup,
+                     DailyVisitRollup, DoctorRollup, DrugRollup)
+
+# (label, inclusive upper bound) - same buckets the analytics dashboard uses
+AGE_BUCKETS = (('0-18', 18), ('19-30', 30), ('31-50', 50), ('51-70', 70), ('70+', None))
+
+ROLLUP_MODELS = (MetricRollup, AgeBucketRollup, DailyVisitRollup, DoctorRollup, DrugRollup)
+
+def age_bucket(age):
+    age = int(age)
+    for label, upper in AGE_BUCKETS:
+        if upper is None or age <= upper:
+            return label
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE, where a counter bump is a single statement
+UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+def _bump_many(model, key_column, deltas, session=None):
+    """
+    Add deltas ({key: {column: delta}}) to the counters of the rows identified
+    by key_column, creating the missing rows. One executemany upsert where the
+    dialect has one, otherwise an executemany UPDATE for the keys that have
+    rows and a single INSERT for the rest.
+    """
+    session = session or db.session
+    columns = sorted({column for counters in deltas.values() for column, delta in counters.items() if delta})
+    rows = [{key_column: key, **{column: counters.get(column, 0) for column in columns}}
+            for key, counters in deltas.items() if any(counters.get(column) for column in columns)]
+    if not rows:
+        return
+    table = model.__table__
+
+    upsert = UPSERT_INSERTS.get((session.bind or db.engine).dialect.name)
+    if upsert is not None:
+        statement = upsert(table)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=[key_column],
+            set_={column: table.c[column] + statement.excluded[column] for column in columns}
+        ), rows)
+        return
+
+    key = table.c[key_column]
+    existing = {value for (value,) in session.execute(db.select(key).where(key.in_([row[key_column] for row in rows])))}
+    if existing:
+        session.execute(
+            table.update()
+            .where(key == bindparam('b_key'))
+            .values({column: table.c[column] + bindparam(f'b_{column}') for column in columns}),
+            [{'b_key': row[key_column], **{f'b_{column}': row[column] for column in columns}}
+             for row in rows if row[key_column] in existing]
+        )
+    missing = [row for row in rows if row[key_column] not in existing]
+    if missing:
+        session.execute(table.insert(), missing)
+
+def _bump(model, key, **deltas):
+    """Add deltas to the counters of the row identified by key, creating it if needed"""
+    (key_column, value), = key.items()
+    _bump_many(model, key_column, {value: deltas})
+
+def record_patient(patient, sign=1):
+    _bump(MetricRollup, {'name': 'total_patients'}, value=sign)
+    _bump(MetricRollup, {'name': 'total_age'}, value=sign * int(patient.age))
+    _bump(AgeBucketRollup, {'bucket': age_bucket(patient.age)}, count=sign)
+
+def record_age_change(old_age, new_age):
+    if int(old_age) == int(new_age):
+        return
+    _bump(MetricRollup, {'name': 'total_age'}, value=int(new_age) - int(old_age))
+    if age_bucket(old_age) != age_bucket(new_age):
+        _bump_many(AgeBucketRollup, 'bucket', {age_bucket(old_age): {'count': -1}, age_bucket(new_age): {'count': 1}})
+
+def record_visit(visit, sign=1):
+    _bump(MetricRollup, {'name': 'total_visits'}, value=sign)
+    _bump(DailyVisitRollup, {'day': visit.visit_date.date()}, count=sign)
+    _bump(DoctorRollup, {'doctor_id': visit.doctor_id}, visits=sign)
+
+def record_prescription(prescription, sign=1):
+    _bump(MetricRollup, {'name': 'total_prescriptions'}, value=sign)
+    _bump(DoctorRollup, {'doctor_id': prescription.doctor_id}, prescriptions=sign)
+    _bump(DrugRollup, {'drug_name': prescription.drug_name}, count=sign)
+
+def _as_date(value):
+    # func.date() comes back as a string on SQLite and a date elsewhere
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def _aggregate(session):
+    """Grouped counts of all visits and prescriptions"""
+    visits = session.query(Visit)
+    prescriptions = session.query(Prescription)
+
+    day = func.date(Visit.visit_date)
+    return {
+        'daily_visits': {
+            _as_date(d): n for d, n in visits.with_entities(day, func.count()).group_by(day)
+        },
+        'doctor_visits': dict(
+            visits.with_entities(Visit.doctor_id, func.count()).group_by(Visit.doctor_id)
+        ),
+        'doctor_prescriptions': dict(
+            prescriptions.with_entities(Prescription.doctor_id, func.count()).group_by(Prescription.doctor_id)
+        ),
+        'drugs': dict(
+            prescriptions.with_entities(Prescription.drug_name, func.count()).group_by(Prescription.drug_name)
+        ),
+    }
+
+def _loaded_aggregate(patient):
+    """_aggregate() for one patient, from its visits and prescriptions (no queries once they are loaded)"""
+    daily, doctor_visits, doctor_prescriptions, drugs = Counter(), Counter(), Counter(), Counter()
+    for visit in patient.visits:
+        daily[visit.visit_date.date()] += 1
+        doctor_visits[visit.doctor_id] += 1
+    for prescription in patient.prescriptions:
+        doctor_prescriptions[prescription.doctor_id] += 1
+        drugs[prescription.drug_name] += 1
+    return {'daily_visits': daily, 'doctor_visits': doctor_visits,
+            'doctor_prescriptions': doctor_prescriptions, 'drugs': drugs}
+
+def _apply(aggregates, sign, metrics=None, session=None):
+    """Add (sign=1) or subtract aggregates, plus any other metric deltas: one statement per rollup table"""
+    doctors = {}
+    for column, counts in (('visits', aggregates['doctor_visits']), ('prescriptions', aggregates['doctor_prescriptions'])):
+        for doctor_id, n in counts.items():
+            doctors.setdefault(doctor_id, {})[column] = sign * n
+
+    _bump_many(DailyVisitRollup, 'day', {day: {'count': sign * n} for day, n in aggregates['daily_visits'].items()},
+               session)
+    _bump_many(DoctorRollup, 'doctor_id', doctors, session)
+    _bump_many(DrugRollup, 'drug_name', {drug: {'count': sign * n} for drug, n in aggregates['drugs'].items()},
+               session)
+    _bump_many(MetricRollup, 'name', {name: {'value': value} for name, value in {
+        'total_visits': sign * sum(aggregates['doctor_visits'].values()),
+        'total_prescriptions': sign * sum(aggregates['doctor_prescriptions'].values()),
+        **(metrics or {})
+    }.items()}, session)
+
+def forget_patient(patient):
+    """
+    Subtract a patient and everything that cascades with it; call before
+    deleting. Load patient.visits and patient.prescriptions first (the delete
+    route does, for the cascade) and this is one statement per rollup table.
+    """
+    _bump(AgeBucketRollup, {'bucket': age_bucket(patient.age)}, count=-1)
+    _apply(_loaded_aggregate(patient), sign=-1, metrics={'total_patients': -1, 'total_age': -int(patient.age)})
+
+def rebuild(session=None):
+    """Recompute every rollup from the base tables inside the current transaction (of db.session by default)"""
+    session = session or db.session
+    for model in ROLLUP_MODELS:
+        session.query(model).delete(synchronize_session=False)
+
+    patients = session.query(func.count(Patient.id), func.coalesce(func.sum(Patient.age), 0)).one()
+    buckets = Counter()
+    for age, n in session.query(Patient.age, func.count()).group_by(Patient.age):
+        buckets[age_bucket(age)] += n
+    _bump_many(AgeBucketRollup, 'bucket', {bucket: {'count': n} for bucket, n in buckets.items()}, session)
+    _apply(_aggregate(session), sign=1, metrics={'total_patients': patients[0], 'total_age': patients[1]},
+           session=session)
+
+def snapshot(days=None, top_drugs=5):
+    """Dashboard metrics read straight from the rollup tables"""
+    metrics = dict(db.session.query(MetricRollup.name, MetricRollup.value))
+    total_patients = metrics.get('total_patients', 0)
+    buckets = dict(db.session.query(AgeBucketRollup.bucket, AgeBucketRollup.count))
+
+    daily = db.session.query(DailyVisitRollup).filter(DailyVisitRollup.count > 0)
+    if days:
+        daily = daily.filter(DailyVisitRollup.day > date.today() - timedelta(days=days))
+    drugs = (db.session.query(DrugRollup)
+             .filter(DrugRollup.count > 0)
+             .order_by(DrugRollup.count.desc())
+             .limit(top_drugs))
+
+    return {
+        'total_patients': total_patients,
+        'average_age': round(metrics.get('total_age', 0) / total_patients, 2) if total_patients else 0,
+        'age_distribution': {label: buckets.get(label, 0) for label, _ in AGE_BUCKETS},
+        'total_visits': metrics.get('total_visits', 0),
+        'daily_visits': {row.day.isoformat(): row.count for row in daily.order_by(DailyVisitRollup.day)},
+        'total_prescriptions': metrics.get('total_prescriptions', 0),
+        'unique_drugs': db.session.query(func.count()).select_from(DrugRollup).filter(DrugRollup.count > 0).scalar(),
+        'most_prescribed_drugs': {row.drug_name: row.count for row in drugs},
+        'doctor_stats': {
+            row.doctor_id: {'visits': row.visits, 'prescriptions': row.prescriptions}
+            for row in db.session.query(DoctorRollup)
+        }
+    }
+
+def init_rollups(app):
+    @app.cli.group()
+    def rollups():
+        """Dashboard rollup maintenance."""
+
+    @rollups.command('rebuild')
+    def rebuild_command():
+        """Recompute all dashboard rollups from the base tables."""
+        rebuild()
+        db.session.commit()
+        click.echo("✅ Dashboard rollups rebuilt")
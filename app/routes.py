@@ -1,17 +1,24 @@
-from flask import request, jsonify, Blueprint, abort, current_app, session, render_template
+from flask import request, jsonify, Blueprint, abort, current_app, session, render_template, Response, stream_with_context, send_from_directory
 from app.models import Patient, Visit, Prescription, Report, User
 from app.hateoas import Hateoas
 from .app_extensions import db
+from sqlalchemy import BigInteger, cast, func
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import datetime
-from app.auth import login_required, create_session, get_current_user, logout, jwt_required
-from .cache_utils import cache_response, invalidate_cache
+from app.auth import login_required, admin_required, create_session, get_current_user, logout, jwt_required
+from .cache_utils import cache_response, invalidate_cache, wants_ndjson
+from . import rollups
+from .timing import query_budget
+from . import profiling
 import traceback
 import json
+import logging
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
 # Welcome route
 @bp.route('/', methods=['GET'])
+@query_budget(0)
 @cache_response(timeout=300)  # Cache welcome page for 5 minutes
 def welcome():
     return jsonify({
@@ -48,9 +55,27 @@ def handle_preflight():
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         return response
 
+# Let clients revalidate GET responses with If-None-Match instead of
+# downloading an unchanged body again
+@bp.after_request
+def add_conditional_headers(response):
+    if request.method == 'GET' and response.status_code == 200 and not response.is_streamed:
+        if not response.get_etag()[0]:
+            response.add_etag()
+        response = response.make_conditional(request)
+    return response
+
+def ndjson_response(query):
+    """Stream query results as newline-delimited JSON without loading them all at once"""
+    def generate():
+        for row in query.yield_per(1000):
+            yield json.dumps(row.to_dict()) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # ------------------- Auth Routes ------------------- #
 
 @bp.route('/login', methods=['POST'])
+@query_budget(1)
 def login():
     try:
         data = request.get_json()
@@ -77,11 +102,13 @@ def login():
         return jsonify({'error': f'Login failed: {str(e)}'}), 500
 
 @bp.route('/logout', methods=['POST'])
+@query_budget(0)
 @jwt_required()
 def logout_route():
     return jsonify({'message': 'Logged out successfully'}), 200
 
 @bp.route('/setup-doctors', methods=['POST'])
+@query_budget(7)
 def setup_doctors():
     try:
         # Check if doctors already exist
@@ -122,10 +149,13 @@ def setup_doctors():
 # ------------------- Patient Routes ------------------- #
 
 @bp.route('/patients', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_all_patients():
     try:
+        if wants_ndjson():
+            return ndjson_response(Patient.query)
         patients = Patient.query.all()
         return jsonify([patient.to_dict() for patient in patients])
     except Exception as e:
@@ -133,7 +163,16 @@ def get_all_patients():
         current_app.logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error'}), 500
 
+def parse_age(value):
+    """Age as a non-negative int (JSON numbers or numeric strings), or None if it isn't one"""
+    try:
+        age = int(value)
+    except (TypeError, ValueError):
+        return None
+    return age if age >= 0 and not isinstance(value, bool) else None
+
 @bp.route('/patients', methods=['POST'])
+@query_budget(5)
 @jwt_required()
 def create_patient():
     try:
@@ -144,13 +183,17 @@ def create_patient():
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
+        age = parse_age(data['age'])
+        if age is None:
+            return jsonify({'error': 'age must be a non-negative integer'}), 400
         
         new_patient = Patient(
             name=data['name'],
-            age=data['age'],
+            age=age,
             contact_info=data['contact_info']
         )
         db.session.add(new_patient)
+        rollups.record_patient(new_patient)
         db.session.commit()
         
         # Invalidate the patients list cache
@@ -166,6 +209,7 @@ def create_patient():
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/patients/<int:patient_id>', methods=['GET'])
+@query_budget(1)
 @login_required
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_patient(patient_id):
@@ -178,14 +222,21 @@ def get_patient(patient_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/patients/<int:patient_id>', methods=['PUT'])
+# Load, total_age and age bucket upserts, UPDATE, reload for the response
+@query_budget(5)
 @login_required
 def update_patient(patient_id):
     try:
         patient = Patient.query.get_or_404(patient_id)
         data = request.get_json()
+        old_age = patient.age
+        age = parse_age(data['age']) if 'age' in data else patient.age
+        if age is None:
+            return jsonify({'error': 'age must be a non-negative integer'}), 400
         patient.name = data.get('name', patient.name)
-        patient.age = data.get('age', patient.age)
+        patient.age = age
         patient.contact_info = data.get('contact_info', patient.contact_info)
+        rollups.record_age_change(old_age, patient.age)
         db.session.commit()
         
         # Invalidate cache for this patient and patient list
@@ -201,10 +252,20 @@ def update_patient(patient_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/patients/<int:patient_id>', methods=['DELETE'])
+# Patient plus 4 selectin loads, one rollup upsert per rollup table (5), and
+# one DELETE each for prescriptions, visits, reports and the patient
+@query_budget(14)
 @login_required
 def delete_patient(patient_id):
     try:
-        patient = Patient.query.get_or_404(patient_id)
+        # Load everything the delete cascades to up front, rather than one
+        # query per visit to detach its prescriptions
+        patient = (Patient.query
+                   .options(selectinload(Patient.visits).selectinload(Visit.prescriptions),
+                            selectinload(Patient.prescriptions),
+                            selectinload(Patient.reports))
+                   .get_or_404(patient_id))
+        rollups.forget_patient(patient)
         db.session.delete(patient)
         db.session.commit()
     except Exception as e:
@@ -221,11 +282,14 @@ def delete_patient(patient_id):
     return jsonify({'message': 'Patient deleted'})
 
 @bp.route('/patients/<int:patient_id>/visits', methods=['GET'])
+@query_budget(2)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_patient_visits(patient_id):
     try:
-        visits = Visit.query.filter_by(patient_id=patient_id).all()
+        visits = (Visit.query.filter_by(patient_id=patient_id)
+                  .options(joinedload(Visit.doctor), selectinload(Visit.prescriptions))
+                  .all())
         return jsonify([{
             'visit_id': visit.visit_id,
             'visit_date': visit.visit_date.isoformat(),
@@ -243,11 +307,14 @@ def get_patient_visits(patient_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/patients/<int:patient_id>/prescriptions', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_patient_prescriptions(patient_id):
     try:
-        prescriptions = Prescription.query.filter_by(patient_id=patient_id).all()
+        prescriptions = (Prescription.query.filter_by(patient_id=patient_id)
+                         .options(joinedload(Prescription.visit), joinedload(Prescription.prescribing_doctor))
+                         .all())
         return jsonify([{
             'prescription_id': p.prescription_id,
             'drug_name': p.drug_name,
@@ -261,6 +328,7 @@ def get_patient_prescriptions(patient_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/patients/<int:patient_id>/reports', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_patient_reports(patient_id):
@@ -279,10 +347,11 @@ def get_patient_reports(patient_id):
 # ------------------- Visit Routes ------------------- #
 
 @bp.route('/visits/<int:visit_id>', methods=['GET'])
+@query_budget(1)
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_visit(visit_id):
     hateoas = Hateoas(request.host_url)
-    visit = Visit.query.get_or_404(visit_id)
+    visit = Visit.query.options(joinedload(Visit.doctor)).get_or_404(visit_id)
     return jsonify({
         "data": {
             "date": visit.visit_date.isoformat(),
@@ -293,12 +362,13 @@ def get_visit(visit_id):
     })
 
 @bp.route('/visits', methods=['POST'])
+@query_budget(8)
 @jwt_required()
 def create_visit():
     try:
         # Log the raw request data for debugging
         raw_data = request.get_data().decode('utf-8', errors='replace')
-        current_app.logger.debug(f"Raw request data: {raw_data}")
+        current_app.logger.debug("Raw request data: %s", raw_data)
         
         # Clean the data by removing any BOM, special characters, and normalizing line endings
         cleaned_data = raw_data.replace('\ufeff', '').replace('\r\n', '\n').strip()
@@ -345,10 +415,11 @@ def create_visit():
             return jsonify({'error': f'Doctor with ID {data["doctor_id"]} not found'}), 404
 
         # Debug the diagnosis value
-        current_app.logger.debug(f"Original diagnosis: '{data['diagnosis']}'")
-        current_app.logger.debug(f"Diagnosis type: {type(data['diagnosis'])}")
-        current_app.logger.debug(f"Diagnosis length: {len(data['diagnosis'])}")
-        current_app.logger.debug(f"Diagnosis characters: {[ord(c) for c in data['diagnosis']]}")
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug(f"Original diagnosis: '{data['diagnosis']}'")
+            current_app.logger.debug(f"Diagnosis type: {type(data['diagnosis'])}")
+            current_app.logger.debug(f"Diagnosis length: {len(data['diagnosis'])}")
+            current_app.logger.debug(f"Diagnosis characters: {[ord(c) for c in data['diagnosis']]}")
 
         # Ensure diagnosis is properly formatted
         diagnosis = data['diagnosis'].strip()
@@ -356,10 +427,11 @@ def create_visit():
             return jsonify({'error': 'Diagnosis cannot be empty'}), 400
 
         # Debug the cleaned diagnosis value
-        current_app.logger.debug(f"Cleaned diagnosis: '{diagnosis}'")
-        current_app.logger.debug(f"Cleaned diagnosis type: {type(diagnosis)}")
-        current_app.logger.debug(f"Cleaned diagnosis length: {len(diagnosis)}")
-        current_app.logger.debug(f"Cleaned diagnosis characters: {[ord(c) for c in diagnosis]}")
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug(f"Cleaned diagnosis: '{diagnosis}'")
+            current_app.logger.debug(f"Cleaned diagnosis type: {type(diagnosis)}")
+            current_app.logger.debug(f"Cleaned diagnosis length: {len(diagnosis)}")
+            current_app.logger.debug(f"Cleaned diagnosis characters: {[ord(c) for c in diagnosis]}")
 
         # Create visit with current timestamp
         visit = Visit(
@@ -369,13 +441,15 @@ def create_visit():
             diagnosis=diagnosis  # Use the properly formatted diagnosis
         )
         db.session.add(visit)
+        rollups.record_visit(visit)
         db.session.commit()
 
         # Debug the stored diagnosis value
-        current_app.logger.debug(f"Stored diagnosis: '{visit.diagnosis}'")
-        current_app.logger.debug(f"Stored diagnosis type: {type(visit.diagnosis)}")
-        current_app.logger.debug(f"Stored diagnosis length: {len(visit.diagnosis)}")
-        current_app.logger.debug(f"Stored diagnosis characters: {[ord(c) for c in visit.diagnosis]}")
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug(f"Stored diagnosis: '{visit.diagnosis}'")
+            current_app.logger.debug(f"Stored diagnosis type: {type(visit.diagnosis)}")
+            current_app.logger.debug(f"Stored diagnosis length: {len(visit.diagnosis)}")
+            current_app.logger.debug(f"Stored diagnosis characters: {[ord(c) for c in visit.diagnosis]}")
 
         # Invalidate caches
         invalidate_cache(
@@ -397,10 +471,11 @@ def create_visit():
         }
 
         # Debug the response data
-        current_app.logger.debug(f"Response diagnosis: '{response_data['visit']['diagnosis']}'")
-        current_app.logger.debug(f"Response diagnosis type: {type(response_data['visit']['diagnosis'])}")
-        current_app.logger.debug(f"Response diagnosis length: {len(response_data['visit']['diagnosis'])}")
-        current_app.logger.debug(f"Response diagnosis characters: {[ord(c) for c in response_data['visit']['diagnosis']]}")
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug(f"Response diagnosis: '{response_data['visit']['diagnosis']}'")
+            current_app.logger.debug(f"Response diagnosis type: {type(response_data['visit']['diagnosis'])}")
+            current_app.logger.debug(f"Response diagnosis length: {len(response_data['visit']['diagnosis'])}")
+            current_app.logger.debug(f"Response diagnosis characters: {[ord(c) for c in response_data['visit']['diagnosis']]}")
 
         return jsonify(response_data), 201
     except Exception as e:
@@ -410,11 +485,22 @@ def create_visit():
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @bp.route('/visits', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_all_visits():
     try:
-        visits = Visit.query.all()
+        query = Visit.query.options(joinedload(Visit.doctor))
+        # Optional window filter, e.g. ?since=2025-01-01T00:00:00
+        since = request.args.get('since')
+        if since:
+            try:
+                query = query.filter(Visit.visit_date >= datetime.fromisoformat(since))
+            except ValueError:
+                return jsonify({'error': f'Invalid since parameter: {since}'}), 400
+        if wants_ndjson():
+            return ndjson_response(query)
+        visits = query.all()
         return jsonify([{
             'visit_id': visit.visit_id,
             'patient_id': visit.patient_id,
@@ -428,14 +514,55 @@ def get_all_visits():
         current_app.logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error'}), 500
 
+# Whole seconds since the epoch of a naive DateTime column, per dialect
+EPOCH_SECONDS = {
+    'sqlite': lambda column: cast(func.strftime('%s', column), BigInteger),
+    'postgresql': lambda column: cast(func.extract('epoch', column), BigInteger),
+}
+
+@bp.route('/visits/timeline', methods=['GET'])
+@query_budget(1)
+@jwt_required()
+def get_visit_timeline():
+    """
+    patient_id and visit_time (seconds since the epoch) of every visit, as a
+    streamed CSV: a compact columnar export for the analytics service's
+    revisit and cohort reports, which need nothing else from a visit.
+    """
+    to_seconds = EPOCH_SECONDS.get(db.engine.dialect.name)
+    if to_seconds is not None:
+        query = db.session.query(Visit.patient_id, to_seconds(Visit.visit_date))
+    else:
+        query = db.session.query(Visit.patient_id, Visit.visit_date)
+    epoch = datetime(1970, 1, 1)
+
+    def generate():
+        yield 'patient_id,visit_time\n'
+        lines = []
+        for patient_id, visit_time in query.yield_per(5000):
+            if to_seconds is None:
+                visit_time = int((visit_time - epoch).total_seconds())
+            lines.append(f'{patient_id},{visit_time}\n')
+            if len(lines) == 5000:
+                yield ''.join(lines)
+                lines = []
+        yield ''.join(lines)
+    return Response(stream_with_context(generate()), mimetype='text/csv')
+
 # ------------------- Prescription Routes ------------------- #
 
+# Prescription.to_dict() reads the doctor and the visit; load them in the same query
+PRESCRIPTION_LOADS = (joinedload(Prescription.prescribing_doctor), joinedload(Prescription.visit))
+
 @bp.route('/prescriptions', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_all_prescriptions():
     try:
-        prescriptions = Prescription.query.all()
+        if wants_ndjson():
+            return ndjson_response(Prescription.query.options(*PRESCRIPTION_LOADS))
+        prescriptions = Prescription.query.options(*PRESCRIPTION_LOADS).all()
         return jsonify([prescription.to_dict() for prescription in prescriptions])
     except Exception as e:
         current_app.logger.error(f"Error getting prescriptions: {str(e)}")
@@ -443,10 +570,11 @@ def get_all_prescriptions():
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/prescriptions/<int:prescription_id>', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 def get_prescription_by_id(prescription_id):
     try:
-        prescription = Prescription.query.get_or_404(prescription_id)
+        prescription = Prescription.query.options(*PRESCRIPTION_LOADS).get_or_404(prescription_id)
         return jsonify(prescription.to_dict())
     except Exception as e:
         current_app.logger.error(f"Error fetching prescription: {str(e)}")
@@ -454,12 +582,13 @@ def get_prescription_by_id(prescription_id):
 
       
 @bp.route('/prescriptions', methods=['POST'])
+@query_budget(13)
 @jwt_required()
 def create_prescription():
     try:
         # Log the raw request data for debugging
         raw_data = request.get_data().decode('utf-8', errors='replace')
-        current_app.logger.debug(f"Raw request data: {raw_data}")
+        current_app.logger.debug("Raw request data: %s", raw_data)
         
         # Clean the data by removing any BOM, special characters, and normalizing line endings
         cleaned_data = raw_data.replace('\ufeff', '').replace('\r\n', '\n').strip()
@@ -526,6 +655,8 @@ def create_prescription():
                 duration=data['duration']
             )
             db.session.add(prescription)
+            rollups.record_visit(visit)
+            rollups.record_prescription(prescription)
             db.session.commit()
 
             # Invalidate caches
@@ -562,9 +693,24 @@ def create_prescription():
         current_app.logger.error(traceback.format_exc())
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+# ------------------- Dashboard Routes ------------------- #
+
+@bp.route('/dashboard/stats', methods=['GET'])
+@query_budget(6)
+@jwt_required()
+def get_dashboard_stats():
+    try:
+        days = request.args.get('days', type=int)
+        return jsonify(rollups.snapshot(days=days))
+    except Exception as e:
+        current_app.logger.error(f"Error getting dashboard stats: {str(e)}")
+        current_app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 # ------------------- Report Routes ------------------- #
 
 @bp.route('/reports', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_all_reports():
@@ -577,6 +723,7 @@ def get_all_reports():
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/reports', methods=['POST'])
+@query_budget(2)
 @jwt_required()
 def create_report():
     try:
@@ -620,6 +767,7 @@ def create_report():
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/reports/<int:report_id>', methods=['DELETE'])
+@query_budget(2)
 @jwt_required()
 def delete_report(report_id):
     try:
@@ -640,6 +788,7 @@ def delete_report(report_id):
 
     return jsonify({'message': 'Report deleted successfully'})
 @bp.route('/reports/<int:report_id>', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 @cache_response(timeout=60)  # Cache for 1 minute
 def get_report(report_id):
@@ -655,3 +804,38 @@ def get_report(report_id):
         current_app.logger.error(f"Error getting report: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+# ------------------- Admin Routes ------------------- #
+
+@bp.route('/admin/profiles', methods=['GET'])
+@query_budget(1)
+@admin_required
+def list_profiles():
+    """Saved profiler captures (see app/profiling.py), newest first"""
+    return jsonify({
+        'enabled': current_app.config.get('PROFILER_ENABLED', False),
+        'captures': profiling.list_captures(current_app.config['PROFILER_DIR'])
+    })
+
+@bp.route('/admin/profiles/<name>', methods=['GET'])
+@query_budget(1)
+@admin_required
+def download_profile(name):
+    if not profiling.is_capture_name(name):
+        return jsonify({'error': 'Invalid capture name'}), 400
+    return send_from_directory(current_app.config['PROFILER_DIR'], name,
+                               mimetype='text/plain', as_attachment=True)
+
+@bp.route('/admin/slow-queries', methods=['GET'])
+@query_budget(1)
+@admin_required
+def list_slow_queries():
+    """Slow statements grouped by fingerprint, most total time first (see app/slow_queries.py)"""
+    log = current_app.extensions.get('slow_queries')
+    if log is None:
+        return jsonify({'enabled': False, 'queries': []})
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({
+        'enabled': True,
+        'threshold_ms': log.threshold_ms,
+        'queries': log.top(max(1, min(limit, 200)))
+    })
@@ -0,0 +1,161 @@
+"""
+Slow-query log.
+
+init_slow_queries(app) times every SQL statement and, for those slower
+than SLOW_QUERY_MS (0 disables the log and registers no listeners):
+
+- logs a JSON line on the `app.slow_queries` logger with the statement
+  normalized (literals replaced by ?) and the bound parameters redacted
+  to their types, so no patient data reaches the logs
+- groups it under a fingerprint of the normalized statement, keeping
+  count, total and max time per fingerprint (at most
+  SLOW_QUERY_MAX_FINGERPRINTS, the lowest total time is dropped first)
+- captures the query plan the first time a fingerprint is seen:
+  EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL. A `SCAN` of a
+  large table in the plan usually means a missing index.
+
+Admins see the top offenders by total time at /api/admin/slow-queries.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from time import perf_counter
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy.engine import Engine
+from app.database import listen_once
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIX = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN '
+}
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s)(?:\s*,\s*(?:\?|%\(\w+\)s|%s))*\s*\)')
+_SPACES = re.compile(r'\s+')
+
+def normalize_statement(statement):
+    """Statement with literals replaced by ? and IN lists collapsed, for grouping"""
+    shape = _LITERALS.sub('?', statement)
+    shape = _IN_LISTS.sub('(?)', shape)
+    return _SPACES.sub(' ', shape).strip()
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+def redact(parameters, executemany=False):
+    """Parameter types instead of values"""
+    if executemany:
+        return f'<{len(parameters)} rows>'
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms, max_fingerprints=200, explain=True):
+        self.threshold_ms = threshold_ms
+        self.max_fingerprints = max_fingerprints
+        self.explain = explain
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, conn, cursor, statement, parameters, executemany, duration_ms):
+        normalized = normalize_statement(statement)
+        key = fingerprint(normalized)
+        with self._lock:
+            stats = self._stats.get(key)
+            is_new = stats is None
+            if is_new:
+                if len(self._stats) >= self.max_fingerprints:
+                    del self._stats[min(self._stats, key=lambda k: self._stats[k]['total_ms'])]
+                stats = self._stats[key] = {
+                    'fingerprint': key,
+                    'statement': normalized,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'plan': None
+                }
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['last_seen'] = time.time()
+
+        plan = None
+        if is_new and self.explain and not executemany:
+            plan = explain(conn, cursor, statement, parameters)
+            with self._lock:
+                stats['plan'] = plan
+
+        logger.warning(json.dumps({
+            'event': 'slow_query',
+            'fingerprint': key,
+            'duration_ms': round(duration_ms, 2),
+            'statement': normalized,
+            'parameters': redact(parameters, executemany),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'plan': plan
+        }))
+
+    def top(self, limit=20):
+        """Fingerprints with the most total time spent, slowest first"""
+        with self._lock:
+            entries = sorted(self._stats.values(), key=lambda stats: stats['total_ms'], reverse=True)[:limit]
+            return [dict(stats, total_ms=round(stats['total_ms'], 2), max_ms=round(stats['max_ms'], 2),
+                         avg_ms=round(stats['total_ms'] / stats['count'], 2))
+                    for stats in entries]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+def explain(conn, cursor, statement, parameters):
+    """Query plan rows as strings, or None for statements and databases we don't explain"""
+    prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    # A raw DBAPI cursor, so the EXPLAIN itself is not timed or logged
+    plan_cursor = cursor.connection.cursor()
+    try:
+        plan_cursor.execute(prefix + statement, parameters)
+        rows = plan_cursor.fetchall()
+    except Exception as e:
+        return [f'EXPLAIN failed: {str(e)}']
+    finally:
+        plan_cursor.close()
+    if conn.dialect.name == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+def current_log():
+    return current_app.extensions.get('slow_queries') if has_app_context() else None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_log() is not None:
+        conn.info.setdefault('_slow_query_started', []).append(perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = current_log()
+    started = conn.info.get('_slow_query_started')
+    if log is None or not started:
+        return
+    duration_ms = (perf_counter() - started.pop()) * 1000
+    if duration_ms >= log.threshold_ms:
+        log.record(conn, cursor, statement, parameters, executemany, duration_ms)
+
+def init_slow_queries(app):
+    threshold_ms = float(app.config.get('SLOW_QUERY_MS', 0))
+    if threshold_ms <= 0:
+        return
+    app.extensions['slow_queries'] = SlowQueryLog(
+        threshold_ms,
+        max_fingerprints=int(app.config.get('SLOW_QUERY_MAX_FINGERPRINTS', 200)),
+        explain=app.config.get('SLOW_QUERY_EXPLAIN', True)
+    )
+    listen_once(Engine, ('before_cursor_execute', _before_cursor_execute),
+                ('after_cursor_execute', _after_cursor_execute))
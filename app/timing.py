@@ -0,0 +1,142 @@
+"""
+Per-request performance instrumentation.
+
+init_timing(app) times a sample of requests (SERVER_TIMING_SAMPLE_RATE)
+without touching the route handlers:
+
+- db: time and number of queries, from SQLAlchemy cursor events
+- cache: time spent in cache get/set/delete (see cache_utils)
+- serialize: time spent encoding JSON responses
+- total: from the start of the request until the response is ready
+
+Sampled requests get a Server-Timing header (unless SERVER_TIMING_HEADER
+is off) and a structured JSON log line on the `app.timing` logger.
+Streamed responses are measured up to the point where streaming starts.
+
+Routes declare the most queries they should need with @query_budget(n).
+Sampled requests over budget are logged as warnings; the test suite fails
+on them (see app_tests/query_budget.py).
+"""
+import json
+import logging
+import random
+from contextlib import contextmanager
+from time import perf_counter
+from flask import current_app, g, has_app_context, request
+from sqlalchemy.engine import Engine
+from app.database import listen_once
+
+logger = logging.getLogger(__name__)
+
+class RequestTiming:
+    __slots__ = ('started', 'db_ms', 'db_queries', 'cache_ms', 'cache_ops', 'serialize_ms')
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.db_ms = 0.0
+        self.db_queries = 0
+        self.cache_ms = 0.0
+        self.cache_ops = 0
+        self.serialize_ms = 0.0
+
+def current_timing():
+    """The RequestTiming of the current request, or None when it is not sampled"""
+    return g.get('_request_timing') if has_app_context() else None
+
+@contextmanager
+def measure(kind):
+    """Add the time spent in the block to the current request's `kind` ('cache' or 'serialize')"""
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (perf_counter() - started) * 1000
+        if kind == 'cache':
+            timing.cache_ms += elapsed
+            timing.cache_ops += 1
+        else:
+            timing.serialize_ms += elapsed
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_timing() is not None:
+        conn.info.setdefault('_timing_started', []).append(perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing()
+    started = conn.info.get('_timing_started')
+    if timing is not None and started:
+        timing.db_ms += (perf_counter() - started.pop()) * 1000
+        timing.db_queries += 1
+
+def query_budget(max_queries):
+    """
+    Declare how many SQL statements a route may run per request. Place it
+    directly under @bp.route so the registered view carries the budget.
+    """
+    def decorator(f):
+        f.query_budget = max_queries
+        return f
+    return decorator
+
+def server_timing_header(timing, total_ms):
+    return ', '.join((
+        f'db;dur={timing.db_ms:.2f};desc="{timing.db_queries} queries"',
+        f'cache;dur={timing.cache_ms:.2f};desc="{timing.cache_ops} ops"',
+        f'serialize;dur={timing.serialize_ms:.2f}',
+        f'total;dur={total_ms:.2f}'
+    ))
+
+def init_timing(app):
+    listen_once(Engine, ('before_cursor_execute', _before_cursor_execute),
+                ('after_cursor_execute', _after_cursor_execute))
+
+    class TimedJSONEncoder(app.json_encoder):
+        def encode(self, o):
+            with measure('serialize'):
+                return super().encode(o)
+
+    app.json_encoder = TimedJSONEncoder
+
+    @app.before_request
+    def start_timing():
+        sample_rate = float(current_app.config.get('SERVER_TIMING_SAMPLE_RATE', 1.0))
+        if sample_rate >= 1 or random.random() < sample_rate:
+            g._request_timing = RequestTiming()
+
+    @app.after_request
+    def finish_timing(response):
+        timing = g.pop('_request_timing', None)
+        if timing is None:
+            return response
+        total_ms = (perf_counter() - timing.started) * 1000
+
+        if current_app.config.get('SERVER_TIMING_HEADER', True):
+            response.headers['Server-Timing'] = server_timing_header(timing, total_ms)
+        logger.info(json.dumps({
+            'event': 'request_timing',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'db_ms': round(timing.db_ms, 2),
+            'db_queries': timing.db_queries,
+            'cache_ms': round(timing.cache_ms, 2),
+            'cache_ops': timing.cache_ops,
+            'serialize_ms': round(timing.serialize_ms, 2)
+        }))
+
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None and timing.db_queries > budget:
+            logger.warning(json.dumps({
+                'event': 'query_budget_exceeded',
+                'endpoint': request.endpoint,
+                'db_queries': timing.db_queries,
+                'query_budget': budget
+            }))
+        return response
@@ -0,0 +1,114 @@
+"""
+Shared fixtures for the pytest suites.
+
+`app` is create_app('testing') on a fresh SQLite file, seeded with the
+doctor dr_smith (user 1), the admin root (user 2) and the patient Alice
+(patient 1), with the dashboard rollups rebuilt to match. Extra config
+comes from the `app_config` fixture: override it in a module, or
+parametrize it per test:
+
+    @pytest.mark.parametrize('app_config', [{'SERVER_TIMING_SAMPLE_RATE': 0.0}])
+    def test_something(client): ...
+
+`make_app` builds unseeded apps (tables only, or not even those) for tests
+that need an empty database or several of them.
+
+`log_records(name)` collects what a logger emits, like pytest's caplog but
+for one logger.
+"""
+import logging
+import os
+import sys
+
+# Make 'app' and 'benchmarks' importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from flask_jwt_extended import create_access_token
+from app import create_app, rollups
+from app.app_extensions import db
+from app.models import User, Patient
+
+# Password of the seeded users
+PASSWORD = 'password123'
+
+@pytest.fixture
+def make_app(tmp_path):
+    """
+    make_app(name='app.db', create_tables=True, **config): a testing app on
+    tmp_path/name (config may set SQLALCHEMY_DATABASE_URI instead)
+    """
+    def make_app(name='app.db', create_tables=True, **config):
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / name}'
+        app.config.update(config)
+        if create_tables:
+            with app.app_context():
+                db.create_all()
+        return app
+    return make_app
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def log_records():
+    """log_records(name, level=logging.INFO): the list of records the named logger emits during the test"""
+    attached = []
+
+    def log_records(name, level=logging.INFO):
+        handler = ListHandler()
+        logger = logging.getLogger(name)
+        attached.append((logger, handler, logger.level))
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        return handler.records
+
+    yield log_records
+    for logger, handler, level in attached:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+@pytest.fixture
+def app_config():
+    """Extra config for `app`"""
+    return {}
+
+@pytest.fixture
+def app(make_app, app_config):
+    app = make_app(**app_config)
+    with app.app_context():
+        tokens = {}
+        for username, role in (('dr_smith', 'doctor'), ('root', 'admin')):
+            user = User(username=username, role=role)
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.flush()
+            tokens[role] = create_access_token(identity=str(user.user_id))
+        db.session.add(Patient(name='Alice', age=30, contact_info='alice@example.com'))
+        db.session.flush()
+        rollups.rebuild()
+        db.session.commit()
+    app.config['TEST_TOKEN'] = tokens['doctor']
+    app.config['ADMIN_TOKEN'] = tokens['admin']
+    return app
+
+@pytest.fixture
+def auth_headers(app):
+    return {'Authorization': f"Bearer {app.config['TEST_TOKEN']}"}
+
+@pytest.fixture
+def admin_headers(app):
+    return {'Authorization': f"Bearer {app.config['ADMIN_TOKEN']}"}
+
+@pytest.fixture
+def client(app):
+    """Test client authenticated as dr_smith"""
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {app.config['TEST_TOKEN']}"
+    return client
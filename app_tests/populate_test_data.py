@@ -61,19 +61,19 @@ def populate_test_data():
         print("Creating visits...")
         visits = [
             Visit(
-                patient_id=patients[0].patient_id,
+                patient_id=patients[0].id,
                 doctor_id=doctors[0].user_id,
                 visit_date=datetime(2023, 1, 1),
                 diagnosis='Common cold'
             ),
             Visit(
-                patient_id=patients[1].patient_id,
+                patient_id=patients[1].id,
                 doctor_id=doctors[1].user_id,
                 visit_date=datetime(2023, 1, 2),
                 diagnosis='Flu'
             ),
             Visit(
-                patient_id=patients[2].patient_id,
+                patient_id=patients[2].id,
                 doctor_id=doctors[2].user_id,
                 visit_date=datetime(2023, 1, 3),
                 diagnosis='Headache'
@@ -89,28 +89,28 @@ def populate_test_data():
         print("Creating prescriptions...")
         prescriptions = [
             Prescription(
-                patient_id=patients[0].patient_id,
+                patient_id=patients[0].id,
                 doctor_id=doctors[0].user_id,
                 visit_id=visits[0].visit_id,
                 drug_name='Aspirin',
                 dosage='500mg',
-                duration='3 days'
+                duration=3  # days
             ),
             Prescription(
-                patient_id=patients[1].patient_id,
+                patient_id=patients[1].id,
                 doctor_id=doctors[1].user_id,
                 visit_id=visits[1].visit_id,
                 drug_name='Tamiflu',
                 dosage='75mg',
-                duration='5 days'
+                duration=5  # days
             ),
             Prescription(
-                patient_id=patients[2].patient_id,
+                patient_id=patients[2].id,
                 doctor_id=doctors[2].user_id,
                 visit_id=visits[2].visit_id,
                 drug_name='Ibuprofen',
                 dosage='400mg',
-                duration='2 days'
+                duration=2  # days
             )
         ]
         
@@ -123,17 +123,17 @@ def populate_test_data():
         print("Creating reports...")
         reports = [
             Report(
-                patient_id=patients[0].patient_id,
+                patient_id=patients[0].id,
                 report_type='Blood Test',
                 report_data='Normal blood count'
             ),
             Report(
-                patient_id=patients[1].patient_id,
+                patient_id=patients[1].id,
                 report_type='X-Ray',
                 report_data='Clear chest X-ray'
             ),
             Report(
-                patient_id=patients[2].patient_id,
+                patient_id=patients[2].id,
                 report_type='MRI',
                 report_data='No abnormalities detected'
             )
@@ -0,0 +1,85 @@
+"""
+Query budget enforcement for route tests.
+
+BudgetedClient is a Flask test client that records the SQL statements each
+request runs (through SQLAlchemy's before_cursor_execute event) and fails
+with QueryBudgetExceeded when:
+
+- the route runs more statements than its declared @query_budget, or
+- the same statement shape (literals and bound values stripped) runs more
+  than MAX_REPEATED_SHAPE times, the usual N+1 signature, or
+- an /api route declares no budget at all.
+
+Use it by setting `app.test_client_class = BudgetedClient` before creating
+the client.
+"""
+from collections import Counter
+from flask import request
+from flask.signals import request_started
+from flask.testing import FlaskClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.slow_queries import normalize_statement as statement_shape
+
+# More executions than this of one statement shape in a request is treated as N+1
+MAX_REPEATED_SHAPE = 3
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryRecorder:
+    """Context manager recording every statement executed on any engine"""
+
+    def __init__(self):
+        self.statements = []
+        self.endpoint = None
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def _request_started(self, sender, **extra):
+        self.endpoint = request.endpoint
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+
+    def repeated_shapes(self, limit=MAX_REPEATED_SHAPE):
+        counts = Counter(statement_shape(statement) for statement in self.statements)
+        return {shape: count for shape, count in counts.items() if count > limit}
+
+def check_budget(app, recorder):
+    """Raise QueryBudgetExceeded if the recorded request broke its route's budget"""
+    endpoint = recorder.endpoint
+    if endpoint is None or endpoint not in app.view_functions:
+        return
+    budget = getattr(app.view_functions[endpoint], 'query_budget', None)
+    if budget is None:
+        if endpoint.startswith('api.'):
+            raise QueryBudgetExceeded(f"{endpoint} declares no @query_budget")
+        return
+
+    problems = []
+    if len(recorder.statements) > budget:
+        problems.append(f"{len(recorder.statements)} queries, budget is {budget}")
+    for shape, count in recorder.repeated_shapes().items():
+        problems.append(f"possible N+1: {count}x {shape}")
+    if problems:
+        listing = '\n  '.join(recorder.statements)
+        raise QueryBudgetExceeded(f"{endpoint}: {'; '.join(problems)}\nStatements:\n  {listing}")
+
+class BudgetedClient(FlaskClient):
+    """Test client that checks every request against its route's query budget"""
+
+    def open(self, *args, **kwargs):
+        recorder = QueryRecorder()
+        with recorder, request_started.connected_to(recorder._request_started, self.application):
+            response = super().open(*args, **kwargs)
+            # Streamed bodies (NDJSON) run their queries while they are read
+            if response.is_streamed:
+                response.make_sequence()
+        check_budget(self.application, recorder)
+        return response
@@ -0,0 +1,144 @@
+import time
+
+import pytest
+from app import auth
+from app.app_extensions import db
+from app.auth import login_required, current_identity, load_user, IdentityCache, CachedUser
+from app.models import User, Patient, Visit
+from flask_jwt_extended import create_access_token, decode_token
+
+HANDLER_SECONDS = 0.1
+
+@pytest.fixture
+def app(app):
+    calls = app.config['HANDLER_CALLS'] = []
+
+    @app.route('/counted')
+    @login_required
+    def counted():
+        calls.append(current_identity())
+        return {'calls': len(calls)}
+
+    @app.route('/slow')
+    @login_required
+    def slow():
+        time.sleep(HANDLER_SECONDS)
+        return {}
+
+    @app.route('/broken')
+    @login_required
+    def broken():
+        calls.append('broken')
+        raise RuntimeError('boom')
+
+    with app.app_context():
+        db.session.add(Visit(patient_id=1, doctor_id=1, diagnosis='Flu'))
+        db.session.commit()
+    return app
+
+def test_handler_runs_once_per_request(app, auth_headers):
+    client = app.test_client()
+    response = client.get('/counted', headers=auth_headers)
+    assert response.status_code == 200
+    assert app.config['HANDLER_CALLS'] == ['1']
+
+def test_token_is_verified_once_per_request(app, monkeypatch, auth_headers):
+    verified = []
+    verify = auth.verify_jwt_in_request
+    monkeypatch.setattr(auth, 'verify_jwt_in_request', lambda: verified.append(1) or verify())
+
+    @app.route('/twice')
+    @login_required
+    def twice():
+        return {'identity': [current_identity(), current_identity()]}
+
+    response = app.test_client().get('/twice', headers=auth_headers)
+    assert response.get_json() == {'identity': ['1', '1']}
+    assert verified == [1]
+
+def test_missing_or_bad_token_skips_the_handler(app):
+    client = app.test_client()
+    assert client.get('/counted').status_code == 401
+    assert client.get('/counted', headers={'Authorization': 'Bearer not-a-token'}).status_code == 401
+    assert app.config['HANDLER_CALLS'] == []
+
+def test_handler_errors_are_not_reported_as_authentication_errors(app, auth_headers):
+    response = app.test_client().get('/broken', headers=auth_headers)
+    assert response.status_code == 500
+    assert app.config['HANDLER_CALLS'] == ['broken']
+
+def test_latency_is_one_handler_run(app, auth_headers):
+    client = app.test_client()
+    client.get('/slow', headers=auth_headers)
+    started = time.perf_counter()
+    assert client.get('/slow', headers=auth_headers).status_code == 200
+    # Running the handler twice took at least 2 x HANDLER_SECONDS
+    assert time.perf_counter() - started < 1.5 * HANDLER_SECONDS
+
+def test_delete_patient_runs_once(app, auth_headers):
+    client = app.test_client()
+    response = client.delete('/api/patients/1', headers=auth_headers)
+    assert response.status_code == 200
+    with app.app_context():
+        assert Patient.query.count() == 0
+        assert Visit.query.count() == 0
+
+def test_login_token_carries_the_role_claim(app):
+    response = app.test_client().post('/api/login', json={'username': 'dr_smith', 'password': 'password123'})
+    with app.app_context():
+        claims = decode_token(response.get_json()['access_token'])
+    assert (claims['sub'], claims['role']) == ('1', 'doctor')
+
+def test_admin_routes_authorize_from_the_claim(app):
+    with app.app_context():
+        tokens = {role: create_access_token(identity='2', additional_claims={'role': role})
+                  for role in ('admin', 'doctor')}
+    client = app.test_client()
+    response = client.get('/api/admin/slow-queries', headers={'Authorization': f"Bearer {tokens['admin']}"})
+    assert response.status_code == 200
+    assert 'desc="0 queries"' in response.headers['Server-Timing']
+    # The claim decides, not the user record (user 2 is an admin)
+    response = client.get('/api/admin/slow-queries', headers={'Authorization': f"Bearer {tokens['doctor']}"})
+    assert response.status_code == 403
+
+def test_tokens_without_a_role_claim_fall_back_to_the_user(app, auth_headers):
+    with app.app_context():
+        token = create_access_token(identity='2')
+    response = app.test_client().get('/api/admin/slow-queries', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert app.config['HANDLER_CALLS'] == []
+    assert app.test_client().get('/api/admin/slow-queries', headers=auth_headers).status_code == 403
+
+def test_current_user_is_cached_until_the_user_changes(app):
+    cache = app.extensions['identity_cache']
+    with app.app_context():
+        assert load_user(1) == CachedUser(1, 'dr_smith', 'doctor')
+        assert load_user('1') == CachedUser(1, 'dr_smith', 'doctor')
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        User.query.get(1).role = 'admin'
+        db.session.commit()
+        assert load_user(1).role == 'admin'
+
+        assert load_user(2).role == 'admin'
+        db.session.delete(User.query.get(2))
+        db.session.commit()
+        assert load_user(2) is None
+        assert load_user(99) is None
+
+def test_identity_cache_is_bounded_and_expires():
+    cache = IdentityCache(max_size=2, ttl=0.05)
+    for user_id in (1, 2, 3):
+        cache.set(user_id, CachedUser(user_id, f'u{user_id}', 'doctor'))
+    assert len(cache) == 2
+    assert cache.get(1) is None
+    assert cache.get(3).username == 'u3'
+    time.sleep(0.1)
+    assert cache.get(3) is None
+    cache.set(4, CachedUser(4, 'u4', 'doctor'))
+    cache.invalidate()
+    assert cache.get(4) is None
+    # TTL 0 turns the cache off
+    off = IdentityCache(ttl=0)
+    off.set(1, CachedUser(1, 'u1', 'doctor'))
+    assert len(off) == 0
@@ -0,0 +1,25 @@
+import json
+
+from benchmarks import run
+
+def test_benchmark_covers_every_route(tmp_path):
+    output = tmp_path / 'results.json'
+    args = ['--sizes', '200', '--iterations', '3', '--route-seconds', '0',
+            '--data-dir', str(tmp_path / 'data'), '--output', str(output)]
+    assert run.main(args) == 0
+
+    results = json.loads(output.read_text())
+    routes = results['sizes']['200']['routes']
+    assert routes['api.get_all_patients']['modes'].keys() == {'cold', 'cache_miss', 'cache_hit'}
+    assert routes['api.create_patient']['modes'].keys() == {'cold', 'warm'}
+    assert {endpoint: r['errors'] for endpoint, r in routes.items() if r['errors']} == {}
+    assert routes['api.get_dashboard_stats']['modes']['warm']['n'] == 3
+
+    # Comparing a run with itself finds no regressions; a 10x faster baseline does
+    assert run.main(args + ['--baseline', str(output)]) == 0
+    for route in results['sizes']['200']['routes'].values():
+        for stats in route['modes'].values():
+            stats['p95'] /= 10
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(results))
+    assert run.main(args + ['--baseline', str(baseline), '--threshold', '0.5']) == 1
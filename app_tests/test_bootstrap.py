@@ -0,0 +1,30 @@
+from app.app_extensions import db
+from app.models import User
+
+def test_startup_does_not_touch_the_database(make_app, tmp_path):
+    app = make_app('fresh.db', create_tables=False)
+    assert not (tmp_path / 'fresh.db').exists()
+    assert 'migrate' not in app.extensions
+    assert app.test_client().get('/api/').status_code == 200
+    assert not (tmp_path / 'fresh.db').exists()
+
+def test_setup_commands_create_schema_and_users(make_app, tmp_path):
+    db_path = tmp_path / 'nested' / 'prms.db'
+    app = make_app('nested/prms.db', create_tables=False)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['setup', 'db'])
+    assert result.exit_code == 0, result.output
+    assert db_path.exists()
+
+    result = runner.invoke(args=['setup', 'users'])
+    assert result.exit_code == 0, result.output
+    assert 'dr_smith, dr_smith_2, dr_smith_3' in result.output
+    assert 'already exist' in runner.invoke(args=['setup', 'users']).output
+    with app.app_context():
+        assert User.query.filter_by(role='doctor').count() == 3
+        assert User.query.filter_by(username='dr_smith').one().check_password('password123')
+
+def test_migrations_are_registered_for_cli_commands(make_app, monkeypatch):
+    monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+    assert make_app('cli.db', create_tables=False).extensions['migrate'].db is db
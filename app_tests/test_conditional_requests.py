@@ -0,0 +1,31 @@
+import json
+
+def test_get_returns_etag_and_honors_if_none_match(client):
+    first = client.get('/api/patients')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    revalidated = client.get('/api/patients', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+def test_etag_changes_after_write(client):
+    etag = client.get('/api/patients').headers['ETag']
+    client.post('/api/patients', json={'name': 'Bob', 'age': 25, 'contact_info': 'bob@example.com'})
+
+    response = client.get('/api/patients', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.json) == 2
+    assert response.headers['ETag'] != etag
+
+def test_ndjson_stream_is_not_cached_or_etagged(client):
+    response = client.get('/api/patients', headers={'Accept': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'ETag' not in response.headers
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row['name'] for row in rows] == ['Alice']
+
+    client.post('/api/patients', json={'name': 'Bob', 'age': 25, 'contact_info': 'bob@example.com'})
+    response = client.get('/api/patients', headers={'Accept': 'application/x-ndjson'})
+    assert len(response.data.decode().splitlines()) == 2
@@ -0,0 +1,40 @@
+import logging
+
+import pytest
+from app import create_app
+from app.app_config import DevelopmentConfig, ProductionConfig
+
+class Production(ProductionConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+class Development(DevelopmentConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+@pytest.fixture(autouse=True)
+def app_logger_level():
+    # The 'app' logger is shared by every app in the test run
+    logger = logging.getLogger('app')
+    level = logger.level
+    yield
+    logger.setLevel(level)
+
+def test_production_profile_has_no_debug_output():
+    app = create_app(Production)
+    assert app.debug is False
+    assert app.config['SQLALCHEMY_ECHO'] is False
+    assert not app.logger.isEnabledFor(logging.DEBUG)
+    assert app.logger.isEnabledFor(logging.INFO)
+
+def test_development_profile_keeps_debugging_on():
+    app = create_app(Development)
+    assert app.debug is True
+    assert app.config['SQLALCHEMY_ECHO'] is True
+    assert app.logger.isEnabledFor(logging.DEBUG)
+
+def test_production_profile_samples_timing_without_the_header():
+    app = create_app(Production)
+    assert app.config['SERVER_TIMING_SAMPLE_RATE'] == 0.01
+    app.config['SERVER_TIMING_SAMPLE_RATE'] = 1.0
+    response = app.test_client().get('/')
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
@@ -0,0 +1,87 @@
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func
+from app import datagen, rollups
+from app.app_extensions import db
+from app.models import User, Patient, Visit, Prescription, Report
+
+NOW = datetime(2025, 6, 1)
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+def test_generated_rows_are_consistent(app):
+    with app.app_context():
+        counts = datagen.generate(4000, seed=1, now=NOW, batch_size=500)
+
+        assert counts['patients'] == Patient.query.count() == 1000
+        assert counts['visits'] == Visit.query.count() == 4000
+        assert counts['prescriptions'] == Prescription.query.count()
+        assert 3000 < counts['prescriptions'] < 5500
+        assert counts['reports'] == Report.query.count() == 500
+        assert User.query.get(counts['admin_id']).role == 'admin'
+
+        # Every reference resolves, and visits follow the patient's registration
+        orphans = (db.session.query(func.count()).select_from(Visit)
+                   .outerjoin(Patient, Visit.patient_id == Patient.id)
+                   .filter((Patient.id.is_(None)) | (Visit.visit_date < Patient.created_at)).scalar())
+        assert orphans == 0
+        mismatched = (db.session.query(func.count()).select_from(Prescription)
+                      .join(Visit, Prescription.visit_id == Visit.visit_id)
+                      .filter((Prescription.patient_id != Visit.patient_id) |
+                              (Prescription.doctor_id != Visit.doctor_id)).scalar())
+        assert mismatched == 0
+        first_doctor, last_doctor = counts['doctor_ids']
+        assert {user.role for user in User.query.filter(User.user_id.between(first_doctor, last_doctor))} == {'doctor'}
+
+        # Skewed: the busiest patients and drugs stand well above the average
+        visits_per_patient = Counter(patient_id for (patient_id,) in db.session.query(Visit.patient_id))
+        assert visits_per_patient.most_common(1)[0][1] > 5 * 4
+        drugs = Counter(drug for (drug,) in db.session.query(Prescription.drug_name))
+        assert [drug for drug, _ in drugs.most_common(2)] == list(datagen.DRUGS[:2])
+
+        # Rollups match the data
+        stats = rollups.snapshot()
+        assert stats['total_visits'] == 4000
+        assert stats['total_prescriptions'] == counts['prescriptions']
+
+def test_same_seed_same_data(make_app):
+    def load(name, seed):
+        app = make_app(name)
+        with app.app_context():
+            datagen.generate(500, seed=seed, now=NOW)
+            return [(v.patient_id, v.doctor_id, v.visit_date, v.diagnosis) for v in Visit.query.order_by(Visit.visit_id)]
+
+    assert load('a.db', 7) == load('b.db', 7)
+    assert load('c.db', 8) != load('a.db', 7)
+
+def test_load_appends_and_restores_pragmas(app):
+    pragmas = ('synchronous', 'journal_mode', 'foreign_keys')
+    with app.app_context():
+        before = [db.session.execute(f'PRAGMA {name}').scalar() for name in pragmas]
+        assert before == [1, 'wal', 1]  # NORMAL, see app/database.py
+        datagen.generate(100, now=NOW)
+        second = datagen.generate(100, now=NOW)
+        assert Visit.query.count() == 200
+        assert second['doctor_ids'][0] > 1
+        assert [db.session.execute(f'PRAGMA {name}').scalar() for name in pragmas] == before
+
+def test_batches_go_in_after_the_rows_they_reference(app, monkeypatch):
+    # With foreign keys checked (as on Postgres), a prescription batch flushed
+    # before its visits fails
+    pragmas = {name: value for name, value in datagen.BULK_LOAD_PRAGMAS.items() if name != 'foreign_keys'}
+    monkeypatch.setattr(datagen, 'BULK_LOAD_PRAGMAS', pragmas)
+    with app.app_context():
+        counts = datagen.generate(300, seed=2, now=NOW, batch_size=50)
+        assert db.session.execute('PRAGMA foreign_keys').scalar() == 1
+        assert Prescription.query.count() == counts['prescriptions']
+
+def test_cli(app):
+    result = app.test_cli_runner().invoke(args=['datagen', 'load', '--visits', '200', '--seed', '3'])
+    assert result.exit_code == 0, result.output
+    assert 'Loaded' in result.output and '200 visits' in result.output
+    with app.app_context():
+        assert Visit.query.count() == 200
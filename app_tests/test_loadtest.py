@@ -0,0 +1,24 @@
+import json
+import socket
+
+from benchmarks import loadtest
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def test_mixed_load_against_local_server(tmp_path):
+    output = tmp_path / 'load.json'
+    assert loadtest.main(['run', '--serve', '--port', str(free_port()), '--visits', '500',
+                          '--db', str(tmp_path / 'load.db'), '--users', '3', '--dashboards', '1',
+                          '--duration', '3', '--ramp-up', '0', '--think-time', '0.01',
+                          '--poll-interval', '0.5', '--output', str(output)]) == 0
+
+    result = json.loads(output.read_text())
+    assert result['requests'] > 0 and result['throughput_rps'] > 0
+    assert result['error_rate'] == 0
+    assert {'POST /api/login', 'GET /api/patients/{id}', 'GET /api/dashboard/stats'} <= result['by_request'].keys()
+    assert result['by_request']['POST /api/login']['n'] == 3
+    cache = result['cache']['api']['cache_requests']
+    assert cache['hits'] + cache['misses'] > 0 and 0 <= cache['hit_ratio'] <= 1
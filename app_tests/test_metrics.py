@@ -0,0 +1,72 @@
+import sys
+import os
+import subprocess
+
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_requests_are_counted_per_route_and_status(client):
+    route = {'method': 'GET', 'route': '/api/patients/<int:patient_id>'}
+    ok_before = sample('http_requests_total', status='200', **route)
+    unmatched = {'method': 'GET', 'route': 'unmatched', 'status': '404'}
+    missing_before = sample('http_requests_total', **unmatched)
+    latency_before = sample('http_request_duration_seconds_count', status='200', **route)
+    # Relative: a streamed response in another test's preserved context never tears down
+    in_progress_before = sample('http_requests_in_progress', method='GET')
+
+    assert client.get('/api/patients/1').status_code == 200
+    assert client.get('/api/patients/1').status_code == 200
+    assert client.get('/api/no-such-route').status_code == 404
+
+    assert sample('http_requests_total', status='200', **route) == ok_before + 2
+    assert sample('http_requests_total', **unmatched) == missing_before + 1
+    assert sample('http_request_duration_seconds_count', status='200', **route) == latency_before + 2
+    assert sample('http_requests_in_progress', method='GET') == in_progress_before
+
+def test_cache_and_pool_metrics(client):
+    hits_before = sample('cache_requests_total', view='get_all_patients', result='hit')
+    misses_before = sample('cache_requests_total', view='get_all_patients', result='miss')
+
+    client.get('/api/patients')
+    client.get('/api/patients')
+
+    assert sample('cache_requests_total', view='get_all_patients', result='miss') == misses_before + 1
+    assert sample('cache_requests_total', view='get_all_patients', result='hit') == hits_before + 1
+    assert sample('db_pool_connections_total') > 0
+    assert sample('db_pool_checked_out_connections') == 0
+
+def test_metrics_endpoint_serves_text_format(client):
+    client.get('/api/')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+
+    families = {family.name: family for family in text_string_to_metric_families(response.get_data(as_text=True))}
+    assert {'http_requests', 'http_request_duration_seconds', 'http_requests_in_progress',
+            'db_pool_checked_out_connections', 'cache_requests'} <= set(families)
+    routes = {s.labels['route'] for s in families['http_requests'].samples}
+    assert '/api/' in routes
+
+WORKER = """
+from app.metrics import REQUESTS
+REQUESTS.labels('GET', '/api/', 200).inc()
+"""
+
+SCRAPE = """
+from app.metrics import metrics_payload
+print(metrics_payload().decode())
+"""
+
+def test_multiprocess_mode_merges_workers(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', WORKER], cwd=ROOT, env=env, check=True)
+    output = subprocess.run([sys.executable, '-c', SCRAPE], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+
+    assert 'http_requests_total{method="GET",route="/api/",status="200"} 2.0' in output
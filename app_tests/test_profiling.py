@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+import pytest
+from app.profiling import init_profiling, StackSampler
+
+@pytest.fixture
+def app_config(tmp_path):
+    return {'PROFILER_DIR': str(tmp_path / 'profiles')}
+
+def profiled(app, **profiler_config):
+    """Turn the profiler on after create_app, which left it off"""
+    app.config.update(PROFILER_ENABLED=True, PROFILER_INTERVAL_MS=1, **profiler_config)
+    init_profiling(app)
+    return app
+
+def test_disabled_profiler_registers_no_hooks(app, admin_headers):
+    hooks = [f.__name__ for f in app.before_request_funcs.get(None, [])]
+    assert 'start_profiling' not in hooks
+
+    client = app.test_client()
+    response = client.get('/api/patients/1', headers={'X-Profile': '1', **admin_headers})
+    assert 'X-Profile-Capture' not in response.headers
+    assert not os.path.exists(app.config['PROFILER_DIR'])
+
+def test_header_profiles_admin_requests_only(app, auth_headers, admin_headers):
+    profiled(app, PROFILER_SAMPLE_EVERY=0)
+    headers = {'doctor': auth_headers, 'admin': admin_headers}
+    client = app.test_client()
+
+    response = client.get('/api/patients/1', headers={'X-Profile': '1', **headers['doctor']})
+    assert 'X-Profile-Capture' not in response.headers
+
+    response = client.get('/api/patients/1', headers={'X-Profile': '1', **headers['admin']})
+    name = response.headers['X-Profile-Capture']
+    assert '-api-get_patient-' in name
+
+    listing = client.get('/api/admin/profiles', headers=headers['admin']).json
+    assert [capture['name'] for capture in listing['captures']] == [name]
+    assert client.get('/api/admin/profiles', headers=headers['doctor']).status_code == 403
+
+    download = client.get(f'/api/admin/profiles/{name}', headers=headers['admin'])
+    assert download.status_code == 200
+    assert 'attachment' in download.headers['Content-Disposition']
+    assert client.get('/api/admin/profiles/..%2Fapp.db', headers=headers['admin']).status_code in (400, 404)
+
+def test_sampling_keeps_newest_captures(app, auth_headers):
+    profiled(app, PROFILER_SAMPLE_EVERY=2, PROFILER_MAX_CAPTURES=2)
+    client = app.test_client()
+    captured = []
+    for _ in range(8):
+        response = client.get('/api/patients/1', headers=auth_headers)
+        captured.append('X-Profile-Capture' in response.headers)
+        time.sleep(0.01)
+
+    assert captured == [False, True] * 4
+    assert len(os.listdir(app.config['PROFILER_DIR'])) == 2
+
+def test_stack_sampler_collapses_stacks():
+    def busy_leaf(deadline):
+        while time.perf_counter() < deadline:
+            pass
+
+    sampler = StackSampler(threading.get_ident(), 0.001)
+    sampler.start()
+    busy_leaf(time.perf_counter() + 0.1)
+    sampler.stop()
+
+    lines = sampler.collapsed().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert stack.split(';')[-1].startswith('busy_leaf (test_profiling.py:')
@@ -0,0 +1,93 @@
+from datetime import datetime
+import pytest
+from app.app_extensions import db
+from app.models import User, Patient, Visit, Prescription, Report
+from flask import jsonify
+from flask_jwt_extended import create_access_token
+from app.timing import query_budget
+from query_budget import BudgetedClient, QueryBudgetExceeded
+
+DOCTORS = 8
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    app.test_client_class = BudgetedClient
+
+    # One patient seen by every doctor, so per-row lazy loads would repeat
+    with app.app_context():
+        doctors = []
+        for i in range(DOCTORS):
+            doctor = User(username=f'dr_{i}', role='doctor')
+            doctor.set_password('password123')
+            db.session.add(doctor)
+            doctors.append(doctor)
+        patient = Patient(name='Alice', age=30, contact_info='x')
+        db.session.add(patient)
+        db.session.flush()
+        for i, doctor in enumerate(doctors):
+            visit = Visit(patient_id=patient.id, doctor_id=doctor.user_id,
+                          visit_date=datetime(2024, 1, i + 1), diagnosis='Flu')
+            db.session.add(visit)
+            db.session.flush()
+            db.session.add(Prescription(patient_id=patient.id, doctor_id=doctor.user_id, visit_id=visit.visit_id,
+                                        drug_name='Aspirin', dosage='500mg', duration=5))
+        db.session.add(Report(patient_id=patient.id, report_type='lab', report_data='ok'))
+        db.session.commit()
+        app.config['TEST_TOKEN'] = create_access_token(identity=str(doctors[0].user_id))
+    return app
+
+def test_every_api_route_declares_a_budget(app):
+    missing = [endpoint for endpoint, view in app.view_functions.items()
+               if endpoint.startswith('api.') and not hasattr(view, 'query_budget')]
+    assert missing == []
+
+@pytest.mark.parametrize('method, path, headers', [
+    ('get', '/api/', {}),
+    ('get', '/api/patients', {}),
+    ('get', '/api/patients/1', {}),
+    ('get', '/api/patients/1/visits', {}),
+    ('get', '/api/patients/1/prescriptions', {}),
+    ('get', '/api/patients/1/reports', {}),
+    ('get', '/api/visits', {}),
+    ('get', '/api/visits/1', {}),
+    ('get', '/api/visits/timeline', {}),
+    ('get', '/api/prescriptions', {}),
+    ('get', '/api/prescriptions', {'Accept': 'application/x-ndjson'}),
+    ('get', '/api/prescriptions/1', {}),
+    ('get', '/api/dashboard/stats', {}),
+    ('get', '/api/reports', {}),
+    ('get', '/api/reports/1', {}),
+])
+def test_read_routes_within_budget(client, method, path, headers):
+    response = getattr(client, method)(path, headers=headers)
+    assert response.status_code == 200
+    if 'Accept' in headers:
+        assert response.mimetype == headers['Accept']
+    response.get_data()
+
+def test_write_routes_within_budget(client):
+    assert client.post('/api/patients', json={'name': 'Bob', 'age': 40, 'contact_info': 'y'}).status_code == 201
+    assert client.post('/api/visits', json={'patient_id': 1, 'doctor_id': 1, 'diagnosis': 'Cold'}).status_code == 201
+    assert client.post('/api/prescriptions', json={
+        'patient_id': 1, 'doctor_id': 2, 'drug_name': 'Ibuprofen', 'dosage': '400mg', 'duration': 3
+    }).status_code == 201
+    assert client.post('/api/reports', json={'patient_id': 1, 'report_type': 'lab', 'report_data': 'ok'}).status_code == 201
+    assert client.delete('/api/reports/2').status_code == 200
+    assert client.delete('/api/patients/1').status_code == 200
+    assert client.post('/api/login', json={'username': 'dr_0', 'password': 'password123'}).status_code == 200
+    assert client.post('/api/setup-doctors').status_code in (200, 201)
+
+def test_update_patient_within_budget(client):
+    assert client.put('/api/patients/1', json={'age': 31}).status_code == 200
+
+def test_lazy_loading_is_reported_as_n_plus_one(app):
+    @app.route('/lazy-visits')
+    @query_budget(20)
+    def lazy_visits():
+        # Each visit.doctor is a separate lazy load
+        return jsonify([visit.doctor.username for visit in Visit.query.all()])
+
+    with app.test_client() as client:
+        with pytest.raises(QueryBudgetExceeded, match=r'possible N\+1: 8x SELECT'):
+            client.get('/lazy-visits')
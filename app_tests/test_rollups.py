@@ -0,0 +1,112 @@
+import logging.config
+import os
+
+from app.app_extensions import db
+from app import rollups
+
+def rebuilt_snapshot(app):
+    """Snapshot recomputed from the base tables, discarded afterwards"""
+    with app.app_context():
+        rollups.rebuild()
+        result = rollups.snapshot()
+        db.session.rollback()
+    return result
+
+def test_write_routes_keep_rollups_in_sync(app, client, auth_headers):
+    # Alice (30) is seeded
+    for name, age in (('Bob', 72), ('Carol', 12)):
+        res = client.post('/api/patients', json={'name': name, 'age': age, 'contact_info': 'x'}, headers=auth_headers)
+        assert res.status_code == 201
+
+    client.post('/api/visits', json={'patient_id': 1, 'doctor_id': 1, 'diagnosis': 'Flu'}, headers=auth_headers)
+    client.post('/api/visits', json={'patient_id': 2, 'doctor_id': 1, 'diagnosis': 'Cold'}, headers=auth_headers)
+    client.post('/api/prescriptions', json={
+        'patient_id': 1, 'doctor_id': 1, 'drug_name': 'Aspirin', 'dosage': '500mg', 'duration': 5
+    }, headers=auth_headers)
+    client.post('/api/prescriptions', json={
+        'patient_id': 2, 'doctor_id': 1, 'drug_name': 'Aspirin', 'dosage': '500mg', 'duration': 3
+    }, headers=auth_headers)
+    client.put('/api/patients/1', json={'age': 55}, headers=auth_headers)
+
+    stats = client.get('/api/dashboard/stats', headers=auth_headers).json
+    assert stats['total_patients'] == 3
+    assert stats['average_age'] == round((55 + 72 + 12) / 3, 2)
+    assert stats['age_distribution'] == {'0-18': 1, '19-30': 0, '31-50': 0, '51-70': 1, '70+': 1}
+    assert stats['total_visits'] == 4
+    assert stats['total_prescriptions'] == 2
+    assert stats['most_prescribed_drugs'] == {'Aspirin': 2}
+    assert stats['doctor_stats']['1'] == {'visits': 4, 'prescriptions': 2}
+
+    with app.app_context():
+        assert rollups.snapshot() == rebuilt_snapshot(app)
+
+def test_delete_patient_subtracts_cascaded_rows(app, client, auth_headers):
+    client.post('/api/patients', json={'name': 'Bob', 'age': 40, 'contact_info': 'x'}, headers=auth_headers)
+    client.post('/api/prescriptions', json={
+        'patient_id': 1, 'doctor_id': 1, 'drug_name': 'Ibuprofen', 'dosage': '400mg', 'duration': 5
+    }, headers=auth_headers)
+    client.post('/api/visits', json={'patient_id': 2, 'doctor_id': 1, 'diagnosis': 'Cold'}, headers=auth_headers)
+
+    assert client.delete('/api/patients/1', headers=auth_headers).status_code == 200
+
+    stats = client.get('/api/dashboard/stats', headers=auth_headers).json
+    assert stats['total_patients'] == 1
+    assert stats['total_visits'] == 1
+    assert stats['total_prescriptions'] == 0
+    assert stats['unique_drugs'] == 0
+    assert stats['doctor_stats']['1'] == {'visits': 1, 'prescriptions': 0}
+    with app.app_context():
+        assert rollups.snapshot() == rebuilt_snapshot(app)
+
+def test_invalid_ages_are_rejected_before_the_rollups(app, client, auth_headers):
+    res = client.post('/api/patients', json={'name': 'Bob', 'age': '40', 'contact_info': 'x'}, headers=auth_headers)
+    assert res.status_code == 201
+    assert res.json['patient']['age'] == 40
+    for age in ('thirty', None, -1, True):
+        res = client.post('/api/patients', json={'name': 'Bob', 'age': age, 'contact_info': 'x'}, headers=auth_headers)
+        assert res.status_code == 400
+    assert client.put('/api/patients/1', json={'age': 'old'}, headers=auth_headers).status_code == 400
+    assert client.put('/api/patients/1', json={'name': 'Alice B'}, headers=auth_headers).status_code == 200
+
+    with app.app_context():
+        assert rollups.snapshot()['total_patients'] == 2
+        assert rollups.snapshot() == rebuilt_snapshot(app)
+
+def test_rebuild_command_backfills(app):
+    with app.app_context():
+        db.session.execute(db.text(
+            "INSERT INTO patient (name, age, contact_info) VALUES ('Backfilled', 20, 'x')"
+        ))
+        db.session.commit()
+        assert rollups.snapshot()['total_patients'] == 1
+
+    result = app.test_cli_runner().invoke(args=['rollups', 'rebuild'])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        assert rollups.snapshot()['total_patients'] == 2
+        assert rollups.snapshot()['age_distribution']['19-30'] == 2
+
+def test_rollup_migration_backfills_existing_rows(make_app, monkeypatch):
+    from flask_migrate import stamp, upgrade
+
+    # Flask-Migrate is only set up for the flask CLI
+    monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+    # migrations/env.py would reconfigure logging and disable the app's loggers
+    monkeypatch.setattr(logging.config, 'fileConfig', lambda *args, **kwargs: None)
+    app = make_app()
+    migrations = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+    with app.app_context():
+        # A database from before the rollup tables existed
+        for model in rollups.ROLLUP_MODELS:
+            model.__table__.drop(db.engine)
+        db.session.execute(db.text(
+            "INSERT INTO patient (name, age, contact_info) VALUES ('Existing', 40, 'x')"
+        ))
+        db.session.commit()
+        stamp(migrations, '4b1d7c9e2f10')
+
+        upgrade(migrations)
+
+        assert rollups.snapshot()['total_patients'] == 1
+        assert rollups.snapshot()['age_distribution']['31-50'] == 1
@@ -0,0 +1,57 @@
+import sys
+import os
+import socket
+import subprocess
+import time
+import urllib.request
+import pytest
+
+from app import create_app, reset_after_fork
+from app.app_extensions import db
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def test_reset_after_fork_replaces_the_connection_pools(tmp_path):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "fork.db"}'
+    with app.app_context():
+        db.session.execute(db.text('SELECT 1'))
+        db.session.remove()
+        inherited = db.engine.pool
+        reset_after_fork(app)
+        assert db.engine.pool is not inherited
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def test_gunicorn_serves_the_preloaded_app(tmp_path):
+    pytest.importorskip('gunicorn')
+    port = free_port()
+    env = dict(os.environ, APP_CONFIG='production', DATABASE_URL=f'sqlite:///{tmp_path / "prms.db"}',
+               PORT=str(port), WEB_CONCURRENCY='2', WEB_THREADS='2', ACCESS_LOG='',
+               PROMETHEUS_MULTIPROC_DIR=str(tmp_path / 'prometheus'))
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=2) as response:
+                    assert response.status == 200
+                    break
+            except OSError:
+                assert server.poll() is None, server.stderr.read()
+                assert time.monotonic() < deadline, 'gunicorn did not start'
+                time.sleep(0.2)
+        for _ in range(4):
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/').close()
+        # Metrics are merged across the workers
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+            metrics = response.read().decode()
+        assert 'http_requests_total{method="GET",route="/",status="200"} 5.0' in metrics
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+def parse_server_timing(header):
+    metrics = {}
+    for entry in header.split(', '):
+        name, *params = entry.split(';')
+        metrics[name] = dict(param.split('=', 1) for param in params)
+    return metrics
+
+@pytest.fixture
+def timing_log(log_records):
+    return log_records('app.timing')
+
+@pytest.mark.parametrize('app_config', [{'SERVER_TIMING_SAMPLE_RATE': 1.0}])
+def test_sampled_requests_report_db_cache_and_serialization(client, timing_log):
+    first = client.get('/api/patients')
+    metrics = parse_server_timing(first.headers['Server-Timing'])
+    assert set(metrics) == {'db', 'cache', 'serialize', 'total'}
+    assert metrics['db']['desc'] != '"0 queries"'
+    assert float(metrics['serialize']['dur']) > 0
+    assert float(metrics['total']['dur']) >= float(metrics['db']['dur'])
+
+    # A cache hit skips the patient query
+    second = client.get('/api/patients')
+    cached = parse_server_timing(second.headers['Server-Timing'])
+    assert cached['cache']['desc'] == '"1 ops"'
+    assert int(cached['db']['desc'].strip('"').split()[0]) < int(metrics['db']['desc'].strip('"').split()[0])
+
+    line = json.loads(timing_log[-1].getMessage())
+    assert line['event'] == 'request_timing'
+    assert line['endpoint'] == 'api.get_all_patients'
+    assert line['status'] == 200
+    assert line['cache_ops'] == 1
+
+@pytest.mark.parametrize('app_config', [{'SERVER_TIMING_SAMPLE_RATE': 0.0}])
+def test_unsampled_requests_are_not_instrumented(client, timing_log):
+    response = client.get('/api/patients')
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
+    assert timing_log == []
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from app.slow_queries import init_slow_queries, normalize_statement, redact
+
+@pytest.fixture
+def slow_log(log_records):
+    return log_records('app.slow_queries')
+
+@pytest.fixture
+def client(app):
+    """Admin client, with the slow-query log set up for app_config's SLOW_QUERY_MS"""
+    init_slow_queries(app)
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {app.config['ADMIN_TOKEN']}"
+    return client
+
+# Every statement counts as slow
+@pytest.mark.parametrize('app_config', [{'SLOW_QUERY_MS': 0.0001}])
+def test_slow_queries_are_fingerprinted_and_explained(client, slow_log):
+    # Query-string variants bypass the response cache
+    for page in range(3):
+        client.get(f'/api/patients/1/visits?page={page}')
+    client.put('/api/patients/1', json={'contact_info': 'private@example.com'})
+
+    queries = client.get('/api/admin/slow-queries').json
+    assert queries['enabled'] is True
+    visits = [q for q in queries['queries'] if q['statement'].startswith('SELECT visit.')][0]
+    assert visits['count'] == 3
+    assert 'WHERE visit.patient_id = ?' in visits['statement']
+    # No index on visit.patient_id yet: the plan shows a full scan
+    assert any(line.startswith('SCAN visit') for line in visits['plan'])
+    totals = [q['total_ms'] for q in queries['queries']]
+    assert totals == sorted(totals, reverse=True)
+
+    events = [json.loads(record.getMessage()) for record in slow_log]
+    assert {event['endpoint'] for event in events} >= {'api.get_patient_visits', 'api.update_patient'}
+    logged = json.dumps(events)
+    assert 'Alice' not in logged and 'private@example.com' not in logged
+
+@pytest.mark.parametrize('app_config', [{'SLOW_QUERY_MS': 10_000}])
+def test_fast_queries_are_not_logged(client, slow_log):
+    client.get('/api/patients/1/visits')
+    assert slow_log == []
+    assert client.get('/api/admin/slow-queries').json['queries'] == []
+
+@pytest.mark.parametrize('app_config', [{'SLOW_QUERY_MS': 0}])
+def test_disabled_log(client):
+    assert client.get('/api/admin/slow-queries').json == {'enabled': False, 'queries': []}
+
+def test_normalize_and_redact():
+    assert normalize_statement("SELECT * FROM t WHERE a = 'x' AND b IN (?, ?, ?)  AND c = 5") == \
+        'SELECT * FROM t WHERE a = ? AND b IN (?) AND c = ?'
+    assert redact(('Alice', 30)) == ['str', 'int']
+    assert redact({'name': 'Alice'}) == {'name': 'str'}
+    assert redact([('a',), ('b',)], executemany=True) == '<2 rows>'
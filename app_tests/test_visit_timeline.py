@@ -0,0 +1,21 @@
+from datetime import datetime
+from app.app_extensions import db
+from app.models import Visit
+
+def test_visit_timeline_is_a_compact_csv(app, client):
+    with app.app_context():
+        db.session.add_all([
+            Visit(patient_id=1, doctor_id=1, visit_date=datetime(2024, 1, 10, 9, 30), diagnosis='Cold'),
+            Visit(patient_id=1, doctor_id=1, visit_date=datetime(1970, 1, 2), diagnosis='Flu')
+        ])
+        db.session.commit()
+
+    response = client.get('/api/visits/timeline')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'patient_id,visit_time'
+    assert sorted(lines[1:]) == ['1,1704879000', '1,86400']
+
+def test_visit_timeline_requires_a_token(app):
+    assert app.test_client().get('/api/visits/timeline').status_code == 401
@@ -0,0 +1,429 @@
+"""
+Mixed read/write load test against a running API.
+
+    # Terminal 1: main API under gunicorn (wsgi:app) on SQLite + simple cache,
+    # seeded with app/datagen.py
+    python -m benchmarks.loadtest serve --visits 100000 --port 5001
+    # Terminal 2
+    python -m benchmarks.loadtest run --base-url http://127.0.0.1:5001 --users 20 --duration 60
+
+    # Or both in one go (the server runs in a subprocess)
+    python -m benchmarks.loadtest run --serve --visits 100000 --users 20 --duration 60
+
+Virtual users are threads with their own keep-alive connection; nothing
+beyond the standard library is needed on the client side. Two scenarios
+model real traffic:
+
+- doctors log in, then repeatedly open a patient record (patient,
+  visits, prescriptions), sometimes add a visit and a prescription or
+  update the patient, with exponential think time between actions
+- dashboards poll /api/dashboard/stats (and /analytics/summary when
+  --analytics-url is given) every --poll-interval seconds
+
+The report has throughput, error rate and p50/p95/p99 latency per
+request type and overall, plus cache hit ratios taken from the /metrics
+endpoints before and after the run. It is printed and, with --output,
+written as JSON.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from benchmarks.run import summarize
+
+# Repository root, where wsgi.py and gunicorn.conf.py live
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Doctor actions after opening a patient record, with their probabilities
+WRITE_VISIT = 0.3
+WRITE_PRESCRIPTION = 0.2
+UPDATE_PATIENT = 0.05
+LIST_PATIENTS = 0.02
+
+class HttpClient:
+    """
+    One keep-alive connection; reconnects when the server closed it. A
+    request is retried (once, on a fresh connection) only if it could not
+    be sent: once sent, the server may have acted on it.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.token = None
+        self._conn = None
+
+    def request(self, method, path, body=None):
+        """(status, parsed JSON body or None)"""
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in (1, 2):
+            connection = self._connection()
+            try:
+                connection.request(method, self.prefix + path, body=payload, headers=headers)
+                break
+            except (BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt == 2:
+                    raise
+        try:
+            response = connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+    def _connection(self):
+        # An idle keep-alive connection with something to read has been closed by the server
+        if self._conn is not None and self._conn.sock is not None and \
+                select.select([self._conn.sock], [], [], 0)[0]:
+            self.close()
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timed(self, client, name, method, path, body=None):
+        """Make a request and record it under `name`; returns the parsed body, or None on errors"""
+        started = perf_counter()
+        try:
+            status, data = client.request(method, path, body)
+        except (OSError, http.client.HTTPException):
+            status, data = None, None
+        elapsed = (perf_counter() - started) * 1000
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if status is None or status >= 400:
+                self.errors[name] += 1
+        return data if status is not None and status < 400 else None
+
+    def report(self, elapsed_seconds):
+        with self._lock:
+            everything = [ms for samples in self.latencies.values() for ms in samples]
+            total = len(everything)
+            errors = sum(self.errors.values())
+            return {
+                'duration_s': round(elapsed_seconds, 2),
+                'requests': total,
+                'throughput_rps': round(total / elapsed_seconds, 2) if elapsed_seconds else 0,
+                'error_rate': round(errors / total, 4) if total else 0,
+                'latency_ms': summarize(everything) if everything else None,
+                'by_request': {
+                    name: dict(summarize(samples), errors=self.errors[name],
+                               error_rate=round(self.errors[name] / len(samples), 4))
+                    for name, samples in sorted(self.latencies.items())
+                }
+            }
+
+def think(rng, mean_seconds, stop):
+    stop.wait(rng.expovariate(1 / mean_seconds) if mean_seconds > 0 else 0)
+
+def doctor(args, number, stats, stop, total_patients):
+    rng = random.Random(args.seed * 1000 + number)
+    client = HttpClient(args.base_url)
+    username = args.username_template.format(n=number % args.doctors + args.first_doctor)
+    login = stats.timed(client, 'POST /api/login', 'POST', '/api/login',
+                        {'username': username, 'password': args.password})
+    if not login:
+        return
+    client.token = login['access_token']
+    doctor_id = login['user']['user_id']
+
+    while not stop.is_set():
+        # Recent, frequently seen patients are opened more often
+        patient_id = min(total_patients, int(rng.paretovariate(1.0))) if rng.random() < 0.5 \
+            else rng.randint(1, total_patients)
+        stats.timed(client, 'GET /api/patients/{id}', 'GET', f'/api/patients/{patient_id}')
+        stats.timed(client, 'GET /api/patients/{id}/visits', 'GET', f'/api/patients/{patient_id}/visits')
+        stats.timed(client, 'GET /api/patients/{id}/prescriptions', 'GET',
+                    f'/api/patients/{patient_id}/prescriptions')
+        think(rng, args.think_time, stop)
+
+        if rng.random() < WRITE_VISIT:
+            created = stats.timed(client, 'POST /api/visits', 'POST', '/api/visits', {
+                'patient_id': patient_id, 'doctor_id': doctor_id, 'diagnosis': rng.choice(('Flu', 'Cold', 'Checkup'))
+            })
+            if created and rng.random() < WRITE_PRESCRIPTION / WRITE_VISIT:
+                stats.timed(client, 'POST /api/prescriptions', 'POST', '/api/prescriptions', {
+                    'patient_id': patient_id, 'doctor_id': doctor_id, 'visit_id': created['visit']['visit_id'],
+                    'drug_name': rng.choice(('Paracetamol', 'Ibuprofen', 'Amoxicillin')),
+                    'dosage': '500mg', 'duration': rng.choice((3, 5, 7))
+                })
+        if rng.random() < UPDATE_PATIENT:
+            stats.timed(client, 'PUT /api/patients/{id}', 'PUT', f'/api/patients/{patient_id}',
+                        {'age': rng.randint(1, 95)})
+        if rng.random() < LIST_PATIENTS:
+            stats.timed(client, 'GET /api/patients', 'GET', '/api/patients')
+        think(rng, args.think_time, stop)
+    client.close()
+
+def dashboard(args, number, stats, stop, token):
+    client = HttpClient(args.base_url)
+    client.token = token
+    analytics = HttpClient(args.analytics_url) if args.analytics_url else None
+    # Spread the pollers over the interval
+    stop.wait(args.poll_interval * number / max(1, args.dashboards))
+    while not stop.is_set():
+        stats.timed(client, 'GET /api/dashboard/stats', 'GET', '/api/dashboard/stats')
+        if analytics is not None:
+            stats.timed(analytics, 'GET /analytics/summary', 'GET', '/analytics/summary')
+        stop.wait(args.poll_interval)
+    client.close()
+
+def scrape_cache_counters(url):
+    """{(metric, result): value} of the cache counters on a /metrics endpoint, or None"""
+    from prometheus_client.parser import text_string_to_metric_families
+    client = HttpClient(url)
+    try:
+        client.prefix = ''
+        client._conn = http.client.HTTPConnection(client.host, client.port, timeout=client.timeout)
+        client._conn.request('GET', '/metrics')
+        text = client._conn.getresponse().read().decode()
+    except (OSError, http.client.HTTPException):
+        return None
+    finally:
+        client.close()
+    counters = defaultdict(float)
+    for family in text_string_to_metric_families(text):
+        if family.name in ('cache_requests', 'analytics_cache_requests'):
+            for sample in family.samples:
+                if sample.name.endswith('_total'):
+                    counters[(family.name, sample.labels['result'])] += sample.value
+    return counters
+
+def cache_hit_ratios(before, after):
+    if before is None or after is None:
+        return None
+    ratios = {}
+    for metric in {metric for metric, _ in after}:
+        hits = after[(metric, 'hit')] - before.get((metric, 'hit'), 0)
+        misses = after[(metric, 'miss')] - before.get((metric, 'miss'), 0)
+        ratios[metric] = {
+            'hits': int(hits),
+            'misses': int(misses),
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None
+        }
+    return ratios
+
+def run(args):
+    bootstrap = HttpClient(args.base_url)
+    login = bootstrap.request('POST', '/api/login', {
+        'username': args.username_template.format(n=args.first_doctor), 'password': args.password
+    })[1]
+    if not login or 'access_token' not in login:
+        raise SystemExit(f"Could not log in as {args.username_template.format(n=args.first_doctor)}: {login}")
+    bootstrap.token = login['access_token']
+    total_patients = bootstrap.request('GET', '/api/dashboard/stats')[1]['total_patients']
+    bootstrap.close()
+    if not total_patients:
+        raise SystemExit("The API has no patients; seed it first (flask datagen load)")
+
+    before = {'api': scrape_cache_counters(args.base_url)}
+    if args.analytics_url:
+        before['analytics'] = scrape_cache_counters(args.analytics_url)
+
+    stats = Stats()
+    stop = threading.Event()
+    threads = [threading.Thread(target=doctor, args=(args, n, stats, stop, total_patients), daemon=True)
+               for n in range(args.users)]
+    threads += [threading.Thread(target=dashboard, args=(args, n, stats, stop, login['access_token']), daemon=True)
+                for n in range(args.dashboards)]
+
+    print(f"Running {args.users} doctors and {args.dashboards} dashboards for {args.duration}s "
+          f"against {args.base_url}", file=sys.stderr)
+    started = perf_counter()
+    for i, thread in enumerate(threads):
+        thread.start()
+        # Ramp up: spread the starts over --ramp-up seconds
+        if args.ramp_up and i < len(threads) - 1:
+            time.sleep(args.ramp_up / len(threads))
+    stop.wait(max(0, args.duration - (perf_counter() - started)))
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=60)
+    result = stats.report(perf_counter() - started)
+
+    result['cache'] = {'api': cache_hit_ratios(before['api'], scrape_cache_counters(args.base_url))}
+    if args.analytics_url:
+        result['cache']['analytics'] = cache_hit_ratios(before['analytics'],
+                                                        scrape_cache_counters(args.analytics_url))
+    result['config'] = {
+        'base_url': args.base_url,
+        'analytics_url': args.analytics_url,
+        'users': args.users,
+        'dashboards': args.dashboards,
+        'duration_s': args.duration,
+        'think_time_s': args.think_time,
+        'poll_interval_s': args.poll_interval
+    }
+    return result
+
+def print_report(result):
+    print(f"\n{result['requests']} requests in {result['duration_s']}s: "
+          f"{result['throughput_rps']} req/s, error rate {result['error_rate']:.2%}")
+    print(f"{'request':<40} {'n':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for name, stats in result['by_request'].items():
+        print(f"{name:<40} {stats['n']:>7} {stats['p50']:>9.2f} {stats['p95']:>9.2f} {stats['p99']:>9.2f} "
+              f"{stats['errors']:>7}")
+    for service, ratios in (result.get('cache') or {}).items():
+        for metric, ratio in (ratios or {}).items():
+            print(f"{service} {metric}: {ratio['hits']} hits, {ratio['misses']} misses, hit ratio {ratio['hit_ratio']}")
+
+# ------------------- Local server ------------------- #
+
+def serve(args):
+    """
+    Seed the SQLite database on first use, then replace this process with
+    gunicorn serving wsgi:app with gunicorn.conf.py, as in production, on the
+    production profile with the simple cache. Each worker has its own
+    cache, so a write only invalidates the worker that handled it.
+    """
+    from app import create_app, datagen
+    from app.app_extensions import db
+
+    db_path = os.path.abspath(args.db or os.path.join(tempfile.gettempdir(), f'prms-load-{args.visits}.db'))
+    if not os.path.exists(db_path):
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+        with app.app_context():
+            db.create_all()
+            counts = datagen.generate(args.visits, seed=args.seed)
+        print(f"Seeded {db_path}: {counts}", file=sys.stderr)
+
+    # A fresh multiprocess directory, so /metrics sums all workers of this run only
+    metrics_dir = os.path.join(tempfile.gettempdir(), f'prms-load-metrics-{args.port}')
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    env = dict(
+        os.environ,
+        APP_CONFIG='production',
+        DATABASE_URL=f'sqlite:///{db_path}',
+        CACHE_TYPE='simple',
+        SERVER_TIMING_SAMPLE_RATE='0',
+        PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+        # Per-request access logs would cost the server more than some of the requests
+        ACCESS_LOG='',
+        LOG_LEVEL='WARNING'
+    )
+    if args.workers:
+        env['WEB_CONCURRENCY'] = str(args.workers)
+    print(f"Serving on http://127.0.0.1:{args.port} (log in as doctor_1 .. with password "
+          f"{datagen.PASSWORD})", file=sys.stderr, flush=True)
+    os.chdir(ROOT)
+    os.execve(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                               '--bind', f'127.0.0.1:{args.port}', 'wsgi:app'], env)
+
+def _wait_until_up(base_url, process, timeout=600):
+    deadline = time.time() + timeout
+    client = HttpClient(base_url, timeout=5)
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("The load-test server exited")
+        try:
+            client.request('GET', '/api/')
+            return
+        except OSError:
+            time.sleep(0.5)
+        finally:
+            client.close()
+    raise SystemExit(f"The load-test server did not start within {timeout}s")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='run the main API on SQLite + simple cache')
+    run_parser = commands.add_parser('run', help='generate load against a running API')
+    for sub in (serve_parser, run_parser):
+        sub.add_argument('--port', type=int, default=5001)
+        sub.add_argument('--visits', type=int, default=100_000, help='dataset size when seeding')
+        sub.add_argument('--db', help='SQLite file (default: a per-size file in the temp dir)')
+        sub.add_argument('--seed', type=int, default=0)
+        sub.add_argument('--workers', type=int, help='gunicorn workers (default: WEB_CONCURRENCY or 2 x CPUs + 1)')
+
+    run_parser.add_argument('--serve', action='store_true', help='start `serve` in a subprocess first')
+    run_parser.add_argument('--base-url', default=None, help='default: http://127.0.0.1:<port>')
+    run_parser.add_argument('--analytics-url', help='analytics service to poll, e.g. http://127.0.0.1:5002')
+    run_parser.add_argument('--users', type=int, default=20, help='concurrent doctors')
+    run_parser.add_argument('--dashboards', type=int, default=2, help='concurrent dashboard pollers')
+    run_parser.add_argument('--duration', type=float, default=60, help='seconds')
+    run_parser.add_argument('--ramp-up', type=float, default=5, help='seconds over which users start')
+    run_parser.add_argument('--think-time', type=float, default=0.5, help='mean seconds between doctor actions')
+    run_parser.add_argument('--poll-interval', type=float, default=5, help='seconds between dashboard polls')
+    run_parser.add_argument('--doctors', type=int, default=5, help='distinct doctor accounts to log in as')
+    run_parser.add_argument('--first-doctor', type=int, default=1)
+    run_parser.add_argument('--username-template', default='doctor_{n}')
+    run_parser.add_argument('--password', default='password123')
+    run_parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args(argv)
+    if args.command == 'run' and args.base_url is None:
+        args.base_url = f'http://127.0.0.1:{args.port}'
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'serve':
+        serve(args)
+        return 0
+
+    server = None
+    if args.serve:
+        command = [sys.executable, '-m', 'benchmarks.loadtest', 'serve', '--port', str(args.port),
+                   '--visits', str(args.visits), '--seed', str(args.seed)]
+        if args.db:
+            command += ['--db', args.db]
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        if server is not None:
+            _wait_until_up(args.base_url, server)
+        result = run(args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
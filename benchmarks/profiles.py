@@ -0,0 +1,129 @@
+"""
+Throughput of the development and production config profiles.
+
+    python -m benchmarks.profiles --visits 10000 --requests 2000
+
+The development profile runs with DEBUG, SQL echo and debug logging; the
+production profile has all of it off (app_config.ProductionConfig). Each
+profile runs in its own process, on a copy of the same seeded SQLite
+database, with the simple cache: doctors create a visit, then read the
+patient and their visits (query strings bypass the response cache).
+Logs go to /dev/null, so the numbers are the cost of producing them, not
+of a slow terminal.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+PROFILES = ('development', 'production')
+
+def seed(path, visits, seed_value):
+    from app import create_app, datagen
+    from app.app_extensions import db
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    with app.app_context():
+        db.create_all()
+        counts = datagen.generate(visits, seed=seed_value)
+        db.session.remove()
+        db.engine.dispose()
+    return counts
+
+def worker(profile, db_path, counts, requests, result_path):
+    """Runs in a subprocess: the profile's config is read from the environment at import time"""
+    os.environ['APP_CONFIG'] = profile
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    import random
+    from app import create_app
+    from app.app_extensions import cache
+    from benchmarks.run import summarize
+    from flask_jwt_extended import create_access_token
+
+    app = create_app()
+    app.config['CACHE_TYPE'] = 'simple'
+    cache.init_app(app)
+    doctor_id = counts['doctor_ids'][0]
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(doctor_id))}'}
+    client = app.test_client()
+    rng = random.Random(0)
+
+    def one_round(i, latencies):
+        patient_id = rng.randint(1, counts['patients'])
+        calls = (
+            ('POST /api/visits', lambda: client.post('/api/visits', headers=headers, json={
+                'patient_id': patient_id, 'doctor_id': doctor_id, 'diagnosis': 'Seasonal flu'})),
+            ('GET /api/patients/{id}', lambda: client.get(f'/api/patients/{patient_id}?n={i}', headers=headers)),
+            ('GET /api/patients/{id}/visits',
+             lambda: client.get(f'/api/patients/{patient_id}/visits?n={i}', headers=headers))
+        )
+        for name, call in calls:
+            started = perf_counter()
+            response = call()
+            latencies.setdefault(name, []).append((perf_counter() - started) * 1000)
+            assert response.status_code < 400, (name, response.status_code)
+
+    for i in range(20):
+        one_round(-i - 1, {})
+    latencies = {}
+    rounds = max(1, requests // 3)
+    started = perf_counter()
+    for i in range(rounds):
+        one_round(i, latencies)
+    elapsed = perf_counter() - started
+
+    with open(result_path, 'w') as f:
+        json.dump({
+            'requests': rounds * 3,
+            'requests_per_second': round(rounds * 3 / elapsed, 1),
+            'by_request': {name: summarize(samples) for name, samples in latencies.items()}
+        }, f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--visits', type=int, default=10_000, help='dataset size')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per profile')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--counts', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker(args.worker, args.db, json.loads(args.counts), args.requests, args.result)
+        return 0
+
+    results = {'visits': args.visits, 'profiles': {}}
+    with tempfile.TemporaryDirectory(prefix='prms-profiles-') as work_dir:
+        seeded = os.path.join(work_dir, 'seeded.db')
+        counts = seed(seeded, args.visits, args.seed)
+        for profile in PROFILES:
+            db_path = os.path.join(work_dir, f'{profile}.db')
+            shutil.copyfile(seeded, db_path)
+            result_path = os.path.join(work_dir, f'{profile}.json')
+            subprocess.run([sys.executable, '-m', 'benchmarks.profiles', '--worker', profile, '--db', db_path,
+                            '--counts', json.dumps(counts), '--requests', str(args.requests),
+                            '--result', result_path],
+                           cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            with open(result_path) as f:
+                results['profiles'][profile] = json.load(f)
+
+    print(f"{'profile':<12} {'req/s':>8}  p50 ms per request")
+    for profile, result in results['profiles'].items():
+        p50s = ', '.join(f"{name} {stats['p50']:.2f}" for name, stats in result['by_request'].items())
+        print(f"{profile:<12} {result['requests_per_second']:>8}  {p50s}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
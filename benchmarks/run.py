@@ -0,0 +1,335 @@
+"""
+Endpoint benchmarks for the main API.
+
+    python -m benchmarks.run --sizes 10000 100000 1000000
+    python -m benchmarks.run --sizes 10000 --baseline benchmarks/results/baseline.json
+
+For each dataset size the database is seeded once with app/datagen.py
+(kept in --data-dir so later runs reuse it) and every route in app/routes.py is
+timed in process through the Flask test client, on SQLite with the
+`simple` cache, so no network or server is needed. Routes wrapped in
+@cache_response are timed in three modes:
+
+- cold: the first request after startup, with an empty response cache
+- cache_miss: the cache is cleared before every request
+- cache_hit: the response is served from the cache
+
+and other routes as cold and warm. Each mode reports p50/p95/p99/mean
+latency in milliseconds; peak Python memory (tracemalloc) is measured on
+one extra request per route. Results are written as JSON to --output.
+With --baseline, modes whose p95 got slower than the baseline by more
+than --threshold (and by at least MIN_REGRESSION_MS) are listed and the
+exit status is 1.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+from app import create_app
+from app.app_extensions import cache, db
+from flask_jwt_extended import create_access_token
+from app import datagen
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+DATA_DIR = os.path.join(os.path.dirname(__file__), '.data')
+
+# Ignore p95 changes smaller than this, whatever the ratio
+MIN_REGRESSION_MS = 1.0
+
+def route_specs(counts):
+    """
+    endpoint -> (method, path, json body, token). path and body may be
+    callables of the iteration number, for writes that need fresh targets.
+    Deletes take ids from the end of the table so reads keep their rows.
+    """
+    patient = max(1, counts['patients'] // 2)
+    visit = max(1, counts['visits'] // 2)
+    prescription = max(1, counts['prescriptions'] // 2)
+    report = max(1, counts['reports'] // 2)
+    first_doctor, last_doctor = counts['doctor_ids']
+    doctor = lambda i: first_doctor + i % (last_doctor - first_doctor + 1)
+    new_patient = lambda i: {'name': f'Bench {i}', 'age': 40 + i % 30, 'contact_info': 'bench@example.com'}
+    return {
+        'api.welcome': ('GET', '/api/', None, 'doctor'),
+        'api.login': ('POST', '/api/login', {'username': f'doctor_{first_doctor}', 'password': datagen.PASSWORD}, None),
+        'api.logout_route': ('POST', '/api/logout', None, 'doctor'),
+        'api.setup_doctors': ('POST', '/api/setup-doctors', None, None),
+        'api.get_all_patients': ('GET', '/api/patients', None, 'doctor'),
+        'api.create_patient': ('POST', '/api/patients', new_patient, 'doctor'),
+        'api.get_patient': ('GET', f'/api/patients/{patient}', None, 'doctor'),
+        'api.update_patient': ('PUT', f'/api/patients/{patient}', lambda i: {'age': 20 + i % 50}, 'doctor'),
+        'api.delete_patient': ('DELETE', lambda i: f"/api/patients/{counts['patients'] - i}", None, 'doctor'),
+        'api.get_patient_visits': ('GET', f'/api/patients/{patient}/visits', None, 'doctor'),
+        'api.get_patient_prescriptions': ('GET', f'/api/patients/{patient}/prescriptions', None, 'doctor'),
+        'api.get_patient_reports': ('GET', f'/api/patients/{patient}/reports', None, 'doctor'),
+        'api.get_visit': ('GET', f'/api/visits/{visit}', None, 'doctor'),
+        'api.create_visit': ('POST', '/api/visits',
+                             lambda i: {'patient_id': patient, 'doctor_id': doctor(i), 'diagnosis': 'Flu'},
+                             'doctor'),
+        'api.get_all_visits': ('GET', '/api/visits', None, 'doctor'),
+        'api.get_visit_timeline': ('GET', '/api/visits/timeline', None, 'doctor'),
+        'api.get_all_prescriptions': ('GET', '/api/prescriptions', None, 'doctor'),
+        'api.get_prescription_by_id': ('GET', f'/api/prescriptions/{prescription}', None, 'doctor'),
+        'api.create_prescription': ('POST', '/api/prescriptions', lambda i: {
+            'patient_id': patient, 'doctor_id': doctor(i),
+            'drug_name': 'Aspirin', 'dosage': '500mg', 'duration': 5
+        }, 'doctor'),
+        'api.get_dashboard_stats': ('GET', '/api/dashboard/stats', None, 'doctor'),
+        'api.get_all_reports': ('GET', '/api/reports', None, 'doctor'),
+        'api.create_report': ('POST', '/api/reports',
+                              {'patient_id': patient, 'report_type': 'lab', 'report_data': 'ok'}, 'doctor'),
+        'api.delete_report': ('DELETE', lambda i: f"/api/reports/{counts['reports'] - i}", None, 'doctor'),
+        'api.get_report': ('GET', f'/api/reports/{report}', None, 'doctor'),
+        'api.list_profiles': ('GET', '/api/admin/profiles', None, 'admin'),
+        'api.download_profile': ('GET', '/api/admin/profiles/bench.collapsed', None, 'admin'),
+        'api.list_slow_queries': ('GET', '/api/admin/slow-queries', None, 'admin'),
+    }
+
+# Destructive routes run last, so the reads above see the full dataset
+RUN_LAST = ('api.setup_doctors', 'api.delete_report', 'api.delete_patient')
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        'n': len(ordered),
+        'p50': round(percentile(ordered, 50), 3),
+        'p95': round(percentile(ordered, 95), 3),
+        'p99': round(percentile(ordered, 99), 3),
+        'mean': round(sum(ordered) / len(ordered), 3)
+    }
+
+class RouteTimer:
+    def __init__(self, client, tokens):
+        self.client = client
+        self.tokens = tokens
+        self.calls = {}
+        self.errors = 0
+
+    def request(self, spec):
+        """One request; returns its latency in ms (body included, for streamed responses)"""
+        method, path, body, token = spec
+        # Iteration number of this route, for paths and bodies that need fresh targets
+        i = self.calls.get(id(spec), 0)
+        self.calls[id(spec)] = i + 1
+        headers = {'Authorization': f'Bearer {self.tokens[token]}'} if token else {}
+        started = perf_counter()
+        response = self.client.open(path(i) if callable(path) else path, method=method,
+                                    json=body(i) if callable(body) else body, headers=headers)
+        response.get_data()
+        elapsed = (perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            self.errors += 1
+        return elapsed
+
+    def sample(self, spec, iterations, max_seconds, before=None):
+        """Latencies of up to `iterations` requests, stopping after max_seconds (at least 3 samples)"""
+        samples = []
+        deadline = perf_counter() + max_seconds
+        while len(samples) < iterations and (len(samples) < 3 or perf_counter() < deadline):
+            if before is not None:
+                before()
+            samples.append(self.request(spec))
+        return samples
+
+    def peak_memory_kb(self, spec, before=None):
+        if before is not None:
+            before()
+        tracemalloc.start()
+        try:
+            self.request(spec)
+            return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+
+def prepare_database(rows, data_dir, work_dir):
+    """Seeded database file for `rows`, copied so benchmark writes don't touch the cached one"""
+    os.makedirs(data_dir, exist_ok=True)
+    seeded = os.path.join(data_dir, f'bench-{rows}.db')
+    counts_file = seeded + '.json'
+    if not (os.path.exists(seeded) and os.path.exists(counts_file)):
+        app = make_app(seeded + '.tmp')
+        started = perf_counter()
+        with app.app_context():
+            db.create_all()
+            counts = datagen.generate(rows)
+            db.session.remove()
+            db.engine.dispose()
+        os.replace(seeded + '.tmp', seeded)
+        with open(counts_file, 'w') as f:
+            json.dump(counts, f)
+        print(f"Seeded {rows} rows in {perf_counter() - started:.1f}s", file=sys.stderr)
+    with open(counts_file) as f:
+        counts = json.load(f)
+    working = os.path.join(work_dir, f'bench-{rows}.db')
+    shutil.copyfile(seeded, working)
+    return working, counts
+
+def make_app(db_path, profile_dir=None):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SERVER_TIMING_SAMPLE_RATE'] = 0
+    if profile_dir:
+        app.config['PROFILER_DIR'] = profile_dir
+    app.logger.setLevel(logging.CRITICAL)
+    return app
+
+def benchmark_size(rows, args, work_dir):
+    db_path, counts = prepare_database(rows, args.data_dir, work_dir)
+    profile_dir = os.path.join(work_dir, 'profiles')
+    os.makedirs(profile_dir, exist_ok=True)
+    with open(os.path.join(profile_dir, 'bench.collapsed'), 'w') as f:
+        f.write('main (bench.py:1) 1\n')
+
+    app = make_app(db_path, profile_dir)
+    with app.app_context():
+        tokens = {
+            'doctor': create_access_token(identity=str(counts['doctor_ids'][0])),
+            'admin': create_access_token(identity=str(counts['admin_id']))
+        }
+        cache.clear()
+
+    specs = route_specs(counts)
+    missing = sorted(endpoint for endpoint in app.view_functions
+                     if endpoint.startswith('api.') and endpoint not in specs)
+    if missing:
+        raise SystemExit(f"No benchmark spec for: {', '.join(missing)}")
+
+    order = [e for e in specs if e not in RUN_LAST] + list(RUN_LAST)
+    if args.routes:
+        order = [e for e in order if any(name in e for name in args.routes)]
+
+    results = {}
+    with app.test_client() as client:
+        timer = RouteTimer(client, tokens)
+        for endpoint in order:
+            spec = specs[endpoint]
+            cached = getattr(app.view_functions[endpoint], 'cached_response', False)
+            errors_before = timer.errors
+            modes = {'cold': summarize([timer.request(spec)])}
+            if cached:
+                modes['cache_miss'] = summarize(timer.sample(spec, args.iterations, args.route_seconds,
+                                                             before=cache.clear))
+                timer.request(spec)
+                modes['cache_hit'] = summarize(timer.sample(spec, args.iterations, args.route_seconds))
+                peak = timer.peak_memory_kb(spec, before=cache.clear)
+            else:
+                modes['warm'] = summarize(timer.sample(spec, args.iterations, args.route_seconds))
+                peak = timer.peak_memory_kb(spec)
+            results[endpoint] = {
+                'modes': modes,
+                'peak_memory_kb': peak,
+                'errors': timer.errors - errors_before
+            }
+            print(f"{rows:>9} {endpoint:<32} " + ' '.join(
+                f"{mode}={stats['p50']:.2f}/{stats['p95']:.2f}ms" for mode, stats in modes.items()), file=sys.stderr)
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    return {'counts': counts, 'routes': results}
+
+def compare(current, baseline, threshold):
+    """Regressions of p95 latency against a baseline results file"""
+    regressions = []
+    for size, data in current['sizes'].items():
+        base_routes = baseline.get('sizes', {}).get(size, {}).get('routes', {})
+        for endpoint, result in data['routes'].items():
+            for mode, stats in result['modes'].items():
+                base = base_routes.get(endpoint, {}).get('modes', {}).get(mode)
+                if base is None:
+                    continue
+                if stats['p95'] > base['p95'] * (1 + threshold) and stats['p95'] - base['p95'] >= MIN_REGRESSION_MS:
+                    regressions.append({
+                        'size': size,
+                        'endpoint': endpoint,
+                        'mode': mode,
+                        'baseline_p95': base['p95'],
+                        'p95': stats['p95'],
+                        'change': round(stats['p95'] / base['p95'] - 1, 3) if base['p95'] else None
+                    })
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='dataset sizes, in visits (default: 10k 100k 1M)')
+    parser.add_argument('--iterations', type=int, default=30, help='requests per route and mode')
+    parser.add_argument('--route-seconds', type=float, default=10,
+                        help='stop sampling a route and mode after this long (at least 3 requests)')
+    parser.add_argument('--routes', nargs='*', help='only endpoints containing one of these names')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='where seeded databases are kept between runs')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='results file to compare p95 latencies against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed p95 slowdown against the baseline (default: 0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'iterations': args.iterations
+        },
+        'sizes': {}
+    }
+    # make_app silences the app's error logs (expected 4xx/5xx paths); put them back afterwards
+    app_logger = logging.getLogger('app')
+    log_level = app_logger.level
+    try:
+        with tempfile.TemporaryDirectory(prefix='prms-bench-') as work_dir:
+            for rows in args.sizes:
+                results['sizes'][str(rows)] = benchmark_size(rows, args, work_dir)
+    finally:
+        app_logger.setLevel(log_level)
+    # ru_maxrss is in KiB on Linux
+    results['meta']['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['size']} {r['endpoint']} {r['mode']}: "
+                  f"p95 {r['baseline_p95']:.2f}ms -> {r['p95']:.2f}ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
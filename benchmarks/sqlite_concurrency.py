@@ -0,0 +1,148 @@
+"""
+Concurrent read/write throughput on SQLite, before and after the tuning in
+app/database.py.
+
+    python -m benchmarks.sqlite_concurrency --visits 100000 --readers 8 --writers 2 --duration 10
+
+Each configuration gets a fresh copy of the same seeded database. Reader
+threads fetch patients' visits (with a query string so the response cache
+is bypassed), writer threads create visits, all through the app in-process.
+"default" is what the app used before: a new connection per session
+(NullPool), rollback journal, synchronous=FULL and pysqlite's 5s busy
+timeout; "tuned" is the pooled WAL setup. Reported per configuration: reads/s, writes/s,
+p50/p95 latency and errors (mostly "database is locked").
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+from benchmarks.run import summarize
+
+CONFIGURATIONS = {
+    # Flask-SQLAlchemy's NullPool and SQLite's own defaults
+    'default': {'DB_POOL_SIZE': 0, 'SQLITE_PRAGMAS': {'journal_mode': 'DELETE', 'synchronous': 'FULL',
+                                                      'busy_timeout': None, 'cache_size': None, 'mmap_size': 0,
+                                                      'temp_store': 'DEFAULT', 'foreign_keys': 'OFF'}},
+    'tuned': {}
+}
+
+def seed(path, visits, seed_value):
+    from app import create_app, datagen
+    from app.app_extensions import db
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    with app.app_context():
+        db.create_all()
+        counts = datagen.generate(visits, seed=seed_value)
+        db.session.remove()
+        db.engine.dispose()
+    return counts
+
+def make_app(path, overrides):
+    from app import create_app
+    app = create_app('testing')
+    app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}', SERVER_TIMING_SAMPLE_RATE=0, TESTING=False,
+                      **overrides)
+    app.logger.setLevel(logging.CRITICAL)
+    return app
+
+def measure(app, counts, readers, writers, duration):
+    from flask_jwt_extended import create_access_token
+    first_doctor = counts['doctor_ids'][0]
+    with app.app_context():
+        headers = {'Authorization': f"Bearer {create_access_token(identity=str(first_doctor))}"}
+
+    latencies = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(kind, number):
+        rng = random.Random(number)
+        client = app.test_client()
+        i = 0
+        while not stop.is_set():
+            patient_id = rng.randint(1, counts['patients'])
+            started = perf_counter()
+            if kind == 'read':
+                response = client.get(f'/api/patients/{patient_id}/visits?n={number}-{i}', headers=headers)
+            else:
+                response = client.post('/api/visits', headers=headers, json={
+                    'patient_id': patient_id, 'doctor_id': first_doctor, 'diagnosis': 'Checkup'})
+            elapsed = (perf_counter() - started) * 1000
+            with lock:
+                latencies[kind].append(elapsed)
+                if response.status_code >= 400:
+                    errors[kind] += 1
+            i += 1
+
+    threads = [threading.Thread(target=worker, args=('read', n)) for n in range(readers)]
+    threads += [threading.Thread(target=worker, args=('write', readers + n)) for n in range(writers)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+
+    result = {}
+    for kind in ('read', 'write'):
+        samples = latencies[kind]
+        ok = len(samples) - errors[kind]
+        result[kind] = {
+            'per_second': round(ok / elapsed, 1),
+            'errors': errors[kind],
+            **({key: value for key, value in summarize(samples).items() if key in ('n', 'p50', 'p95')}
+               if samples else {})
+        }
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--visits', type=int, default=100_000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per configuration')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    app_logger = logging.getLogger('app')
+    log_level = app_logger.level
+    results = {'visits': args.visits, 'readers': args.readers, 'writers': args.writers, 'configurations': {}}
+    try:
+        with tempfile.TemporaryDirectory(prefix='prms-sqlite-') as work_dir:
+            seeded = os.path.join(work_dir, 'seeded.db')
+            counts = seed(seeded, args.visits, args.seed)
+            for name, overrides in CONFIGURATIONS.items():
+                path = os.path.join(work_dir, f'{name}.db')
+                shutil.copyfile(seeded, path)
+                app = make_app(path, overrides)
+                results['configurations'][name] = measure(app, counts, args.readers, args.writers, args.duration)
+                with app.app_context():
+                    from app.app_extensions import db
+                    db.engine.dispose()
+    finally:
+        app_logger.setLevel(log_level)
+
+    print(f"{'config':<10} {'reads/s':>9} {'p95 ms':>8} {'errors':>7} {'writes/s':>9} {'p95 ms':>8} {'errors':>7}")
+    for name, result in results['configurations'].items():
+        read, write = result['read'], result['write']
+        print(f"{name:<10} {read['per_second']:>9} {read.get('p95', 0):>8.2f} {read['errors']:>7} "
+              f"{write['per_second']:>9} {write.get('p95', 0):>8.2f} {write['errors']:>7}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
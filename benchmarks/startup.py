@@ -0,0 +1,85 @@
+"""
+Application startup time.
+
+    python -m benchmarks.startup --runs 10
+
+Each run is a fresh interpreter with the production profile, pointed at a
+database file that doesn't exist, and measures:
+
+- import: `import app`
+- first_create_app: the first create_app() (imports the routes and the
+  rest of the modules it loads lazily)
+- create_app: later create_app() calls, as in test fixtures
+- first_request: the first request through the test client
+
+It also checks that startup left the database alone (no file created).
+Medians over the runs are printed, and written as JSON with --output.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = r'''
+import json, os, sys
+from time import perf_counter
+started = perf_counter()
+import app
+imported = perf_counter()
+from app import create_app
+application = create_app()
+created = perf_counter()
+again = []
+for _ in range(5):
+    t = perf_counter()
+    create_app()
+    again.append(perf_counter() - t)
+t = perf_counter()
+status = application.test_client().get('/api/').status_code
+served = perf_counter()
+print(json.dumps({
+    'import': (imported - started) * 1000,
+    'first_create_app': (created - imported) * 1000,
+    'create_app': sorted(again)[len(again) // 2] * 1000,
+    'first_request': (served - t) * 1000,
+    'status': status
+}))
+'''
+
+def run_once(db_path):
+    env = dict(os.environ, APP_CONFIG='production', DATABASE_URL=f'sqlite:///{db_path}', LOG_LEVEL='WARNING')
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    output = subprocess.run([sys.executable, '-c', PROBE], env=env, check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='prms-startup-') as work_dir:
+        db_path = os.path.join(work_dir, 'never-created.db')
+        runs = [run_once(db_path) for _ in range(args.runs)]
+        touched = os.path.exists(db_path)
+
+    results = {
+        'runs': args.runs,
+        'median_ms': {key: round(statistics.median(run[key] for run in runs), 2)
+                      for key in ('import', 'first_create_app', 'create_app', 'first_request')},
+        'database_touched': touched
+    }
+    for key, value in results['median_ms'].items():
+        print(f"{key:<18} {value:>8.2f} ms")
+    print(f"database touched: {touched}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if touched else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+gunicorn settings for the main API:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+WEB_CONCURRENCY worker processes (default 2 x CPUs + 1), each with
+WEB_THREADS threads, on PORT. The app is loaded once in the master and
+the workers are forked from it, so they start in milliseconds and share
+its memory; post_fork then drops the database and Redis connections a
+worker would otherwise share with the master.
+
+Reloads: `kill -HUP <master>` replaces the workers gracefully (in-flight
+requests get GRACEFUL_TIMEOUT seconds). With the app preloaded, new code
+needs a new master: `kill -USR2 <master>` starts one next to the old, then
+`kill -TERM <old master>`. MAX_REQUESTS recycles workers after that many
+requests, with jitter, to bound slow memory growth.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+max_requests = int(os.environ.get('MAX_REQUESTS', 10_000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('ACCESS_LOG', '-') or None
+
+# Metric files of every worker (see app/metrics.py)
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# One pooled database connection per thread (app/database.py reads this when the app is loaded)
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+
+def post_fork(server, worker):
+    from app import reset_after_fork
+    reset_after_fork(server.app.wsgi())
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,479 @@
+"""
+Row-by-row aggregators behind the analytics endpoints.
+
+Each aggregator consumes upstream rows one at a time through add() and
+builds its response with result(), so rows can be streamed straight from
+the main API without ever materializing the full dataset. A single pass
+over a dataset can feed several aggregators. The dashboard summary is the
+exception: it is built from the main API's rollup counters
+(dashboard_summary) instead of from rows.
+"""
+import logging
+from array import array
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from sketches import HyperLogLog, SpaceSaving
+
+logger = logging.getLogger(__name__)
+
+def window_start(days):
+    """First day of a `days`-long window ending today"""
+    return datetime.now().date() - timedelta(days=days - 1)
+
+def bucket_visits(daily_visits, granularity):
+    """Roll zero-filled daily counts up into weekly (keyed by Monday) or monthly buckets"""
+    if granularity == 'daily':
+        return dict(daily_visits)
+
+    buckets = {}
+    for date_str, count in daily_visits.items():
+        day = datetime.strptime(date_str, '%Y-%m-%d').date()
+        if granularity == 'weekly':
+            key = (day - timedelta(days=day.weekday())).isoformat()
+        else:
+            key = day.strftime('%Y-%m')
+        buckets[key] = buckets.get(key, 0) + count
+    return buckets
+
+def parse_duration_days(duration):
+    """Prescription duration in days, from an int or a string such as '7 days', or None"""
+    if isinstance(duration, bool):
+        return None
+    if isinstance(duration, (int, float)):
+        return duration
+    if isinstance(duration, str):
+        # Extract numeric value from duration string
+        days_str = ''.join(filter(str.isdigit, duration))
+        if days_str:
+            return int(days_str)
+    return None
+
+class PatientStats:
+    """Total patients, average age and age distribution"""
+
+    def __init__(self):
+        self.total_patients = 0
+        self.age_count = 0
+        self.age_sum = 0
+        self.age_ranges = {
+            '0-18': 0,
+            '19-30': 0,
+            '31-50': 0,
+            '51-70': 0,
+            '70+': 0
+        }
+
+    def add(self, patient):
+        self.total_patients += 1
+        age = patient.get('age')
+        if age is None:
+            return
+        self.age_count += 1
+        self.age_sum += age
+        if age <= 18:
+            self.age_ranges['0-18'] += 1
+        elif age <= 30:
+            self.age_ranges['19-30'] += 1
+        elif age <= 50:
+            self.age_ranges['31-50'] += 1
+        elif age <= 70:
+            self.age_ranges['51-70'] += 1
+        else:
+            self.age_ranges['70+'] += 1
+
+    def result(self):
+        avg_age = self.age_sum / self.age_count if self.age_count else 0
+        return {
+            'total_patients': self.total_patients,
+            'average_age': round(avg_age, 2),
+            'age_distribution': self.age_ranges
+        }
+
+class DailyVisits:
+    """Zero-filled visit counts per day for the last `days` days (today included)"""
+
+    def __init__(self, days):
+        start_date = window_start(days)
+        self.daily_visits = {
+            (start_date + timedelta(days=offset)).isoformat(): 0
+            for offset in range(days)
+        }
+
+    def add(self, visit):
+        try:
+            date_str = datetime.fromisoformat(visit['visit_date']).date().isoformat()
+        except (ValueError, TypeError, KeyError) as e:
+            logger.debug(f"Error processing visit date: {visit.get('visit_date')}, Error: {str(e)}")
+            return
+        # Skip visits outside the window (e.g. upstreams that ignore the filter)
+        if date_str in self.daily_visits:
+            self.daily_visits[date_str] += 1
+
+    def result(self):
+        return self.daily_visits
+
+def visit_trends(daily_visits, days, granularity):
+    """Visit totals and buckets for a window of zero-filled daily counts"""
+    total_visits = sum(daily_visits.values())
+    return {
+        'daily_visits': daily_visits,
+        'granularity': granularity,
+        'visits': bucket_visits(daily_visits, granularity),
+        'total_visits': total_visits,
+        'average_daily_visits': total_visits / days,
+        'period': f"Last {days} days"
+    }
+
+class PrescriptionAnalysis:
+    """Drug usage and duration buckets (approx uses fixed-memory sketches for drug counts)"""
+
+    def __init__(self, approx=False, sketch_bytes=4096):
+        self.approx = approx
+        self.total_prescriptions = 0
+        self.drug_usage = {}
+        if approx:
+            self.distinct_drugs = HyperLogLog.from_memory(sketch_bytes)
+            self.top_drugs = SpaceSaving.from_memory(sketch_bytes)
+        self.duration_analysis = {
+            '1-3 days': 0,
+            '4-7 days': 0,
+            '8-14 days': 0,
+            '15+ days': 0
+        }
+
+    def add(self, prescription):
+        self.total_prescriptions += 1
+
+        # Count drug usage
+        drug = prescription.get('drug_name')
+        if drug and isinstance(drug, str) and drug.strip():
+            drug = drug.strip()  # Remove any whitespace
+            if self.approx:
+                self.distinct_drugs.add(drug)
+                self.top_drugs.add(drug)
+            else:
+                self.drug_usage[drug] = self.drug_usage.get(drug, 0) + 1
+
+        # Analyze duration (the API returns ints; older rows may hold strings)
+        days = parse_duration_days(prescription.get('duration'))
+        if days is not None:
+            if days <= 3:
+                self.duration_analysis['1-3 days'] += 1
+            elif days <= 7:
+                self.duration_analysis['4-7 days'] += 1
+            elif days <= 14:
+                self.duration_analysis['8-14 days'] += 1
+            else:
+                self.duration_analysis['15+ days'] += 1
+
+    def result(self):
+        if self.approx:
+            top = self.top_drugs.top(5)
+            return {
+                'total_prescriptions': self.total_prescriptions,
+                'unique_drugs': self.distinct_drugs.count(),
+                'most_prescribed_drugs': {drug: count for drug, count, _ in top},
+                'duration_analysis': self.duration_analysis,
+                'approximate': True,
+                'unique_drugs_relative_error': round(self.distinct_drugs.relative_error, 4),
+                'most_prescribed_max_overcount': max((error for _, _, error in top), default=0)
+            }
+
+        # Sort drugs by usage
+        sorted_drugs = sorted(self.drug_usage.items(), key=lambda x: x[1], reverse=True)
+        most_prescribed = dict(sorted_drugs[:5])  # Top 5 most prescribed drugs
+
+        return {
+            'total_prescriptions': self.total_prescriptions,
+            'unique_drugs': len(self.drug_usage),
+            'most_prescribed_drugs': most_prescribed,
+            'duration_analysis': self.duration_analysis
+        }
+
+class DoctorWorkload:
+    """
+    Per-doctor visits, prescriptions and diagnoses (approx counts diagnoses
+    with sketches). Prescriptions are only attributed to doctors that have
+    visits; visits and prescriptions may be fed in any order.
+    """
+
+    def __init__(self, approx=False, sketch_bytes=4096):
+        self.approx = approx
+        self.sketch_bytes = sketch_bytes
+        self.doctor_stats = {}
+        self.prescriptions = {}
+
+    def add_visit(self, visit):
+        doctor_id = visit.get('doctor_id')
+        if not doctor_id:
+            return
+        if doctor_id not in self.doctor_stats:
+            self.doctor_stats[doctor_id] = {
+                'name': f"Doctor {doctor_id}",  # Use ID as name since we don't have doctor names
+                'visits': 0,
+                'diagnoses': HyperLogLog.from_memory(self.sketch_bytes) if self.approx else set()
+            }
+        self.doctor_stats[doctor_id]['visits'] += 1
+        diagnosis = visit.get('diagnosis')
+        if diagnosis:
+            self.doctor_stats[doctor_id]['diagnoses'].add(diagnosis)
+
+    def add_prescription(self, prescription):
+        doctor_id = prescription.get('doctor_id')
+        if doctor_id:
+            self.prescriptions[doctor_id] = self.prescriptions.get(doctor_id, 0) + 1
+
+    def result(self):
+        # Convert sets to lists (or sketches to counts) for JSON serialization
+        doctor_stats = {}
+        relative_error = None
+        for doctor_id, stats in self.doctor_stats.items():
+            stats = dict(stats)
+            stats['prescriptions'] = self.prescriptions.get(doctor_id, 0)
+            if self.approx:
+                sketch = stats.pop('diagnoses')
+                stats['distinct_diagnoses'] = sketch.count()
+                relative_error = round(sketch.relative_error, 4)
+            else:
+                stats['diagnoses'] = list(stats['diagnoses'])
+            doctor_stats[doctor_id] = stats
+
+        result = {
+            'total_doctors': len(doctor_stats),
+            'doctor_stats': doctor_stats
+        }
+        if self.approx:
+            result['approximate'] = True
+            result['distinct_diagnoses_relative_error'] = relative_error
+        return result
+
+# Rollup counters the main API maintains for the dashboard
+DASHBOARD_STATS = 'dashboard/stats'
+
+def dashboard_summary(stats, sections, days, granularity):
+    """
+    Summary sections from a /api/dashboard/stats?days=`days` response, shaped
+    like the matching endpoints (without the duration buckets and diagnoses,
+    which the rollups do not keep).
+    """
+    result = {}
+    if 'patient_stats' in sections:
+        result['patient_stats'] = {key: stats[key] for key in ('total_patients', 'average_age', 'age_distribution')}
+    if 'visit_trends' in sections:
+        daily_visits = DailyVisits(days).result()
+        for day, count in stats['daily_visits'].items():
+            if day in daily_visits:
+                daily_visits[day] = count
+        result['visit_trends'] = visit_trends(daily_visits, days, granularity)
+    if 'prescription_analysis' in sections:
+        result['prescription_analysis'] = {
+            key: stats[key] for key in ('total_prescriptions', 'unique_drugs', 'most_prescribed_drugs')
+        }
+    if 'doctor_workload' in sections:
+        # Like DoctorWorkload, only doctors with visits are listed
+        doctor_stats = {
+            doctor_id: {'name': f"Doctor {doctor_id}", 'visits': counts['visits'], 'prescriptions': counts['prescriptions']}
+            for doctor_id, counts in stats['doctor_stats'].items() if counts['visits'] > 0
+        }
+        result['doctor_workload'] = {'total_doctors': len(doctor_stats), 'doctor_stats': doctor_stats}
+    return result
+
+# Columnar (patient_id, visit_time) export of every visit in the main API
+VISIT_TIMELINE = 'visits/timeline'
+
+# Upstream dataset each distribution metric is computed from
+DISTRIBUTION_METRICS = {
+    'age': 'patients',
+    'duration': 'prescriptions',
+    'visits_per_patient': VISIT_TIMELINE,
+    'days_between_visits': VISIT_TIMELINE
+}
+
+def read_visit_timeline(files):
+    """
+    (patient_ids, seconds) int64 arrays from the CSV pages of the visit
+    timeline export, parsed in C by pandas rather than row by row.
+    """
+    frames = [pd.read_csv(file, usecols=['patient_id', 'visit_time'], dtype=np.int64) for file in files]
+    if not frames:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    frame = pd.concat(frames) if len(frames) > 1 else frames[0]
+    return frame['patient_id'].to_numpy(np.int64), frame['visit_time'].to_numpy(np.int64)
+
+def sort_visits(patient_ids, timestamps):
+    """
+    Visits ordered by (patient, time). When both fit, they are packed into one
+    int64 key so a single radix-friendly sort replaces a two-key lexsort.
+    """
+    if patient_ids.size:
+        low_id, high_id = int(patient_ids.min()), int(patient_ids.max())
+        first = int(timestamps.min())
+        span = int(timestamps.max()) - first
+        if (timestamps.dtype.kind == 'i' and low_id >= 0
+                and span < 2 ** 32 and high_id < 2 ** 31):
+            keys = np.sort((patient_ids.astype(np.int64) << 32) | (timestamps - first).astype(np.int64))
+            return keys >> 32, (keys & 0xFFFFFFFF) + first
+    order = np.lexsort((timestamps, patient_ids))
+    return patient_ids[order], timestamps[order]
+
+def run_lengths(sorted_values):
+    """Length of each run of equal values in a sorted array"""
+    if not sorted_values.size:
+        return np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], sorted_values[1:] != sorted_values[:-1], [True])))
+    return np.diff(starts)
+
+def count_distinct_sorted(sorted_values):
+    return int(np.count_nonzero(sorted_values[1:] != sorted_values[:-1])) + 1 if sorted_values.size else 0
+
+def gaps_between_visits(patient_ids, timestamps):
+    """
+    Time between each patient's consecutive visits, from visits already
+    sorted by (patient, time) (see sort_visits): diff, and keep the diffs
+    within the same patient. Returns (patient_ids, gaps), sorted by patient,
+    for every visit that has a successor.
+    """
+    same_patient = patient_ids[1:] == patient_ids[:-1]
+    return patient_ids[:-1][same_patient], np.diff(timestamps)[same_patient]
+
+class MetricValues:
+    """
+    Numeric values of one row-based distribution metric (age or duration),
+    collected from streamed rows into a compact array (8 bytes per value).
+    """
+
+    def __init__(self, metric):
+        self.metric = metric
+        self._values = array('d')
+
+    def add(self, row):
+        if self.metric == 'age':
+            value = row.get('age')
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self._values.append(value)
+        else:
+            value = parse_duration_days(row.get('duration'))
+            if value is not None:
+                self._values.append(value)
+
+    def values(self):
+        return np.frombuffer(self._values, dtype=np.float64) if self._values else np.empty(0)
+
+def visit_metric_values(metric, patient_ids, seconds):
+    """Values of a visit-timeline distribution metric, vectorized"""
+    if metric == 'visits_per_patient':
+        return run_lengths(np.sort(patient_ids)).astype(np.float64)
+    _, gaps = gaps_between_visits(*sort_visits(patient_ids, seconds))
+    return gaps / 86400
+
+def distribution(values, bins=10, percentiles=(50, 90, 99)):
+    """
+    Histogram and percentiles of a numeric array. `bins` is either a number of
+    equal-width bins or a sequence of increasing edges; with explicit edges,
+    values outside them are counted in `below` / `above`.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = {'count': int(values.size)}
+    if not values.size:
+        result.update({
+            'min': None,
+            'max': None,
+            'mean': None,
+            'percentiles': {f"p{p:g}": None for p in percentiles},
+            'histogram': []
+        })
+        return result
+
+    if isinstance(bins, int):
+        edges = np.histogram_bin_edges(values, bins=bins)
+        below = above = 0
+    else:
+        edges = np.asarray(bins, dtype=np.float64)
+        below = int(np.count_nonzero(values < edges[0]))
+        above = int(np.count_nonzero(values > edges[-1]))
+    counts, _ = np.histogram(values, bins=edges)
+
+    result.update({
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': round(float(values.mean()), 4),
+        'percentiles': {
+            f"p{p:g}": round(float(value), 4)
+            for p, value in zip(percentiles, np.percentile(values, percentiles))
+        },
+        'histogram': [
+            {'start': round(float(start), 4), 'end': round(float(end), 4), 'count': int(count)}
+            for start, end, count in zip(edges[:-1], edges[1:], counts)
+        ]
+    })
+    if not isinstance(bins, int):
+        result['below'] = below
+        result['above'] = above
+    return result
+
+def time_to_next_visit(patient_ids, seconds, within_days=30, percentiles=(50, 90)):
+    """
+    Readmission-style metrics: days from each visit to the same patient's next
+    one, and the share of visits followed by another within `within_days`.
+    """
+    # Sorted once; the gaps reuse the order
+    patient_ids, seconds = sort_visits(patient_ids, seconds)
+    gap_patients, gaps = gaps_between_visits(patient_ids, seconds)
+    gap_days = gaps / 86400
+    total_visits = int(patient_ids.size)
+    revisits = int(np.count_nonzero(gap_days <= within_days))
+
+    if gap_days.size:
+        mean_days = round(float(gap_days.mean()), 2)
+        quantiles = [round(float(value), 2) for value in np.percentile(gap_days, percentiles)]
+    else:
+        mean_days, quantiles = None, [None] * len(percentiles)
+
+    return {
+        'total_visits': total_visits,
+        'total_patients': count_distinct_sorted(patient_ids),
+        'returning_patients': count_distinct_sorted(gap_patients),
+        'within_days': within_days,
+        'revisits_within': revisits,
+        'revisit_rate': round(revisits / total_visits, 4) if total_visits else 0,
+        'mean_days_to_next_visit': mean_days,
+        'days_to_next_visit': {f"p{p:g}": value for p, value in zip(percentiles, quantiles)}
+    }
+
+def visit_cohorts(patient_ids, seconds, periods=12):
+    """
+    Patients grouped by the month of their first visit, with how many of each
+    cohort came back in each of the following `periods` months (month 0 is
+    the cohort month itself).
+    """
+    if not patient_ids.size:
+        return {'periods': periods, 'cohorts': []}
+
+    patient_ids, seconds = sort_visits(patient_ids, seconds)
+    months = seconds.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    # Sorted by (patient, time): each patient's first row holds their cohort month
+    cohort = np.repeat(months[np.concatenate(([True], patient_ids[1:] != patient_ids[:-1]))],
+                       run_lengths(patient_ids))
+    offset = months - cohort
+
+    # Count each patient once per (cohort, month offset)
+    first_in_month = np.concatenate(([True], (patient_ids[1:] != patient_ids[:-1]) | (offset[1:] != offset[:-1])))
+    keep = first_in_month & (offset < periods)
+    cohort, offset = cohort[keep], offset[keep]
+
+    first_cohort = int(cohort.min())
+    cells = np.bincount((cohort - first_cohort) * periods + offset)
+    cells = np.pad(cells, (0, -len(cells) % periods)).reshape(-1, periods)
+
+    cohorts = []
+    for index, counts in enumerate(cells.tolist()):
+        if not counts[0]:
+            continue  # No patient had their first visit that month
+        cohorts.append({
+            'cohort': str(np.datetime64(first_cohort + index, 'M')),
+            'patients': counts[0],
+            'active': counts,
+            'retention': [round(count / counts[0], 4) for count in counts]
+        })
+    return {'periods': periods, 'cohorts': cohorts}
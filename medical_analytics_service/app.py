@@ -2,265 +2,641 @@ from flask import Flask, jsonify, request, send_from_directory
 import requests
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from contextlib import closing
+import json
+import logging
 import os
 from dotenv import load_dotenv
-import json
+import hmac
+from cache import TTLCache
+from streaming import Payload
+from aggregators import (PatientStats, DailyVisits, PrescriptionAnalysis, DoctorWorkload,
+                         MetricValues, DASHBOARD_STATS, DISTRIBUTION_METRICS, VISIT_TIMELINE, dashboard_summary,
+                         distribution, read_visit_timeline,
+                         time_to_next_visit, visit_cohorts, visit_metric_values, visit_trends, window_start)
+from jobs import JobManager, JobQueueFull
+from metrics import REPORT_SECONDS, init_metrics
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__, static_folder='static')
+init_metrics(app)
+
+# Debug logging (request/response details) is off unless ANALYTICS_DEBUG=1
+ANALYTICS_DEBUG = os.getenv('ANALYTICS_DEBUG', '0') == '1'
+if ANALYTICS_DEBUG:
+    app.logger.setLevel(logging.DEBUG)
 
 # Get API configuration from environment variables
 API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:5001/api')
 API_TOKEN = os.getenv('API_TOKEN')
 
-print("DEBUG: API Configuration:")
-print(f"DEBUG: API_BASE_URL: {API_BASE_URL}")
-print(f"DEBUG: API_TOKEN present: {'Yes' if API_TOKEN else 'No'}")
+app.logger.debug(f"API_BASE_URL: {API_BASE_URL}, API_TOKEN present: {'Yes' if API_TOKEN else 'No'}")
 
 # Initialize API headers with token
 API_HEADERS = {
     'Authorization': f'Bearer {API_TOKEN}',
     'Content-Type': 'application/json'
 }
+# UPSTREAM_FORMAT=ndjson asks the main API to stream rows as NDJSON. That keeps
+# the API's memory flat too, but streamed responses carry no ETag to revalidate.
+if os.getenv('UPSTREAM_FORMAT', 'json') == 'ndjson':
+    API_HEADERS['Accept'] = 'application/x-ndjson'
+
+# Visit trends are cached per (window, granularity) for this many seconds
+TRENDS_CACHE_TTL = int(os.getenv('TRENDS_CACHE_TTL', 60))
+TREND_GRANULARITIES = ('daily', 'weekly', 'monthly')
+# The combined dashboard summary is cached for a shorter time
+SUMMARY_CACHE_TTL = int(os.getenv('SUMMARY_CACHE_TTL', 15))
+SUMMARY_SECTIONS = ('patient_stats', 'visit_trends', 'prescription_analysis', 'doctor_workload')
+
+# Upstream payloads stay fresh for UPSTREAM_CACHE_TTL seconds and are then
+# revalidated with If-None-Match. Payloads and computed results share one
+# LRU cache bounded by ANALYTICS_CACHE_MAX_BYTES.
+UPSTREAM_CACHE_TTL = int(os.getenv('UPSTREAM_CACHE_TTL', 30))
+cache = TTLCache(max_bytes=int(os.getenv('ANALYTICS_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+# Upstream bodies are read and parsed in chunks of this size. Bodies larger
+# than UPSTREAM_CACHE_MAX_PAYLOAD are spooled to disk instead of being kept
+# in memory or in the payload cache.
+UPSTREAM_CHUNK_SIZE = int(os.getenv('UPSTREAM_CHUNK_SIZE', 64 * 1024))
+UPSTREAM_CACHE_MAX_PAYLOAD = int(os.getenv('UPSTREAM_CACHE_MAX_PAYLOAD', 8 * 1024 * 1024))
+UPSTREAM_TIMEOUT = int(os.getenv('UPSTREAM_TIMEOUT', 30))
+
+# Token required by the /admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.getenv('ANALYTICS_ADMIN_TOKEN')
+
+# Upper bound on the number of histogram bins /analytics/distribution returns
+MAX_DISTRIBUTION_BINS = int(os.getenv('MAX_DISTRIBUTION_BINS', 200))
 
-print("DEBUG: API Headers:", API_HEADERS)
+# Upper bound on the number of months /analytics/cohorts follows each cohort for
+MAX_COHORT_PERIODS = int(os.getenv('MAX_COHORT_PERIODS', 60))
 
-def fetch_data(endpoint):
-    """Fetch data from the main API with error handling"""
+# Memory budget, in bytes, for each sketch used by the approx=1 modes
+SKETCH_MEMORY_BYTES = int(os.getenv('SKETCH_MEMORY_BYTES', 4096))
+
+http = requests.Session()
+
+class UpstreamError(Exception):
+    """The main API could not be reached or returned an unusable response"""
+
+def _upstream_key(endpoint, params=None):
+    return ('upstream', endpoint, tuple(sorted((params or {}).items())))
+
+def _request(url, params=None, headers=None):
+    app.logger.debug(f"Fetching from {url} with params {params}")
     try:
-        print(f"DEBUG: Fetching from {API_BASE_URL}/{endpoint}")
-        print(f"DEBUG: Using headers: {API_HEADERS}")
-        
-        response = requests.get(f"{API_BASE_URL}/{endpoint}", headers=API_HEADERS)
-        print(f"DEBUG: Response status: {response.status_code}")
-        print(f"DEBUG: Response content: {response.text}")
-        
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                print(f"DEBUG: Parsed JSON data: {data}")
-                return data
-            except json.JSONDecodeError as e:
-                print(f"DEBUG: JSON decode error: {str(e)}")
-                return {"error": f"Failed to decode response: {str(e)}"}
-        else:
-            print(f"DEBUG: Error response: {response.text}")
-            return {"error": f"API returned status {response.status_code}"}
-            
+        response = http.get(url, headers=headers or API_HEADERS, params=params,
+                            stream=True, timeout=UPSTREAM_TIMEOUT)
     except requests.exceptions.RequestException as e:
-        print(f"DEBUG: Request error: {str(e)}")
-        return {"error": f"Failed to fetch data: {str(e)}"}
-    except Exception as e:
-        print(f"DEBUG: Unexpected error: {str(e)}")
-        return {"error": f"Unexpected error: {str(e)}"}
+        raise UpstreamError(f"Failed to fetch data: {str(e)}")
+    app.logger.debug(f"Response status: {response.status_code}")
+    if response.status_code not in (200, 304):
+        response.close()
+        raise UpstreamError(f"API returned status {response.status_code}")
+    return response
+
+def fetch_payload(endpoint, params=None):
+    """
+    Raw body of a main API resource, following Link: rel="next" pagination,
+    without parsing it (see streaming.Payload). Raises UpstreamError if the
+    API cannot be reached or answers with an error.
+
+    Single-page bodies up to UPSTREAM_CACHE_MAX_PAYLOAD bytes are cached and,
+    once stale, revalidated with If-None-Match so unchanged data costs a 304.
+    Larger ones are spooled to disk, so memory stays flat as the dataset grows.
+    """
+    cache_key = _upstream_key(endpoint, params)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return Payload([cached])
+
+    # A stale entry can still be revalidated
+    entry = cache.get_entry(cache_key)
+    headers = dict(API_HEADERS)
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+
+    response = _request(f"{API_BASE_URL}/{endpoint}", params=params, headers=headers)
+    if response.status_code == 304:
+        response.close()
+        if entry is None:
+            raise UpstreamError("API returned status 304 for an uncached resource")
+        cache.renew(cache_key, UPSTREAM_CACHE_TTL)
+        return Payload([entry.value])
+
+    payload = Payload(max_memory=UPSTREAM_CACHE_MAX_PAYLOAD)
+    etag = response.headers.get('ETag')
+    try:
+        while response is not None:
+            with closing(response):
+                payload.start_page(ndjson='ndjson' in response.headers.get('Content-Type', ''))
+                for chunk in response.iter_content(chunk_size=UPSTREAM_CHUNK_SIZE):
+                    payload.write(chunk)
+                payload.end_page()
+                next_url = getattr(response, 'links', {}).get('next', {}).get('url')
+            response = _request(next_url) if next_url else None
+    except BaseException:
+        payload.close()
+        raise
+
+    if payload.body is not None:
+        cache.set(cache_key, payload.pages[0], ttl=UPSTREAM_CACHE_TTL, etag=etag)
+    return payload
+
+def payload_rows(payload):
+    """Parse the rows out of a payload, removing any spooled pages once done"""
+    try:
+        yield from payload.rows(UPSTREAM_CHUNK_SIZE)
+    except ValueError as e:
+        raise UpstreamError(f"Failed to decode response: {str(e)}")
+    finally:
+        payload.close()
+
+def fetch_data(endpoint, params=None):
+    """Rows from the main API, parsed in this process (see fetch_payload)"""
+    return payload_rows(fetch_payload(endpoint, params))
 
 @app.route('/')
 def dashboard():
     """Serve the dashboard page"""
     return send_from_directory('static', 'dashboard.html')
 
+# ------------------- Routes ------------------- #
+
+def _bad_request(message):
+    return jsonify({"error": message, "status": "error"}), 400
+
+# Parameter parsers accept a query string or a JSON object and return
+# (params, None), or (None, error message) for a 400 response.
+
+def _parse_trend_args(args):
+    """Validated (days, granularity)"""
+    try:
+        days = int(args.get('days', 30))
+    except (TypeError, ValueError):
+        days = 30
+    if days <= 0:
+        return None, "Days parameter must be a positive number"
+    granularity = args.get('granularity', 'daily')
+    if granularity not in TREND_GRANULARITIES:
+        return None, f"Granularity must be one of: {', '.join(TREND_GRANULARITIES)}"
+    return (days, granularity), None
+
+def _window_params(days):
+    """Upstream filter for visits inside a `days`-long window ending today"""
+    return {'since': datetime.combine(window_start(days), datetime.min.time()).isoformat()}
+
 @app.route('/analytics/patient-stats')
 def get_patient_stats():
     """Get patient statistics"""
     try:
-        data = fetch_data('patients')
-        if "error" in data:
-            app.logger.error(f"Error in patient stats: {data['error']}")
-            return jsonify({"error": data["error"]}), 500
-            
-        # Process patient data
-        total_patients = len(data)
-        ages = [patient.get('age', 0) for patient in data if patient.get('age') is not None]
-        avg_age = sum(ages) / len(ages) if ages else 0
-        
-        # Calculate age distribution
-        age_ranges = {
-            '0-18': 0,
-            '19-30': 0,
-            '31-50': 0,
-            '51-70': 0,
-            '70+': 0
-        }
-        
-        for age in ages:
-            if age <= 18:
-                age_ranges['0-18'] += 1
-            elif age <= 30:
-                age_ranges['19-30'] += 1
-            elif age <= 50:
-                age_ranges['31-50'] += 1
-            elif age <= 70:
-                age_ranges['51-70'] += 1
-            else:
-                age_ranges['70+'] += 1
-        
-        return jsonify({
-            'total_patients': total_patients,
-            'average_age': round(avg_age, 2),
-            'age_distribution': age_ranges
-        })
+        stats = PatientStats()
+        for patient in fetch_data('patients'):
+            stats.add(patient)
+        return jsonify(stats.result())
+    except UpstreamError as e:
+        app.logger.error(f"Error in patient stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         app.logger.error(f"Unexpected error in patient stats: {str(e)}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+def get_window_daily_counts(days):
+    """
+    Zero-filled visit counts per day for the last `days` days (today included).
+    Only visits inside the window are requested from the main API.
+    """
+    cached = cache.get(('window', days))
+    if cached is not None:
+        return cached
+
+    daily = DailyVisits(days)
+    for visit in fetch_data('visits', params=_window_params(days)):
+        daily.add(visit)
+
+    daily_visits = daily.result()
+    cache.set(('window', days), daily_visits, ttl=TRENDS_CACHE_TTL)
+    return daily_visits
+
 @app.route('/analytics/visit-trends')
 def get_visit_trends():
-    """Get visit trends"""
+    """Get visit trends for the last `days` days at daily, weekly or monthly granularity"""
     try:
-        days = request.args.get('days', default=30, type=int)
-        if days <= 0:
-            return jsonify({
-                "error": "Days parameter must be a positive number",
-                "status": "error"
-            }), 400
-            
-        data = fetch_data('visits')
-        if "error" in data:
-            app.logger.error(f"Error in visit trends: {data['error']}")
-            return jsonify({"error": data["error"]}), 500
-            
-        # Process visit data
-        daily_visits = {}
-        for visit in data:
-            try:
-                # Parse the ISO format date
-                visit_date = datetime.strptime(visit['visit_date'], '%Y-%m-%dT%H:%M:%S.%f')
-                date_str = visit_date.strftime('%Y-%m-%d')
-                daily_visits[date_str] = daily_visits.get(date_str, 0) + 1
-            except (ValueError, TypeError, KeyError) as e:
-                print(f"DEBUG: Error processing visit date: {visit.get('visit_date')}, Error: {str(e)}")
-                continue
-        
-        # Calculate total visits
-        total_visits = sum(daily_visits.values())
-        
-        # Calculate average daily visits
-        avg_daily = total_visits / days if days > 0 else 0
-        
-        return jsonify({
-            'daily_visits': daily_visits,
-            'total_visits': total_visits,
-            'average_daily_visits': avg_daily,
-            'period': f"Last {days} days"
-        })
+        args, error = _parse_trend_args(request.args)
+        if error:
+            return _bad_request(error)
+        days, granularity = args
+
+        cached = cache.get(('trends', days, granularity))
+        if cached is not None:
+            return jsonify(cached)
+
+        result = visit_trends(get_window_daily_counts(days), days, granularity)
+        cache.set(('trends', days, granularity), result, ttl=TRENDS_CACHE_TTL)
+        return jsonify(result)
+    except UpstreamError as e:
+        app.logger.error(f"Error in visit trends: {str(e)}")
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         app.logger.error(f"Unexpected error in visit trends: {str(e)}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+# ------------------- Reports ------------------- #
+# Heavy reports run through `jobs` in two steps. collect_report runs in the
+# server process and only downloads the raw payloads a report reads
+# (REPORTS[name][0] lists them), through the payload cache and its ETag
+# revalidation. run_report then parses those payloads and aggregates the
+# rows in the process pool, so the per-row work never holds the GIL of the
+# server process. Payloads travel to the pool as bytes, or as the paths of
+# the files large ones were spooled to.
+
+class ReportData(dict):
+    """Payloads downloaded for a report, by endpoint; an UpstreamError stands in for a failed download"""
+
+    def payload(self, endpoint):
+        payload = self[endpoint]
+        if isinstance(payload, UpstreamError):
+            raise payload
+        return payload
+
+    def rows(self, endpoint):
+        return payload_rows(self.payload(endpoint))
+
+    def document(self, endpoint):
+        """A payload holding one JSON object rather than rows"""
+        payload = self.payload(endpoint)
+        try:
+            return json.loads(b''.join(file.read() for _, file in payload.files()))
+        except ValueError as e:
+            raise UpstreamError(f"Failed to decode response: {str(e)}")
+        finally:
+            payload.close()
+
+    def visit_timeline(self):
+        """(patient_ids, seconds) arrays of every visit, from the main API's columnar export"""
+        payload = self.payload(VISIT_TIMELINE)
+        try:
+            return read_visit_timeline(file for _, file in payload.files())
+        except ValueError as e:
+            raise UpstreamError(f"Failed to decode response: {str(e)}")
+        finally:
+            payload.close()
+
+    def close(self):
+        for payload in self.values():
+            if isinstance(payload, Payload):
+                payload.close()
+
+def _datasets(*endpoints):
+    """Datasets of a report that reads whole endpoints, whatever its params"""
+    return lambda **params: dict.fromkeys(endpoints)
+
+def prescription_analysis_report(data, approx=False):
+    analysis = PrescriptionAnalysis(approx, SKETCH_MEMORY_BYTES)
+    for prescription in data.rows('prescriptions'):
+        analysis.add(prescription)
+    return analysis.result()
+
+def doctor_workload_report(data, approx=False):
+    workload = DoctorWorkload(approx, SKETCH_MEMORY_BYTES)
+    for visit in data.rows('visits'):
+        workload.add_visit(visit)
+
+    try:
+        for prescription in data.rows('prescriptions'):
+            workload.add_prescription(prescription)
+    except UpstreamError as e:
+        app.logger.warning(f"Doctor workload without prescriptions: {str(e)}")
+
+    return workload.result()
+
+def summary_datasets(sections, days=30, granularity='daily'):
+    """
+    Every section is read from the main API's dashboard rollups, so a full
+    dashboard load costs one small upstream call whatever the data size.
+    """
+    return {DASHBOARD_STATS: {'days': days}}
+
+def summary_report(data, sections, days=30, granularity='daily'):
+    return dashboard_summary(data.document(DASHBOARD_STATS), sections, days, granularity)
+
+def distribution_datasets(metric, bins=10, percentiles=(50, 90, 99)):
+    return {DISTRIBUTION_METRICS[metric]: None}
+
+def distribution_report(data, metric, bins=10, percentiles=(50, 90, 99)):
+    """Histogram and percentiles of one metric, vectorized with numpy"""
+    if DISTRIBUTION_METRICS[metric] == VISIT_TIMELINE:
+        values = visit_metric_values(metric, *data.visit_timeline())
+    else:
+        collected = MetricValues(metric)
+        for row in data.rows(DISTRIBUTION_METRICS[metric]):
+            collected.add(row)
+        values = collected.values()
+    result = distribution(values, bins, percentiles)
+    result['metric'] = metric
+    return result
+
+def time_to_next_visit_report(data, within=30):
+    return time_to_next_visit(*data.visit_timeline(), within_days=within)
+
+def cohorts_report(data, periods=12):
+    return visit_cohorts(*data.visit_timeline(), periods=periods)
+
+# Report name: (upstream datasets to download, as {endpoint: query params}, compute in the pool)
+REPORTS = {
+    'prescription_analysis': (_datasets('prescriptions'), prescription_analysis_report),
+    'doctor_workload': (_datasets('visits', 'prescriptions'), doctor_workload_report),
+    'summary': (summary_datasets, summary_report),
+    'distribution': (distribution_datasets, distribution_report),
+    'time_to_next_visit': (_datasets(VISIT_TIMELINE), time_to_next_visit_report),
+    'cohorts': (_datasets(VISIT_TIMELINE), cohorts_report)
+}
+
+def collect_report(report, params):
+    """Executed in the server process: download the report's payloads, unparsed"""
+    data = ReportData()
+    try:
+        for endpoint, query in REPORTS[report][0](**params).items():
+            try:
+                data[endpoint] = fetch_payload(endpoint, query)
+            except UpstreamError as e:
+                data[endpoint] = e
+    except BaseException:
+        data.close()
+        raise
+    return data
+
+def run_report(report, params, data):
+    """Entry point executed in the worker process: parse the payloads and compute the report"""
+    with REPORT_SECONDS.labels(report).time():
+        return REPORTS[report][1](data, **params)
+
+# Bounded pool for the reports above. ANALYTICS_WORKERS=0 computes them in
+# the request thread instead.
+jobs = JobManager(
+    run_report,
+    cache,
+    collect=collect_report,
+    max_workers=int(os.getenv('ANALYTICS_WORKERS', min(4, os.cpu_count() or 1))),
+    max_pending=int(os.getenv('ANALYTICS_MAX_PENDING_JOBS', 16)),
+    result_ttl=int(os.getenv('REPORT_CACHE_TTL', 30))
+)
+
+def reset_after_fork():
+    """
+    Called in each pre-forked worker (gunicorn.conf.py): use a fresh upstream
+    connection pool and report pool rather than the ones inherited from the
+    master process.
+    """
+    global http
+    http = requests.Session()
+    jobs.after_fork()
+
+def _report_error(name, e):
+    """Error response for a report that failed or could not be queued"""
+    if isinstance(e, JobQueueFull):
+        app.logger.warning(f"Rejected {name}: {str(e)}")
+        return jsonify({"error": "Too many reports in progress, retry later", "status": "error"}), 503
+    if isinstance(e, UpstreamError):
+        app.logger.error(f"Error in {name}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    app.logger.error(f"Unexpected error in {name}: {str(e)}")
+    return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+def _parse_summary_args(args):
+    """Validated summary report params"""
+    sections = args.get('sections')
+    if isinstance(sections, str):
+        sections = [name.strip() for name in sections.split(',') if name.strip()]
+    elif sections is None:
+        sections = list(SUMMARY_SECTIONS)
+    if not isinstance(sections, list) or not sections or any(name not in SUMMARY_SECTIONS for name in sections):
+        return None, f"Sections must be a comma-separated subset of: {', '.join(SUMMARY_SECTIONS)}"
+    trend_args, error = _parse_trend_args(args)
+    if error:
+        return None, error
+    days, granularity = trend_args
+    return {
+        'sections': tuple(sorted(set(sections))),
+        'days': days,
+        'granularity': granularity
+    }, None
+
+def _parse_number_list(value):
+    if isinstance(value, str):
+        value = [item for item in value.split(',') if item.strip()]
+    if not isinstance(value, (list, tuple)):
+        raise ValueError
+    return tuple(float(item) for item in value)
+
+def _parse_distribution_args(args):
+    """Validated distribution report params"""
+    metric = args.get('metric')
+    if metric not in DISTRIBUTION_METRICS:
+        return None, f"Metric must be one of: {', '.join(DISTRIBUTION_METRICS)}"
+
+    bins = args.get('bins', 10)
+    try:
+        if isinstance(bins, str) and ',' not in bins:
+            bins = int(bins)
+        elif not isinstance(bins, int):
+            bins = _parse_number_list(bins)
+    except (TypeError, ValueError):
+        return None, "Bins must be a bin count or comma-separated increasing edges"
+    if isinstance(bins, int):
+        if not 1 <= bins <= MAX_DISTRIBUTION_BINS:
+            return None, f"Bin count must be between 1 and {MAX_DISTRIBUTION_BINS}"
+    elif (not 2 <= len(bins) <= MAX_DISTRIBUTION_BINS + 1
+          or any(high <= low for low, high in zip(bins, bins[1:]))):
+        return None, "Bins must be a bin count or comma-separated increasing edges"
+
+    try:
+        percentiles = _parse_number_list(args.get('percentiles', '50,90,99'))
+    except (TypeError, ValueError):
+        percentiles = ()
+    if not percentiles or any(not 0 <= p <= 100 for p in percentiles):
+        return None, "Percentiles must be comma-separated numbers between 0 and 100"
+
+    return {'metric': metric, 'bins': bins, 'percentiles': percentiles}, None
+
+def _parse_approx(args):
+    try:
+        return int(args.get('approx', 0)) == 1
+    except (TypeError, ValueError):
+        return False
+
+def _parse_approx_args(args):
+    return {'approx': _parse_approx(args)}, None
+
+def _parse_positive_int(args, name, default, maximum):
+    """Validated {name: value} for a bounded whole-number parameter"""
+    try:
+        value = int(args.get(name, default))
+    except (TypeError, ValueError):
+        value = 0
+    if not 1 <= value <= maximum:
+        return None, f"{name} must be a whole number between 1 and {maximum}"
+    return {name: value}, None
+
+def _parse_time_to_next_visit_args(args):
+    return _parse_positive_int(args, 'within', 30, 3650)
+
+def _parse_cohort_args(args):
+    return _parse_positive_int(args, 'periods', 12, MAX_COHORT_PERIODS)
+
+# Query/JSON parameter parsers for each report accepted by POST /analytics/jobs
+REPORT_ARGS = {
+    'prescription_analysis': _parse_approx_args,
+    'doctor_workload': _parse_approx_args,
+    'summary': _parse_summary_args,
+    'distribution': _parse_distribution_args,
+    'time_to_next_visit': _parse_time_to_next_visit_args,
+    'cohorts': _parse_cohort_args
+}
+
 @app.route('/analytics/prescription-analysis')
 def get_prescription_analysis():
-    """Get prescription analysis"""
+    """Get prescription analysis (approx=1 uses fixed-memory sketches for drug counts)"""
     try:
-        data = fetch_data('prescriptions')
-        if "error" in data:
-            app.logger.error(f"Error in prescription analysis: {data['error']}")
-            return jsonify({"error": data["error"]}), 500
-            
-        # Process prescription data
-        drug_usage = {}
-        duration_analysis = {
-            '1-3 days': 0,
-            '4-7 days': 0,
-            '8-14 days': 0,
-            '15+ days': 0
-        }
-        
-        for prescription in data:
-            # Count drug usage
-            drug = prescription.get('drug_name')
-            if drug and isinstance(drug, str) and drug.strip():
-                drug = drug.strip()  # Remove any whitespace
-                drug_usage[drug] = drug_usage.get(drug, 0) + 1
-            
-            # Analyze duration
-            duration = prescription.get('duration', '')
-            if isinstance(duration, str):
-                try:
-                    # Extract numeric value from duration string
-                    days_str = ''.join(filter(str.isdigit, duration))
-                    if days_str:  # Only process if we found digits
-                        days = int(days_str)
-                        if days <= 3:
-                            duration_analysis['1-3 days'] += 1
-                        elif days <= 7:
-                            duration_analysis['4-7 days'] += 1
-                        elif days <= 14:
-                            duration_analysis['8-14 days'] += 1
-                        else:
-                            duration_analysis['15+ days'] += 1
-                except ValueError:
-                    continue
-        
-        # Sort drugs by usage
-        sorted_drugs = sorted(drug_usage.items(), key=lambda x: x[1], reverse=True)
-        most_prescribed = dict(sorted_drugs[:5])  # Top 5 most prescribed drugs
-        
-        return jsonify({
-            'total_prescriptions': len(data),
-            'unique_drugs': len(drug_usage),
-            'most_prescribed_drugs': most_prescribed,
-            'duration_analysis': duration_analysis
-        })
+        return jsonify(jobs.run('prescription_analysis', {'approx': _parse_approx(request.args)}))
     except Exception as e:
-        app.logger.error(f"Unexpected error in prescription analysis: {str(e)}")
-        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+        return _report_error('prescription analysis', e)
 
 @app.route('/analytics/doctor-workload')
 def get_doctor_workload():
-    """Get doctor workload analysis"""
+    """Get doctor workload analysis (approx=1 returns sketch-based distinct diagnosis counts)"""
     try:
-        # Get visits data first
-        visits_data = fetch_data('visits')
-        if "error" in visits_data:
-            app.logger.error(f"Error in doctor workload: {visits_data['error']}")
-            return jsonify({"error": visits_data["error"]}), 500
-            
-        # Process doctor data from visits
-        doctor_stats = {}
-        for visit in visits_data:
-            doctor_id = visit.get('doctor_id')
-            if doctor_id:
-                if doctor_id not in doctor_stats:
-                    doctor_stats[doctor_id] = {
-                        'name': f"Doctor {doctor_id}",  # Use ID as name since we don't have doctor names
-                        'visits': 0,
-                        'prescriptions': 0,
-                        'diagnoses': set()
-                    }
-                doctor_stats[doctor_id]['visits'] += 1
-                diagnosis = visit.get('diagnosis')
-                if diagnosis:
-                    doctor_stats[doctor_id]['diagnoses'].add(diagnosis)
-        
-        # Get prescriptions data
-        prescriptions_data = fetch_data('prescriptions')
-        if "error" not in prescriptions_data:
-            for prescription in prescriptions_data:
-                doctor_id = prescription.get('doctor_id')
-                if doctor_id in doctor_stats:
-                    doctor_stats[doctor_id]['prescriptions'] += 1
-        
-        # Convert sets to lists for JSON serialization
-        for stats in doctor_stats.values():
-            stats['diagnoses'] = list(stats['diagnoses'])
-        
+        return jsonify(jobs.run('doctor_workload', {'approx': _parse_approx(request.args)}))
+    except Exception as e:
+        return _report_error('doctor workload', e)
+
+@app.route('/analytics/summary')
+def get_summary():
+    """
+    All dashboard sections in one response, from the main API's dashboard
+    rollups, cached for SUMMARY_CACHE_TTL seconds.
+    Optional query parameters: sections (comma-separated), days, granularity.
+    """
+    params, error = _parse_summary_args(request.args)
+    if error:
+        return _bad_request(error)
+    try:
+        return jsonify(jobs.run('summary', params, ttl=SUMMARY_CACHE_TTL))
+    except Exception as e:
+        return _report_error('summary', e)
+
+@app.route('/analytics/distribution')
+def get_distribution():
+    """
+    Histogram and percentiles for one metric: age, duration, visits_per_patient
+    or days_between_visits. Optional query parameters: bins (a count, or
+    comma-separated edges such as 0,18,30,50,70,120) and percentiles
+    (comma-separated, default 50,90,99).
+    """
+    params, error = _parse_distribution_args(request.args)
+    if error:
+        return _bad_request(error)
+    try:
+        return jsonify(jobs.run('distribution', params))
+    except Exception as e:
+        return _report_error('distribution', e)
+
+@app.route('/analytics/time-to-next-visit')
+def get_time_to_next_visit():
+    """
+    Days from each visit to the same patient's next one, and the share of
+    visits followed by another within `within` days (default 30).
+    """
+    params, error = _parse_time_to_next_visit_args(request.args)
+    if error:
+        return _bad_request(error)
+    try:
+        return jsonify(jobs.run('time_to_next_visit', params))
+    except Exception as e:
+        return _report_error('time to next visit', e)
+
+@app.route('/analytics/cohorts')
+def get_cohorts():
+    """Patients by first-visit month, and how many return in each of the next `periods` months"""
+    params, error = _parse_cohort_args(request.args)
+    if error:
+        return _bad_request(error)
+    try:
+        return jsonify(jobs.run('cohorts', params))
+    except Exception as e:
+        return _report_error('cohorts', e)
+
+# ------------------- Report Jobs ------------------- #
+
+@app.route('/analytics/jobs', methods=['POST'])
+def submit_job():
+    """
+    Start a report in the background. Body: {"report": <name>, "params": {...}}
+    where params are the query parameters of the matching /analytics endpoint.
+    Poll the returned status_url until the status is done or failed.
+    """
+    data = request.get_json(silent=True) or {}
+    report = data.get('report')
+    if report not in REPORTS:
         return jsonify({
-            'total_doctors': len(doctor_stats),
-            'doctor_stats': doctor_stats
-        })
+            "error": f"Report must be one of: {', '.join(REPORTS)}",
+            "status": "error"
+        }), 400
+
+    args = data.get('params') or {}
+    if not isinstance(args, dict):
+        return jsonify({"error": "params must be an object", "status": "error"}), 400
+    params, error = REPORT_ARGS[report](args)
+    if error:
+        return _bad_request(error)
+    ttl = SUMMARY_CACHE_TTL if report == 'summary' else None
+
+    try:
+        job = jobs.submit(report, params, ttl=ttl)
     except Exception as e:
-        app.logger.error(f"Unexpected error in doctor workload: {str(e)}")
-        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+        return _report_error(report, e)
+    body = job.to_dict()
+    body['status_url'] = f"/analytics/jobs/{job.job_id}"
+    return jsonify(body), 202
+
+@app.route('/analytics/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a submitted report, with its result once done"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found", "status": "error"}), 404
+    return jsonify(job.to_dict())
+
+# ------------------- Admin Routes ------------------- #
+
+def _is_admin():
+    supplied = request.headers.get('Authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, f'Bearer {ADMIN_TOKEN}')
+
+@app.route('/admin/cache', methods=['GET'])
+def cache_stats():
+    """Cache size and hit/miss/revalidation counters"""
+    if not _is_admin():
+        return jsonify({"error": "Admin token required"}), 403
+    return jsonify(cache.stats())
+
+@app.route('/admin/cache/flush', methods=['POST'])
+def flush_cache():
+    """Drop every cached upstream payload and computed result"""
+    if not _is_admin():
+        return jsonify({"error": "Admin token required"}), 403
+    cache.clear()
+    return jsonify({"message": "Cache flushed"})
 
 @app.route('/test/raw-data')
 def test_raw_data():
     """Test endpoint to see raw data from main API"""
     try:
-        visits = fetch_data('visits')
-        prescriptions = fetch_data('prescriptions')
+        visits = list(fetch_data('visits'))
+        prescriptions = list(fetch_data('prescriptions'))
         
         return jsonify({
             'visits': visits,
@@ -285,4 +661,9 @@ def debug_config():
     })
 
 if __name__ == '__main__':
-    app.run(port=5002, debug=True) 
\ No newline at end of file
+    # ANALYTICS_MODE=async serves the same API with aiohttp (see async_app.py)
+    if os.getenv('ANALYTICS_MODE', 'sync') == 'async':
+        import async_app
+        async_app.main(port=5002)
+    else:
+        app.run(port=5002, debug=True) 
\ No newline at end of file
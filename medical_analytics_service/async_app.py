@@ -0,0 +1,381 @@
+"""
+Asyncio mode of the analytics service (ANALYTICS_MODE=async).
+
+Serves the same /analytics endpoints as app.py with aiohttp. Upstream calls
+use a shared aiohttp session, so waiting on the main API does not occupy a
+thread. Patient stats and visit trends are parsed chunk by chunk with the
+push parsers in streaming.py and fed to the same aggregators. The summary
+and the heavy reports are the ones in app.REPORTS: their payloads are
+downloaded on that session (collect_report) and only then handed to the
+process pool (`app.jobs`), which is awaited without blocking the event loop.
+
+Configuration, the cache, parameter parsing and report definitions are
+shared with app.py; the sync Flask app remains the default.
+"""
+import asyncio
+import functools
+import hmac
+import logging
+import os
+from time import perf_counter
+
+import aiohttp
+from aiohttp import web
+
+import app as analytics
+from aggregators import PatientStats, DailyVisits, visit_trends
+from jobs import JobQueueFull
+from metrics import CONTENT_TYPE_LATEST, IN_PROGRESS, metrics_payload, observe_request
+from streaming import JsonArrayParser, NdjsonParser, Payload, iter_body
+
+logger = logging.getLogger('analytics.async')
+
+# Concurrent connections to the main API per process
+UPSTREAM_CONNECTIONS = int(os.getenv('UPSTREAM_CONNECTIONS', 100))
+
+# Shared upstream client session, created when the app starts
+SESSION = web.AppKey('session', aiohttp.ClientSession)
+
+cache = analytics.cache
+jobs = analytics.jobs
+UpstreamError = analytics.UpstreamError
+
+# ------------------- Upstream ------------------- #
+
+async def _request(session, url, params=None, headers=None):
+    logger.debug(f"Fetching from {url} with params {params}")
+    try:
+        response = await session.get(url, headers=headers or analytics.API_HEADERS, params=params)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise UpstreamError(f"Failed to fetch data: {str(e) or type(e).__name__}")
+    if response.status not in (200, 304):
+        response.release()
+        raise UpstreamError(f"API returned status {response.status}")
+    return response
+
+def _cached_rows(page):
+    """Rows of a payload cache entry (an (ndjson, body) page, as app.fetch_payload stores them)"""
+    ndjson, body = page
+    try:
+        return list(iter_body([body], ndjson))
+    except ValueError as e:
+        raise UpstreamError(f"Failed to decode response: {str(e)}")
+
+async def fetch_batches(session, endpoint, params=None):
+    """
+    Rows from the main API in batches (one per received chunk). Same caching,
+    ETag revalidation and pagination rules as app.fetch_payload.
+    """
+    cache_key = analytics._upstream_key(endpoint, params)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield _cached_rows(cached)
+        return
+
+    entry = cache.get_entry(cache_key)
+    headers = dict(analytics.API_HEADERS)
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+
+    response = await _request(session, f"{analytics.API_BASE_URL}/{endpoint}", params, headers)
+    if response.status == 304:
+        response.release()
+        if entry is None:
+            raise UpstreamError("API returned status 304 for an uncached resource")
+        cache.renew(cache_key, analytics.UPSTREAM_CACHE_TTL)
+        yield _cached_rows(entry.value)
+        return
+
+    buffered, size, etag = [], 0, response.headers.get('ETag')
+    ndjson = 'ndjson' in response.headers.get('Content-Type', '')
+    while response is not None:
+        async with response:
+            parser = NdjsonParser() if 'ndjson' in response.headers.get('Content-Type', '') else JsonArrayParser()
+            try:
+                async for chunk in response.content.iter_chunked(analytics.UPSTREAM_CHUNK_SIZE):
+                    size += len(chunk)
+                    if buffered is not None:
+                        buffered.append(chunk)
+                        if size > analytics.UPSTREAM_CACHE_MAX_PAYLOAD:
+                            buffered = None
+                    rows = parser.feed(chunk)
+                    if rows:
+                        yield rows
+                rows = parser.close()
+            except ValueError as e:
+                raise UpstreamError(f"Failed to decode response: {str(e)}")
+            if rows:
+                yield rows
+
+            next_url = response.links.get('next', {}).get('url')
+        if next_url:
+            buffered = None
+            response = await _request(session, str(next_url))
+        else:
+            response = None
+
+    if buffered is not None:
+        cache.set(cache_key, (ndjson, b''.join(buffered)), ttl=analytics.UPSTREAM_CACHE_TTL, etag=etag)
+
+async def fetch_payload(session, endpoint, params=None):
+    """
+    Async app.fetch_payload: the raw body of a main API resource, unparsed,
+    with the same caching, ETag revalidation, pagination and spooling.
+    """
+    cache_key = analytics._upstream_key(endpoint, params)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return Payload([cached])
+
+    entry = cache.get_entry(cache_key)
+    headers = dict(analytics.API_HEADERS)
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+
+    response = await _request(session, f"{analytics.API_BASE_URL}/{endpoint}", params, headers)
+    if response.status == 304:
+        response.release()
+        if entry is None:
+            raise UpstreamError("API returned status 304 for an uncached resource")
+        cache.renew(cache_key, analytics.UPSTREAM_CACHE_TTL)
+        return Payload([entry.value])
+
+    payload = Payload(max_memory=analytics.UPSTREAM_CACHE_MAX_PAYLOAD)
+    etag = response.headers.get('ETag')
+    try:
+        while response is not None:
+            async with response:
+                payload.start_page(ndjson='ndjson' in response.headers.get('Content-Type', ''))
+                async for chunk in response.content.iter_chunked(analytics.UPSTREAM_CHUNK_SIZE):
+                    payload.write(chunk)
+                payload.end_page()
+                next_url = response.links.get('next', {}).get('url')
+            response = await _request(session, str(next_url)) if next_url else None
+    except BaseException:
+        payload.close()
+        raise
+
+    if payload.body is not None:
+        cache.set(cache_key, payload.pages[0], ttl=analytics.UPSTREAM_CACHE_TTL, etag=etag)
+    return payload
+
+async def collect_report(session, report, params):
+    """Async app.collect_report: the report's payloads, downloaded concurrently"""
+    datasets = analytics.REPORTS[report][0](**params)
+    fetched = await asyncio.gather(*(fetch_payload(session, endpoint, query) for endpoint, query in datasets.items()),
+                                   return_exceptions=True)
+    data = analytics.ReportData()
+    failure = None
+    for endpoint, payload in zip(datasets, fetched):
+        if isinstance(payload, (Payload, UpstreamError)):
+            data[endpoint] = payload
+        else:
+            failure = payload
+    if failure is not None:
+        data.close()
+        raise failure
+    return data
+
+async def consume(session, endpoint, *handlers, params=None):
+    """Feed every row of a dataset to each handler"""
+    async for rows in fetch_batches(session, endpoint, params):
+        for row in rows:
+            for handler in handlers:
+                handler(row)
+
+# ------------------- Responses ------------------- #
+
+def _bad_request(message):
+    return web.json_response({"error": message, "status": "error"}, status=400)
+
+def _error_response(name, e):
+    """Same error mapping as app._report_error"""
+    if isinstance(e, JobQueueFull):
+        logger.warning(f"Rejected {name}: {str(e)}")
+        return web.json_response({"error": "Too many reports in progress, retry later", "status": "error"}, status=503)
+    if isinstance(e, UpstreamError):
+        logger.error(f"Error in {name}: {str(e)}")
+        return web.json_response({"error": str(e)}, status=500)
+    logger.error(f"Unexpected error in {name}: {str(e)}")
+    return web.json_response({"error": f"Internal server error: {str(e)}"}, status=500)
+
+# ------------------- Routes ------------------- #
+
+routes = web.RouteTableDef()
+
+@routes.get('/')
+async def dashboard(request):
+    """Serve the dashboard page"""
+    return web.FileResponse(os.path.join(os.path.dirname(__file__), 'static', 'dashboard.html'))
+
+@routes.get('/analytics/patient-stats')
+async def get_patient_stats(request):
+    """Get patient statistics"""
+    try:
+        stats = PatientStats()
+        await consume(request.app[SESSION], 'patients', stats.add)
+        return web.json_response(stats.result())
+    except Exception as e:
+        return _error_response('patient stats', e)
+
+async def get_window_daily_counts(session, days):
+    """Async app.get_window_daily_counts (shares its cache entries)"""
+    cached = cache.get(('window', days))
+    if cached is not None:
+        return cached
+
+    daily = DailyVisits(days)
+    await consume(session, 'visits', daily.add, params=analytics._window_params(days))
+    daily_visits = daily.result()
+    cache.set(('window', days), daily_visits, ttl=analytics.TRENDS_CACHE_TTL)
+    return daily_visits
+
+@routes.get('/analytics/visit-trends')
+async def get_visit_trends(request):
+    """Get visit trends for the last `days` days at daily, weekly or monthly granularity"""
+    args, error = analytics._parse_trend_args(request.query)
+    if error:
+        return _bad_request(error)
+    days, granularity = args
+    try:
+        cached = cache.get(('trends', days, granularity))
+        if cached is not None:
+            return web.json_response(cached)
+
+        result = visit_trends(await get_window_daily_counts(request.app[SESSION], days), days, granularity)
+        cache.set(('trends', days, granularity), result, ttl=analytics.TRENDS_CACHE_TTL)
+        return web.json_response(result)
+    except Exception as e:
+        return _error_response('visit trends', e)
+
+def _collector(request):
+    """collect for app.jobs: collect_report on the app's upstream session"""
+    return functools.partial(collect_report, request.app[SESSION])
+
+def _pooled_report(path, report, ttl=None):
+    """Route for a report computed in the process pool"""
+    async def handler(request):
+        params, error = analytics.REPORT_ARGS[report](request.query)
+        if error:
+            return _bad_request(error)
+        try:
+            return web.json_response(await jobs.run_async(report, params, ttl=ttl, collect=_collector(request)))
+        except Exception as e:
+            return _error_response(report.replace('_', ' '), e)
+    handler.__name__ = f"get_{report}"
+    routes.get(path)(handler)
+
+_pooled_report('/analytics/summary', 'summary', ttl=analytics.SUMMARY_CACHE_TTL)
+_pooled_report('/analytics/prescription-analysis', 'prescription_analysis')
+_pooled_report('/analytics/doctor-workload', 'doctor_workload')
+_pooled_report('/analytics/distribution', 'distribution')
+_pooled_report('/analytics/time-to-next-visit', 'time_to_next_visit')
+_pooled_report('/analytics/cohorts', 'cohorts')
+
+@routes.post('/analytics/jobs')
+async def submit_job(request):
+    """Start a report in the background (see app.submit_job)"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data if isinstance(data, dict) else {}
+    report = data.get('report')
+    if report not in analytics.REPORTS:
+        return _bad_request(f"Report must be one of: {', '.join(analytics.REPORTS)}")
+
+    args = data.get('params') or {}
+    if not isinstance(args, dict):
+        return _bad_request("params must be an object")
+    params, error = analytics.REPORT_ARGS[report](args)
+    if error:
+        return _bad_request(error)
+    ttl = analytics.SUMMARY_CACHE_TTL if report == 'summary' else None
+
+    try:
+        job = jobs.submit(report, params, ttl=ttl, collect=_collector(request))
+    except Exception as e:
+        return _error_response(report, e)
+    body = job.to_dict()
+    body['status_url'] = f"/analytics/jobs/{job.job_id}"
+    return web.json_response(body, status=202)
+
+@routes.get('/analytics/jobs/{job_id}')
+async def get_job(request):
+    """Status of a submitted report, with its result once done"""
+    job = jobs.get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({"error": "Job not found", "status": "error"}, status=404)
+    return web.json_response(job.to_dict())
+
+# ------------------- Admin Routes ------------------- #
+
+def _is_admin(request):
+    supplied = request.headers.get('Authorization', '')
+    return bool(analytics.ADMIN_TOKEN) and hmac.compare_digest(supplied, f'Bearer {analytics.ADMIN_TOKEN}')
+
+@routes.get('/admin/cache')
+async def cache_stats(request):
+    """Cache size and hit/miss/revalidation counters"""
+    if not _is_admin(request):
+        return web.json_response({"error": "Admin token required"}, status=403)
+    return web.json_response(cache.stats())
+
+@routes.post('/admin/cache/flush')
+async def flush_cache(request):
+    """Drop every cached upstream payload and computed result"""
+    if not _is_admin(request):
+        return web.json_response({"error": "Admin token required"}, status=403)
+    cache.clear()
+    return web.json_response({"message": "Cache flushed"})
+
+@routes.get('/metrics')
+async def metrics(request):
+    return web.Response(body=metrics_payload(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+# ------------------- Application ------------------- #
+
+@web.middleware
+async def request_metrics(request, handler):
+    """Same request metrics as metrics.init_metrics for the Flask app"""
+    started = perf_counter()
+    in_progress = IN_PROGRESS.labels(request.method)
+    in_progress.inc()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        in_progress.dec()
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        observe_request(request.method, route, status, perf_counter() - started)
+
+async def _upstream_session(app):
+    """One pooled client session per process, closed on shutdown"""
+    app[SESSION] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=UPSTREAM_CONNECTIONS),
+        # Per-read timeouts like requests' timeout=, so long streams are not cut off
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=analytics.UPSTREAM_TIMEOUT,
+                                      sock_read=analytics.UPSTREAM_TIMEOUT)
+    )
+    yield
+    await app[SESSION].close()
+
+def create_app():
+    app = web.Application(middlewares=[request_metrics])
+    app.add_routes(routes)
+    app.cleanup_ctx.append(_upstream_session)
+    return app
+
+def main(port=5002):
+    if analytics.ANALYTICS_DEBUG:
+        logging.basicConfig(level=logging.DEBUG)
+    web.run_app(create_app(), port=port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Memory-bounded TTL cache for upstream payloads and computed results.
+
+Entries are kept in least-recently-used order and evicted once the total
+size of their keys and values exceeds `max_bytes`. Sizes are measured
+from the objects themselves (see estimate_size), so the bound holds for
+parsed results as well as for raw payloads. Expired entries are not dropped
+straight away: an upstream payload that carries an ETag can still be
+revalidated with If-None-Match, and a 304 simply renews it.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from metrics import CACHE_REQUESTS
+
+class CacheEntry:
+    __slots__ = ('value', 'size', 'expires_at', 'etag')
+
+    def __init__(self, value, size, expires_at, etag=None):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.etag = etag
+
+    @property
+    def fresh(self):
+        return self.expires_at > time.monotonic()
+
+def estimate_size(value):
+    """
+    Memory held by a value, in bytes: sys.getsizeof of the value and of every
+    key, item and element it contains, each object counted once. Serialized
+    lengths would undercount: a dict of short strings and ints takes several
+    times its JSON size.
+    """
+    seen = set()
+    size = 0
+    pending = [value]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+    return size
+
+# Per-entry bookkeeping: the CacheEntry and its slot in the OrderedDict
+ENTRY_OVERHEAD = sys.getsizeof(CacheEntry(None, 0, 0)) + 100
+
+class TTLCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, default_ttl=60):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return a fresh cached value, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.fresh:
+                self.misses += 1
+                CACHE_REQUESTS.labels('miss').inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.labels('hit').inc()
+            return entry.value
+
+    def get_entry(self, key):
+        """Return the entry for key even if it has expired (for revalidation), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl=None, size=None, etag=None):
+        size = estimate_size((key, value)) + ENTRY_OVERHEAD if size is None else size
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = CacheEntry(value, size, time.monotonic() + ttl, etag)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def renew(self, key, ttl=None):
+        """Extend an entry after the upstream confirmed it is unchanged (304)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+                self.revalidations += 1
+                CACHE_REQUESTS.labels('revalidated').inc()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations
+            }
@@ -0,0 +1,60 @@
+"""
+gunicorn settings for the analytics service, run from this directory:
+
+    gunicorn -c gunicorn.conf.py
+
+ANALYTICS_MODE=sync (default) serves the Flask app (app:app) with
+WEB_THREADS threads per worker; ANALYTICS_MODE=async serves the aiohttp
+app (async_app:create_app()) with aiohttp's gunicorn worker, on PORT.
+
+One worker by default: report jobs, their ids and the caches live in the
+worker's memory, so a second worker would not know the jobs the first
+accepted, and would fetch and cache everything again. The CPU-bound work
+scales in the worker's report process pool instead, which gets the CPUs
+(ANALYTICS_WORKERS, default CPUs / workers). WEB_CONCURRENCY > 1 needs
+sticky routing for /analytics/jobs polls. Workers are forked from a
+master that loaded the app once; post_fork gives each its own upstream
+connection pool and report pool.
+
+Reloads work as for the main API (see ../gunicorn.conf.py): HUP replaces
+the workers gracefully, USR2 starts a new master for new code.
+"""
+import multiprocessing
+import os
+
+ASYNC = os.environ.get('ANALYTICS_MODE', 'sync') == 'async'
+
+wsgi_app = 'async_app:create_app()' if ASYNC else 'app:app'
+worker_class = 'aiohttp.GunicornWebWorker' if ASYNC else 'gthread'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5002)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Request threads mostly wait on upstream requests and the report pool
+threads = int(os.environ.get('WEB_THREADS', multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+max_requests = int(os.environ.get('MAX_REQUESTS', 10_000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('ACCESS_LOG', '-') or None
+
+# Metric files of every process (see metrics.py)
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Report processes across all workers: about one per CPU (app.py reads this when the app is loaded)
+os.environ.setdefault('ANALYTICS_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+def on_starting(server):
+    if workers > 1:
+        server.log.warning("%d workers: report jobs and caches are per worker, so "
+                           "/analytics/jobs polls need sticky routing", workers)
+
+def post_fork(server, worker):
+    import app
+    app.reset_after_fork()
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
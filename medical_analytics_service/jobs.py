@@ -0,0 +1,264 @@
+"""
+Process-pool job layer for CPU-heavy analytics reports.
+
+Each report's input is collected in a thread of the server process, which
+should do I/O only (downloading there keeps one upstream cache per server
+process), and handed to a bounded ProcessPoolExecutor that does all of the
+parsing and aggregation, so that work never holds the GIL of the process
+serving other dashboard requests. Results are cached per (report, params). Jobs can be awaited inline (run, or
+run_async from the asyncio mode) or submitted and polled later
+(submit / get) for long reports. The asyncio mode passes its own
+coroutine `collect`, so downloads run on its event loop rather than in a
+thread.
+
+Job ids are local to the process that accepted them, which is why
+gunicorn.conf.py runs a single server process and scales this pool
+instead; behind several, polls must reach the same process (sticky
+routing).
+"""
+import asyncio
+import itertools
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+def _close(data):
+    close = getattr(data, 'close', None)
+    if close is not None:
+        close()
+
+class JobQueueFull(Exception):
+    """Too many jobs are pending; the caller should retry later"""
+
+class Job:
+    __slots__ = ('job_id', 'report', 'params', 'future', 'result', 'error', 'submitted_at', 'finished_at')
+
+    def __init__(self, job_id, report, params):
+        self.job_id = job_id
+        self.report = report
+        self.params = params
+        self.future = None
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    @property
+    def status(self):
+        if self.finished_at is not None:
+            return 'failed' if self.error is not None else 'done'
+        # Async jobs (asyncio tasks) start collecting as soon as they are submitted
+        if self.future is not None and (isinstance(self.future, asyncio.Future) or self.future.running()):
+            return 'running'
+        return 'pending'
+
+    def to_dict(self):
+        data = {
+            'job_id': self.job_id,
+            'report': self.report,
+            'params': self.params,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == 'done':
+            data['result'] = self.result
+        elif self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+class JobManager:
+    def __init__(self, runner, cache, collect=None, max_workers=2, max_pending=16, result_ttl=60, job_ttl=600,
+                 max_jobs=1000):
+        """
+        collect: (report, params) -> data, run in this process (default: no data).
+        Data with a close() method is closed once the report has run.
+        runner: picklable top-level function (report, params, data) -> result, run in the pool.
+        max_workers=0 runs reports inline in the calling thread (e.g. for tests).
+        """
+        self.runner = runner
+        self.collect = collect or (lambda report, params: None)
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self._executor = None
+        self._collectors = None
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _get_collectors(self):
+        """Threads that collect a report's data and then wait for the pool; at most one per pending job"""
+        with self._lock:
+            if self._collectors is None:
+                self._collectors = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix='report')
+            return self._collectors
+
+    def _collect_and_run(self, report, params):
+        data = self.collect(report, params)
+        try:
+            return self._get_executor().submit(self.runner, report, params, data).result()
+        finally:
+            _close(data)
+
+    def _run_inline(self, report, params):
+        data = self.collect(report, params)
+        try:
+            return self.runner(report, params, data)
+        finally:
+            _close(data)
+
+    def _cache_key(self, report, params):
+        return ('report', report, tuple(sorted(params.items())))
+
+    def _reserve(self):
+        """Count a new pending job, enforcing the bound"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"{self._pending} jobs already pending")
+            self._pending += 1
+
+    def _release(self, _=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _start(self, report, params):
+        """Submit to the pool, enforcing the pending-job bound"""
+        self._reserve()
+        try:
+            future = self._get_collectors().submit(self._collect_and_run, report, params)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def _collect_and_run_async(self, report, params, collect):
+        data = await collect(report, params)
+        try:
+            if self.max_workers:
+                return await asyncio.wrap_future(self._get_executor().submit(self.runner, report, params, data))
+            return await asyncio.get_running_loop().run_in_executor(None, self.runner, report, params, data)
+        finally:
+            _close(data)
+
+    def _start_async(self, report, params, collect):
+        """_start() for a coroutine collect: an asyncio task on the running loop"""
+        self._reserve()
+        task = asyncio.ensure_future(self._collect_and_run_async(report, params, collect))
+        task.add_done_callback(self._release)
+        return task
+
+    def run(self, report, params, ttl=None):
+        """Compute a report (or return it from cache), blocking until it is ready"""
+        key = self._cache_key(report, params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        if self.max_workers:
+            result = self._start(report, params).result()
+        else:
+            result = self._run_inline(report, params)
+        self.cache.set(key, result, ttl=self.result_ttl if ttl is None else ttl)
+        return result
+
+    async def run_async(self, report, params, ttl=None, collect=None):
+        """
+        run() for asyncio handlers: awaits the pool without blocking the event
+        loop. collect: coroutine function (report, params) -> data used instead
+        of the manager's, e.g. to download on the handler's aiohttp session.
+        """
+        key = self._cache_key(report, params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        if collect is not None:
+            result = await self._start_async(report, params, collect)
+        elif self.max_workers:
+            result = await asyncio.wrap_future(self._start(report, params))
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(None, self._run_inline, report, params)
+        self.cache.set(key, result, ttl=self.result_ttl if ttl is None else ttl)
+        return result
+
+    def submit(self, report, params, ttl=None, collect=None):
+        """
+        Start a report in the background and return its Job for polling. With
+        a coroutine collect (see run_async), call it from the event loop.
+        """
+        self._expire_jobs()
+        job = Job(f"{uuid.uuid4().hex[:12]}{next(self._ids)}", report, params)
+        key = self._cache_key(report, params)
+
+        cached = self.cache.get(key)
+        if cached is not None or (not self.max_workers and collect is None):
+            try:
+                job.result = cached if cached is not None else self.run(report, params, ttl)
+            except Exception as e:
+                job.error = str(e)
+            job.finished_at = time.time()
+        else:
+            job.future = self._start(report, params) if collect is None else self._start_async(report, params, collect)
+
+            def finish(future):
+                try:
+                    job.result = future.result()
+                    self.cache.set(key, job.result, ttl=self.result_ttl if ttl is None else ttl)
+                except Exception as e:
+                    job.error = str(e)
+                except asyncio.CancelledError:
+                    job.error = "Cancelled"
+                job.finished_at = time.time()
+            job.future.add_done_callback(finish)
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id):
+        self._expire_jobs()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _expire_jobs(self):
+        """Forget finished jobs after job_ttl, and the oldest ones beyond max_jobs"""
+        now = time.time()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished_at is not None and now - job.finished_at > self.job_ttl:
+                    del self._jobs[job_id]
+            while len(self._jobs) > self.max_jobs:
+                del self._jobs[next(iter(self._jobs))]
+
+    def after_fork(self):
+        """In a forked child: drop the parent's pool and lock; the pool starts again on first use"""
+        self._lock = threading.Lock()
+        self._executor = None
+        self._collectors = None
+        self._jobs = {}
+        self._pending = 0
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            collectors, self._collectors = self._collectors, None
+        for pool in (collectors, executor):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
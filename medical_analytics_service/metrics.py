@@ -0,0 +1,69 @@
+"""
+Prometheus metrics for the analytics service, served at /metrics in both
+the Flask and the asyncio (async_app.py) modes.
+
+- http_requests_total / http_request_duration_seconds by method, route
+  and status, and http_requests_in_progress by method
+- analytics_report_duration_seconds: compute time of each report,
+  recorded in the process that ran it (pool workers included)
+- analytics_cache_requests_total: TTLCache hits, misses and ETag
+  revalidations
+
+Counters are updated in place on the request path and only formatted when
+scraped. With several processes (server workers or the report pool), set
+PROMETHEUS_MULTIPROC_DIR as for the main API (see ../app/metrics.py) so
+/metrics merges the values of every process.
+"""
+import os
+from time import perf_counter
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests', ['method', 'route', 'status'])
+LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency', ['method', 'route', 'status'])
+IN_PROGRESS = Gauge('http_requests_in_progress', 'HTTP requests being served', ['method'],
+                    multiprocess_mode='livesum')
+
+REPORT_SECONDS = Histogram('analytics_report_duration_seconds', 'Report compute time', ['report'],
+                           buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120))
+CACHE_REQUESTS = Counter('analytics_cache_requests_total', 'TTLCache lookups', ['result'])
+
+def metrics_payload():
+    """Current metrics in the Prometheus text format, merged across processes when configured"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+def observe_request(method, route, status, seconds):
+    """Record a served request; `route` is the route template, not the path, so the label set stays bounded"""
+    REQUESTS.labels(method, route, status).inc()
+    LATENCY.labels(method, route, status).observe(seconds)
+
+def init_metrics(app):
+    """Request metrics and the /metrics route for the Flask app"""
+
+    @app.before_request
+    def start_request_metrics():
+        g._metrics_started = perf_counter()
+        IN_PROGRESS.labels(request.method).inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('_metrics_started')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            observe_request(request.method, route, response.status_code, perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop('_metrics_started', None) is not None:
+            IN_PROGRESS.labels(request.method).dec()
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(metrics_payload(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,153 @@
+"""
+Mergeable probabilistic sketches for the analytics endpoints.
+
+- HyperLogLog: approximate distinct counts (e.g. diagnoses per doctor)
+- SpaceSaving: approximate top-k heavy hitters (e.g. most prescribed drugs)
+
+Every sketch can be sized from a memory budget in bytes and merged with
+another sketch of the same shape, so partial results (per worker, per page
+of upstream data) can be combined without revisiting the raw rows.
+"""
+import hashlib
+import heapq
+import itertools
+import math
+
+def _hash128(item):
+    """Stable 128-bit hash of an item as two 64-bit integers"""
+    digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+class HyperLogLog:
+    """Distinct-count estimator with a relative standard error of about 1.04 / sqrt(2**precision)"""
+
+    MIN_PRECISION = 4
+    MAX_PRECISION = 16
+
+    def __init__(self, precision=12):
+        if not self.MIN_PRECISION <= precision <= self.MAX_PRECISION:
+            raise ValueError(f"precision must be between {self.MIN_PRECISION} and {self.MAX_PRECISION}")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    @classmethod
+    def from_memory(cls, budget_bytes):
+        """Largest sketch whose registers (one byte each) fit in budget_bytes"""
+        precision = int(math.log2(max(budget_bytes, 1 << cls.MIN_PRECISION)))
+        return cls(min(precision, cls.MAX_PRECISION))
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, item):
+        value = _hash128(item)[0]
+        index = value & (self.m - 1)
+        rest = value >> self.precision
+        # Position of the lowest set bit in the remaining 64 - p bits
+        rank = (rest & -rest).bit_length() if rest else 64 - self.precision + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        if self.m == 16:
+            alpha = 0.673
+        elif self.m == 32:
+            alpha = 0.697
+        elif self.m == 64:
+            alpha = 0.709
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Small-range correction (linear counting)
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+class SpaceSaving:
+    """
+    Top-k heavy hitters over a stream using a fixed number of counters.
+    Every item seen more than total / capacity times is kept, and each
+    reported count over-estimates the true count by at most its error.
+    """
+
+    # Rough per-entry cost of the dict slot, counter pair and heap entry
+    ENTRY_BYTES = 128
+
+    def __init__(self, capacity=64):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.total = 0
+        self.counters = {}  # item -> [count, error]
+        self._heap = []  # (count, seq, item), may contain stale entries
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_memory(cls, budget_bytes):
+        return cls(max(budget_bytes // cls.ENTRY_BYTES, 1))
+
+    def _rebuild_heap(self):
+        self._heap = [(count, next(self._seq), item) for item, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def _push(self, item, count):
+        heapq.heappush(self._heap, (count, next(self._seq), item))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _pop_min(self):
+        while True:
+            count, _, item = heapq.heappop(self._heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                return item, counter
+
+    def add(self, item, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[item] = [0, 0]
+            else:
+                # Replace the smallest counter and inherit its count as error
+                evicted, (min_count, _) = self._pop_min()
+                del self.counters[evicted]
+                counter = self.counters[item] = [min_count, min_count]
+        counter[0] += count
+        self._push(item, counter[0])
+
+    def top(self, k):
+        """The k largest (item, count, error) triples, largest first"""
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)
+        return [(item, count, error) for item, (count, error) in ranked[:k]]
+
+    def merge(self, other):
+        merged = {}
+        for source in (self.counters, other.counters):
+            for item, (count, error) in source.items():
+                entry = merged.setdefault(item, [0, 0])
+                entry[0] += count
+                entry[1] += error
+        # Items missing from one summary may have been seen up to its minimum count
+        floor_self = min((c for c, _ in self.counters.values()), default=0) if len(self.counters) >= self.capacity else 0
+        floor_other = min((c for c, _ in other.counters.values()), default=0) if len(other.counters) >= other.capacity else 0
+        for item, entry in merged.items():
+            if item not in self.counters:
+                entry[0] += floor_self
+                entry[1] += floor_self
+            if item not in other.counters:
+                entry[0] += floor_other
+                entry[1] += floor_other
+        kept = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)[:self.capacity]
+        self.counters = dict(kept)
+        self.total += other.total
+        self._rebuild_heap()
+        return self
@@ -0,0 +1,182 @@
+"""
+Incremental parsers for upstream response bodies.
+
+Both parsers take an iterable of byte chunks (e.g. response.iter_content())
+and yield one decoded row at a time, so memory use is bounded by the chunk
+size and the largest single row rather than by the size of the payload.
+The push-based JsonArrayParser / NdjsonParser behind them can be fed
+chunks from an async client instead.
+
+Payload keeps a raw body unparsed, so it can be downloaded in one process
+and parsed in another.
+"""
+import codecs
+import io
+import json
+import os
+import tempfile
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+class JsonArrayParser:
+    """Elements of a top-level JSON array, returned by feed() as they complete"""
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._started = self._finished = False
+        self._expect_value = True
+
+    def feed(self, chunk):
+        buffer = self._buffer + self._text.decode(chunk)
+        rows = []
+        pos = 0
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos >= len(buffer):
+                break
+            if self._finished:
+                raise ValueError(f"Unexpected data after JSON array at: {buffer[pos:pos + 20]!r}")
+            char = buffer[pos]
+            if not self._started:
+                if char != '[':
+                    raise ValueError("Expected a JSON array")
+                self._started = True
+                pos += 1
+            elif char == ']':
+                self._finished = True
+                pos += 1
+            elif char == ',' and not self._expect_value:
+                self._expect_value = True
+                pos += 1
+            else:
+                try:
+                    row, end = _decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    break  # Incomplete element; wait for the next chunk
+                if end == len(buffer) and not isinstance(row, (dict, list)):
+                    break  # A trailing scalar may continue in the next chunk
+                rows.append(row)
+                self._expect_value = False
+                pos = end
+        self._buffer = buffer[pos:]
+        return rows
+
+    def close(self):
+        """Check that the body was a complete array"""
+        buffer = self._buffer + self._text.decode(b'', final=True)
+        if buffer.strip() or not self._finished:
+            raise ValueError("Truncated JSON array")
+        return []
+
+class NdjsonParser:
+    """One decoded value per line of newline-delimited JSON"""
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+
+    def feed(self, chunk):
+        *lines, self._buffer = (self._buffer + self._text.decode(chunk)).split('\n')
+        return [json.loads(line) for line in lines if line.strip()]
+
+    def close(self):
+        """Any final line without a trailing newline"""
+        buffer = self._buffer + self._text.decode(b'', final=True)
+        self._buffer = ''
+        return [json.loads(buffer)] if buffer.strip() else []
+
+def _iter_parsed(parser, chunks):
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+def iter_json_array(chunks):
+    """Yield the elements of a top-level JSON array as they arrive"""
+    return _iter_parsed(JsonArrayParser(), chunks)
+
+def iter_ndjson(chunks):
+    """Yield one decoded value per line of newline-delimited JSON"""
+    return _iter_parsed(NdjsonParser(), chunks)
+
+def iter_body(chunks, ndjson=False):
+    """Rows of a JSON array (or NDJSON) body"""
+    return iter_ndjson(chunks) if ndjson else iter_json_array(chunks)
+
+class Payload:
+    """
+    Raw upstream response body, one entry per page. Pages are kept as bytes
+    until the payload holds `max_memory` bytes, and spooled to temporary
+    files beyond that, so a payload stays cheap to hold and to pickle. Call
+    close() once it has been read to remove the spooled files.
+    """
+
+    def __init__(self, pages=(), max_memory=8 * 1024 * 1024):
+        self.pages = list(pages)  # (ndjson, bytes or the path of a spooled page)
+        self.max_memory = max_memory
+        self._memory = sum(len(body) for _, body in self.pages if isinstance(body, bytes))
+        self._page = None
+        self._file = None
+
+    def start_page(self, ndjson=False):
+        self._page = (ndjson, [])
+
+    def write(self, chunk):
+        ndjson, buffered = self._page
+        if self._file is None and self._memory + len(chunk) > self.max_memory:
+            self._file = tempfile.NamedTemporaryFile(prefix='upstream-', delete=False)
+            self._file.writelines(buffered)
+            self._memory -= sum(map(len, buffered))
+            buffered.clear()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            buffered.append(chunk)
+            self._memory += len(chunk)
+
+    def end_page(self):
+        ndjson, buffered = self._page
+        if self._file is not None:
+            self._file.close()
+            self.pages.append((ndjson, self._file.name))
+            self._file = None
+        else:
+            self.pages.append((ndjson, b''.join(buffered)))
+        self._page = None
+
+    @property
+    def body(self):
+        """The whole body, if it is a single page held in memory (else None)"""
+        if len(self.pages) == 1 and isinstance(self.pages[0][1], bytes):
+            return self.pages[0][1]
+        return None
+
+    def files(self):
+        """(ndjson, binary file object) for each page"""
+        for ndjson, body in self.pages:
+            with (io.BytesIO(body) if isinstance(body, bytes) else open(body, 'rb')) as file:
+                yield ndjson, file
+
+    def rows(self, chunk_size=64 * 1024):
+        """Every row of every page, parsed chunk by chunk"""
+        for ndjson, file in self.files():
+            yield from iter_body(iter(lambda: file.read(chunk_size), b''), ndjson)
+
+    def close(self):
+        spooled = [body for _, body in self.pages if not isinstance(body, bytes)]
+        if self._file is not None:
+            self._file.close()
+            spooled.append(self._file.name)
+            self._file = None
+        for path in spooled:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.pages = []
@@ -1,13 +1,59 @@
 import pytest
+import app as analytics
 from app import app
 import json
+import os
+import time
+from datetime import datetime, timedelta
 
 @pytest.fixture
-def client():
+def client(monkeypatch):
     app.config['TESTING'] = True
+    analytics.cache.clear()
+    # Compute reports in the request thread, where the mocked main API is
+    monkeypatch.setattr(analytics.jobs, 'max_workers', 0)
     with app.test_client() as client:
         yield client
 
+class MockResponse:
+    def __init__(self, status_code, payload=None, etag=None, content_type='application/json', next_url=None):
+        self.status_code = status_code
+        if content_type == 'application/x-ndjson':
+            self.content = ''.join(json.dumps(row) + '\n' for row in payload).encode()
+        elif content_type == 'text/csv':
+            self.content = payload.encode()
+        else:
+            self.content = json.dumps(payload).encode() if payload is not None else b''
+        self.headers = {'Content-Type': content_type}
+        if etag:
+            self.headers['ETag'] = etag
+        self.links = {'next': {'url': next_url}} if next_url else {}
+
+    def iter_content(self, chunk_size=1):
+        # Deliberately tiny chunks to exercise incremental parsing
+        for start in range(0, len(self.content), 7):
+            yield self.content[start:start + 7]
+
+    def close(self):
+        pass
+
+def mock_api(monkeypatch, get_rows):
+    """Serve get_rows(endpoint, params) from a mocked main API: JSON arrays, or CSV for a string"""
+    def get(url, headers=None, params=None, **kwargs):
+        rows = get_rows(url[len('http://api/'):], params)
+        return MockResponse(200, rows, content_type='text/csv' if isinstance(rows, str) else 'application/json')
+
+    monkeypatch.setattr(analytics, 'API_BASE_URL', 'http://api')
+    monkeypatch.setattr(analytics.http, 'get', get)
+
+def timeline_csv(visits):
+    """The main API's visit timeline export for (patient_id, ISO visit date) pairs"""
+    epoch = datetime(1970, 1, 1)
+    return 'patient_id,visit_time\n' + ''.join(
+        f"{patient_id},{int((datetime.fromisoformat(visit_date) - epoch).total_seconds())}\n"
+        for patient_id, visit_date in visits
+    )
+
 def test_patient_statistics(client, monkeypatch):
     # Mock API response
     mock_patients = [
@@ -19,7 +65,7 @@ def test_patient_statistics(client, monkeypatch):
     def mock_get_api_data(endpoint, params=None):
         return mock_patients
     
-    monkeypatch.setattr('app.get_api_data', mock_get_api_data)
+    mock_api(monkeypatch, mock_get_api_data)
     
     response = client.get('/analytics/patient-stats')
     assert response.status_code == 200
@@ -29,22 +75,56 @@ def test_patient_statistics(client, monkeypatch):
 
 def test_visit_trends(client, monkeypatch):
     # Mock API response
+    today = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0)
+    yesterday = today - timedelta(days=1)
     mock_visits = [
-        {'visit_id': 1, 'visit_date': '2024-01-01T10:00:00'},
-        {'visit_id': 2, 'visit_date': '2024-01-01T11:00:00'},
-        {'visit_id': 3, 'visit_date': '2024-01-02T10:00:00'}
+        {'visit_id': 1, 'visit_date': yesterday.isoformat()},
+        {'visit_id': 2, 'visit_date': yesterday.replace(hour=11).isoformat()},
+        {'visit_id': 3, 'visit_date': today.isoformat()}
     ]
     
     def mock_get_api_data(endpoint, params=None):
         return mock_visits
     
-    monkeypatch.setattr('app.get_api_data', mock_get_api_data)
+    mock_api(monkeypatch, mock_get_api_data)
     
     response = client.get('/analytics/visit-trends?days=2')
     assert response.status_code == 200
     data = json.loads(response.data)
     assert data['total_visits'] == 3
 
+def test_visit_trends_window_pushdown(client, monkeypatch):
+    today = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0)
+    requested = []
+
+    def mock_get_api_data(endpoint, params=None):
+        requested.append((endpoint, params))
+        # An old visit the upstream failed to filter out
+        return [
+            {'visit_id': 1, 'visit_date': (today - timedelta(days=400)).isoformat()},
+            {'visit_id': 2, 'visit_date': today.isoformat()}
+        ]
+
+    mock_api(monkeypatch, mock_get_api_data)
+
+    response = client.get('/analytics/visit-trends?days=7')
+    data = json.loads(response.data)
+    since = datetime.fromisoformat(requested[0][1]['since'])
+    assert since.date() == (today - timedelta(days=6)).date()
+    assert data['total_visits'] == 1
+    assert len(data['daily_visits']) == 7
+    assert sum(data['daily_visits'].values()) == 1
+
+    # Other granularities reuse the window without another upstream call
+    response = client.get('/analytics/visit-trends?days=7&granularity=monthly')
+    data = json.loads(response.data)
+    assert data['granularity'] == 'monthly'
+    assert sum(data['visits'].values()) == 1
+    assert len(requested) == 1
+
+    response = client.get('/analytics/visit-trends?days=7&granularity=hourly')
+    assert response.status_code == 400
+
 def test_prescription_analysis(client, monkeypatch):
     # Mock API response
     mock_prescriptions = [
@@ -56,7 +136,7 @@ def test_prescription_analysis(client, monkeypatch):
     def mock_get_api_data(endpoint, params=None):
         return mock_prescriptions
     
-    monkeypatch.setattr('app.get_api_data', mock_get_api_data)
+    mock_api(monkeypatch, mock_get_api_data)
     
     response = client.get('/analytics/prescription-analysis')
     assert response.status_code == 200
@@ -75,9 +155,366 @@ def test_doctor_workload(client, monkeypatch):
     def mock_get_api_data(endpoint, params=None):
         return mock_visits
     
-    monkeypatch.setattr('app.get_api_data', mock_get_api_data)
+    mock_api(monkeypatch, mock_get_api_data)
     
     response = client.get('/analytics/doctor-workload')
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert data['total_doctors'] == 2 
\ No newline at end of file
+    assert data['total_doctors'] == 2 
+
+def test_approx_modes(client, monkeypatch):
+    mock_visits = [
+        {'doctor_id': 1, 'visit_id': i, 'diagnosis': f'Diagnosis {i % 40}'}
+        for i in range(200)
+    ]
+    mock_prescriptions = [
+        {'doctor_id': 1, 'drug_name': 'Aspirin' if i % 3 else f'Drug {i}', 'duration': 7}
+        for i in range(300)
+    ]
+
+    def mock_get_api_data(endpoint, params=None):
+        return mock_visits if endpoint == 'visits' else mock_prescriptions
+
+    mock_api(monkeypatch, mock_get_api_data)
+
+    data = json.loads(client.get('/analytics/doctor-workload?approx=1').data)
+    assert data['approximate'] is True
+    assert 'diagnoses' not in data['doctor_stats']['1']
+    assert data['doctor_stats']['1']['distinct_diagnoses'] == 40
+
+    data = json.loads(client.get('/analytics/prescription-analysis?approx=1').data)
+    assert data['approximate'] is True
+    assert data['unique_drugs'] == 101
+    assert data['most_prescribed_drugs']['Aspirin'] == 200
+
+def test_summary_reads_dashboard_rollups(client, monkeypatch):
+    today = datetime.now().date()
+    stats = {
+        'total_patients': 2,
+        'average_age': 50.0,
+        'age_distribution': {'0-18': 0, '19-30': 1, '31-50': 0, '51-70': 0, '70+': 1},
+        'total_visits': 5,
+        # The main API only lists days with visits
+        'daily_visits': {(today - timedelta(days=1)).isoformat(): 1, today.isoformat(): 2},
+        'total_prescriptions': 3,
+        'unique_drugs': 2,
+        'most_prescribed_drugs': {'Aspirin': 2, 'Ibuprofen': 1},
+        'doctor_stats': {'1': {'visits': 3, 'prescriptions': 3}, '2': {'visits': 0, 'prescriptions': 0}}
+    }
+    calls = []
+
+    def mock_get_api_data(endpoint, params=None):
+        calls.append((endpoint, params))
+        return stats
+
+    mock_api(monkeypatch, mock_get_api_data)
+
+    response = client.get('/analytics/summary?days=7')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert calls == [('dashboard/stats', {'days': 7})]
+    assert data['patient_stats'] == {key: stats[key] for key in ('total_patients', 'average_age', 'age_distribution')}
+    trends = data['visit_trends']
+    assert len(trends['daily_visits']) == 7
+    assert trends['daily_visits'][today.isoformat()] == 2
+    assert trends['total_visits'] == 3
+    assert data['prescription_analysis']['most_prescribed_drugs'] == {'Aspirin': 2, 'Ibuprofen': 1}
+    assert data['doctor_workload'] == {
+        'total_doctors': 1,
+        'doctor_stats': {'1': {'name': 'Doctor 1', 'visits': 3, 'prescriptions': 3}}
+    }
+
+    # The combined result is cached
+    client.get('/analytics/summary?days=7')
+    assert len(calls) == 1
+
+    # Other sections reuse the cached stats
+    data = json.loads(client.get('/analytics/summary?days=7&sections=patient_stats').data)
+    assert list(data) == ['patient_stats']
+    assert len(calls) == 1
+
+    assert client.get('/analytics/summary?sections=bogus').status_code == 400
+
+def test_upstream_revalidation_with_etag(client, monkeypatch):
+    requests_made = []
+
+    def mock_get(url, headers=None, params=None, **kwargs):
+        requests_made.append(headers.get('If-None-Match'))
+        if headers.get('If-None-Match') == '"v1"':
+            return MockResponse(304)
+        return MockResponse(200, [{'id': 1, 'age': 40}], etag='"v1"')
+
+    monkeypatch.setattr(analytics.http, 'get', mock_get)
+    monkeypatch.setattr(analytics, 'UPSTREAM_CACHE_TTL', 0)
+
+    assert list(analytics.fetch_data('patients')) == [{'id': 1, 'age': 40}]
+    # Stale entry: revalidated with If-None-Match and served from cache on 304
+    assert list(analytics.fetch_data('patients')) == [{'id': 1, 'age': 40}]
+    assert requests_made == [None, '"v1"']
+    assert analytics.cache.stats()['revalidations'] == 1
+
+    # While fresh, no upstream request is made at all
+    monkeypatch.setattr(analytics, 'UPSTREAM_CACHE_TTL', 60)
+    analytics.fetch_data('patients')
+    analytics.fetch_data('patients')
+    analytics.fetch_data('patients')
+    assert len(requests_made) == 3
+
+def test_cache_is_memory_bounded():
+    from cache import TTLCache
+    bounded = TTLCache(max_bytes=100)
+    for i in range(10):
+        bounded.set(i, 'x' * 20, size=30)
+    assert bounded.current_bytes <= 100
+    assert bounded.get(9) is not None
+    assert bounded.get(0) is None
+
+def test_cache_bound_matches_real_memory():
+    import tracemalloc
+    from cache import TTLCache
+
+    def trends(i):
+        """A visit-trends-like result: many small keys and values"""
+        start = datetime(2024, 1, 1)
+        daily = {(start + timedelta(days=day)).date().isoformat(): day * i for day in range(365)}
+        return {'daily_visits': daily, 'total_visits': sum(daily.values()), 'period': f"Last {i} days"}
+
+    max_bytes = 2 * 1024 * 1024
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        bounded = TTLCache(max_bytes=max_bytes)
+        for i in range(200):
+            bounded.set(('trends', i), trends(i))
+            bounded.set(('payload', i), (False, json.dumps(trends(i)).encode()))
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    assert bounded.current_bytes <= max_bytes
+    # What the cache holds stays within the bound, and the bound is not
+    # so conservative that it wastes most of the budget
+    assert max_bytes * 0.75 < held < max_bytes * 1.05
+
+def test_admin_cache_flush(client, monkeypatch):
+    analytics.cache.set('key', {'value': 1})
+    assert client.post('/admin/cache/flush').status_code == 403
+
+    monkeypatch.setattr(analytics, 'ADMIN_TOKEN', 'secret')
+    response = client.post('/admin/cache/flush', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert analytics.cache.get('key') is None
+
+def test_streams_paginated_ndjson_without_caching_large_payloads(client, monkeypatch):
+    pages = {
+        'http://api/visits': MockResponse(200, [{'visit_id': 1}, {'visit_id': 2}],
+                                          content_type='application/x-ndjson', next_url='http://api/visits?page=2'),
+        'http://api/visits?page=2': MockResponse(200, [{'visit_id': 3}])
+    }
+
+    def mock_get(url, headers=None, params=None, **kwargs):
+        return pages[url]
+
+    monkeypatch.setattr(analytics.http, 'get', mock_get)
+    monkeypatch.setattr(analytics, 'API_BASE_URL', 'http://api')
+
+    rows = analytics.fetch_data('visits')
+    assert not isinstance(rows, list)  # a lazy row iterator, not a materialized payload
+    assert [row['visit_id'] for row in rows] == [1, 2, 3]
+    # Multi-page results are never kept in the payload cache
+    assert analytics.cache.stats()['entries'] == 0
+
+def test_upstream_errors_are_reported(client, monkeypatch):
+    monkeypatch.setattr(analytics.http, 'get', lambda url, **kwargs: MockResponse(401, {'msg': 'nope'}))
+
+    response = client.get('/analytics/patient-stats')
+    assert response.status_code == 500
+    assert json.loads(response.data)['error'] == 'API returned status 401'
+
+def test_report_jobs_can_be_submitted_and_polled(client, monkeypatch):
+    mock_api(monkeypatch, lambda endpoint, params=None: [
+        {'doctor_id': 1, 'drug_name': 'Aspirin', 'duration': '5 days'}
+    ])
+
+    response = client.post('/analytics/jobs', json={'report': 'prescription_analysis', 'params': {'approx': 0}})
+    assert response.status_code == 202
+    job = json.loads(response.data)
+
+    data = json.loads(client.get(job['status_url']).data)
+    assert data['status'] == 'done'
+    assert data['result']['most_prescribed_drugs'] == {'Aspirin': 1}
+
+    assert client.post('/analytics/jobs', json={'report': 'bogus'}).status_code == 400
+    assert client.post('/analytics/jobs', json={'report': 'summary', 'params': {'sections': ['bogus']}}).status_code == 400
+    assert client.get('/analytics/jobs/unknown').status_code == 404
+
+def test_failed_report_jobs_carry_the_error(client, monkeypatch):
+    monkeypatch.setattr(analytics.http, 'get', lambda url, **kwargs: MockResponse(503))
+
+    job = json.loads(client.post('/analytics/jobs', json={'report': 'doctor_workload'}).data)
+    data = json.loads(client.get(job['status_url']).data)
+    assert data['status'] == 'failed'
+    assert data['error'] == 'API returned status 503'
+
+def pid_report(report, params, data):
+    time.sleep(params.get('sleep', 0))
+    return {'pid': os.getpid()}
+
+def test_job_manager_runs_reports_in_a_bounded_process_pool():
+    from cache import TTLCache
+    from jobs import JobManager, JobQueueFull
+
+    manager = JobManager(pid_report, TTLCache(), max_workers=1, max_pending=1)
+    try:
+        result = manager.run('pid', {})
+        assert result['pid'] != os.getpid()
+        # Cached: the same params do not reach the pool again
+        assert manager.run('pid', {}) is result
+
+        job = manager.submit('pid', {'sleep': 1})
+        with pytest.raises(JobQueueFull):
+            manager.submit('pid', {'sleep': 2})
+        job.future.result(timeout=30)
+        for _ in range(50):
+            if manager.get(job.job_id).status == 'done':
+                break
+            time.sleep(0.1)
+        assert manager.get(job.job_id).to_dict()['result']['pid'] != os.getpid()
+    finally:
+        manager.shutdown()
+
+def test_pooled_reports_are_parsed_in_the_worker(monkeypatch):
+    from cache import TTLCache
+    from jobs import JobManager
+    from streaming import Payload
+
+    calls, spooled = [], []
+    body = json.dumps([{'id': i, 'age': age} for i, age in enumerate([10, 20, 30, 40])]).encode()
+
+    def fetch_payload(endpoint, params=None):
+        calls.append(endpoint)
+        payload = Payload(max_memory=0)
+        payload.start_page()
+        payload.write(body)
+        payload.end_page()
+        spooled.append(payload.pages[0][1])
+        return payload
+
+    def parse_here(payload):
+        raise AssertionError('payloads must be parsed in the pool')
+
+    # Patched in this process only: it downloads, the pool worker parses
+    monkeypatch.setattr('app.fetch_payload', fetch_payload)
+    monkeypatch.setattr('app.payload_rows', parse_here)
+    manager = JobManager(analytics.run_report, TTLCache(), collect=analytics.collect_report, max_workers=1)
+    try:
+        result = manager.run('distribution', {'metric': 'age', 'bins': 2, 'percentiles': (50,)})
+        assert calls == ['patients']
+        assert result['count'] == 4 and result['percentiles'] == {'p50': 25.0}
+        # The spooled body is removed once the report has run
+        assert not os.path.exists(spooled[0])
+    finally:
+        manager.shutdown()
+
+def test_distribution_with_custom_bins_and_percentiles(client, monkeypatch):
+    upstream = {
+        'patients': [{'id': i, 'age': age} for i, age in enumerate([5, 25, 35, 45, 65, 90, None])],
+        'prescriptions': [{'duration': 2}, {'duration': '10 days'}, {'duration': 30}]
+    }
+    mock_api(monkeypatch, lambda endpoint, params=None: upstream[endpoint])
+
+    data = json.loads(client.get('/analytics/distribution?metric=age&bins=0,18,30,50,70&percentiles=50,90').data)
+    assert data['count'] == 6
+    assert [b['count'] for b in data['histogram']] == [1, 1, 2, 1]
+    assert data['above'] == 1 and data['below'] == 0
+    assert data['percentiles'] == {'p50': 40.0, 'p90': 77.5}
+
+    data = json.loads(client.get('/analytics/distribution?metric=duration&bins=2').data)
+    assert data['count'] == 3
+    assert data['max'] == 30.0
+    assert sum(b['count'] for b in data['histogram']) == 3
+
+    assert client.get('/analytics/distribution?metric=bogus').status_code == 400
+    assert client.get('/analytics/distribution?metric=age&bins=5,1').status_code == 400
+    assert client.get('/analytics/distribution?metric=age&percentiles=101').status_code == 400
+
+def test_visit_distributions(client, monkeypatch):
+    timeline = timeline_csv([
+        (1, '2024-01-11T09:00:00'),
+        (1, '2024-01-01T09:00:00'),
+        (2, '2024-01-05T09:00:00'),
+        (1, '2024-01-31T09:00:00'),
+        (2, '2024-01-05T09:00:00')
+    ])
+    requested = []
+    mock_api(monkeypatch, lambda endpoint, params=None: requested.append(endpoint) or timeline)
+
+    data = json.loads(client.get('/analytics/distribution?metric=visits_per_patient').data)
+    assert requested == ['visits/timeline']
+    assert data['count'] == 2
+    assert data['max'] == 3.0 and data['min'] == 2.0
+
+    data = json.loads(client.get('/analytics/distribution?metric=days_between_visits&percentiles=50').data)
+    assert data['count'] == 3
+    assert data['min'] == 0.0 and data['max'] == 20.0
+    assert data['percentiles'] == {'p50': 10.0}
+
+def test_time_to_next_visit_and_cohorts(client, monkeypatch):
+    timeline = timeline_csv(reversed([
+        (1, '2024-01-10T09:00:00'),
+        (1, '2024-01-20T09:00:00'),
+        (1, '2024-03-20T09:00:00'),
+        (2, '2024-01-15T09:00:00'),
+        (3, '2024-02-01T09:00:00'),
+        (3, '2024-02-05T09:00:00')
+    ]))
+    mock_api(monkeypatch, lambda endpoint, params=None: timeline)
+
+    data = json.loads(client.get('/analytics/time-to-next-visit?within=30').data)
+    assert data['total_visits'] == 6
+    assert data['total_patients'] == 3
+    assert data['returning_patients'] == 2
+    assert data['revisits_within'] == 2
+    assert data['revisit_rate'] == round(2 / 6, 4)
+    assert data['days_to_next_visit']['p50'] == 10.0
+
+    data = json.loads(client.get('/analytics/cohorts?periods=3').data)
+    assert data['cohorts'] == [
+        {'cohort': '2024-01', 'patients': 2, 'active': [2, 0, 1], 'retention': [1.0, 0.0, 0.5]},
+        {'cohort': '2024-02', 'patients': 1, 'active': [1, 0, 0], 'retention': [1.0, 0.0, 0.0]}
+    ]
+
+    assert client.get('/analytics/cohorts?periods=0').status_code == 400
+    assert client.get('/analytics/time-to-next-visit?within=abc').status_code == 400
+
+def test_malformed_visit_timeline_is_an_upstream_error(client, monkeypatch):
+    mock_api(monkeypatch, lambda endpoint, params=None: 'patient_id,visit_time\n1,not a time\n')
+
+    response = client.get('/analytics/cohorts')
+    assert response.status_code == 500
+    assert json.loads(response.data)['error'].startswith('Failed to decode response')
+
+def test_metrics_endpoint(client, monkeypatch):
+    from prometheus_client import REGISTRY
+
+    def sample(name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    mock_api(monkeypatch, lambda endpoint, params=None: [{'doctor_id': 1, 'visit_id': 1}])
+    route = {'method': 'GET', 'route': '/analytics/doctor-workload', 'status': '200'}
+    requests_before = sample('http_requests_total', route)
+    reports_before = sample('analytics_report_duration_seconds_count', {'report': 'doctor_workload'})
+
+    # The second call is served from the result cache
+    client.get('/analytics/doctor-workload')
+    client.get('/analytics/doctor-workload')
+
+    assert sample('http_requests_total', route) == requests_before + 2
+    assert sample('analytics_report_duration_seconds_count', {'report': 'doctor_workload'}) == reports_before + 1
+    assert sample('analytics_cache_requests_total', {'result': 'hit'}) >= 1
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket{' in body
+    assert 'analytics_report_duration_seconds_bucket{' in body
\ No newline at end of file
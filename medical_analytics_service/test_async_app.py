@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import app as analytics
+import async_app
+
+UPSTREAM_DELAY = 0.3
+
+def upstream_data():
+    now = datetime.now().replace(microsecond=0)
+    today = now.isoformat()
+    return {
+        'patients': [{'id': 1, 'age': 25}, {'id': 2, 'age': 75}],
+        'visits': [
+            {'visit_id': 1, 'patient_id': 1, 'doctor_id': 1, 'diagnosis': 'Cold', 'visit_date': today},
+            {'visit_id': 2, 'patient_id': 2, 'doctor_id': 2, 'diagnosis': 'Flu', 'visit_date': today}
+        ],
+        'prescriptions': [{'doctor_id': 1, 'drug_name': 'Aspirin', 'duration': 5}],
+        'dashboard/stats': {
+            'total_patients': 2, 'average_age': 50.0,
+            'age_distribution': {'0-18': 0, '19-30': 1, '31-50': 0, '51-70': 0, '70+': 1},
+            'total_visits': 2, 'daily_visits': {now.date().isoformat(): 2},
+            'total_prescriptions': 1, 'unique_drugs': 1, 'most_prescribed_drugs': {'Aspirin': 1},
+            'doctor_stats': {'1': {'visits': 1, 'prescriptions': 1}, '2': {'visits': 1, 'prescriptions': 0}}
+        }
+    }
+
+def make_upstream(calls, status=200):
+    """A slow fake main API serving JSON arrays"""
+    data = upstream_data()
+
+    async def handler(request):
+        endpoint = request.match_info['endpoint']
+        calls.append(endpoint)
+        await asyncio.sleep(UPSTREAM_DELAY)
+        if status != 200:
+            return web.json_response({'msg': 'nope'}, status=status)
+        return web.json_response(data[endpoint])
+
+    upstream = web.Application()
+    upstream.router.add_get('/api/{endpoint:.+}', handler)
+    return upstream
+
+@pytest.fixture(autouse=True)
+def reset(monkeypatch):
+    analytics.cache.clear()
+    monkeypatch.setattr(analytics.jobs, 'max_workers', 0)
+
+def run_with_upstream(monkeypatch, scenario, status=200):
+    """Run scenario(client, calls) against the async app with a fake upstream"""
+    calls = []
+
+    async def main():
+        async with TestServer(make_upstream(calls, status)) as upstream:
+            monkeypatch.setattr(analytics, 'API_BASE_URL', str(upstream.make_url('/api')))
+            async with TestClient(TestServer(async_app.create_app())) as client:
+                return await scenario(client, calls)
+
+    return asyncio.run(main())
+
+def test_summary_reads_dashboard_stats(monkeypatch):
+    async def scenario(client, calls):
+        response = await client.get('/analytics/summary')
+        return response.status, await response.json(), list(calls)
+
+    status, data, calls = run_with_upstream(monkeypatch, scenario)
+    assert status == 200
+    assert calls == ['dashboard/stats']
+    assert data['patient_stats']['total_patients'] == 2
+    assert data['visit_trends']['total_visits'] == 2
+    assert data['prescription_analysis']['most_prescribed_drugs'] == {'Aspirin': 1}
+    assert data['doctor_workload']['doctor_stats']['1']['prescriptions'] == 1
+
+def test_many_concurrent_clients(monkeypatch):
+    async def scenario(client, calls):
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.get('/analytics/patient-stats') for _ in range(50)
+        ))
+        elapsed = time.perf_counter() - started
+        return [r.status for r in responses], elapsed
+
+    statuses, elapsed = run_with_upstream(monkeypatch, scenario)
+    assert statuses == [200] * 50
+    # Waiting on the upstream does not tie up a thread per client
+    assert elapsed < 10 * UPSTREAM_DELAY
+
+def test_pooled_reports_and_errors(monkeypatch):
+    def blocking_get(*args, **kwargs):
+        raise AssertionError("pooled reports must download on the aiohttp session")
+    monkeypatch.setattr(analytics.http, 'get', blocking_get)
+
+    async def scenario(client, calls):
+        workload = await client.get('/analytics/doctor-workload')
+        bad = await client.get('/analytics/cohorts?periods=0')
+        job = await client.post('/analytics/jobs', json={'report': 'distribution', 'params': {'metric': 'age'}})
+        job = await job.json()
+        status_url = job['status_url']
+        while job['status'] in ('pending', 'running'):
+            await asyncio.sleep(0.05)
+            job = await (await client.get(status_url)).json()
+        return await workload.json(), bad.status, job
+
+    workload, bad_status, job = run_with_upstream(monkeypatch, scenario)
+    assert workload['total_doctors'] == 2
+    assert bad_status == 400
+    assert job['status'] == 'done'
+    assert job['result']['count'] == 2
+
+def test_upstream_errors_are_reported(monkeypatch):
+    async def scenario(client, calls):
+        response = await client.get('/analytics/patient-stats')
+        return response.status, json.loads(await response.text())
+
+    status, data = run_with_upstream(monkeypatch, scenario, status=401)
+    assert status == 500
+    assert data['error'] == 'API returned status 401'
+
+def test_metrics_endpoint(monkeypatch):
+    async def scenario(client, calls):
+        await client.get('/analytics/patient-stats')
+        await client.get('/analytics/summary')
+        response = await client.get('/metrics')
+        return response.status, await response.text()
+
+    status, body = run_with_upstream(monkeypatch, scenario)
+    assert status == 200
+    assert 'http_requests_total{method="GET",route="/analytics/patient-stats",status="200"}' in body
+    assert 'analytics_report_duration_seconds_count{report="summary"}' in body
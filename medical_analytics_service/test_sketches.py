@@ -0,0 +1,76 @@
+import random
+import pytest
+from sketches import HyperLogLog, SpaceSaving
+
+def zipf_stream(n_items, n_distinct, seed=7):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, n_distinct + 1)]
+    return rng.choices([f"drug-{i}" for i in range(n_distinct)], weights=weights, k=n_items)
+
+def exact_counts(stream):
+    counts = {}
+    for item in stream:
+        counts[item] = counts.get(item, 0) + 1
+    return counts
+
+@pytest.mark.parametrize('n_distinct', [100, 5000, 50000])
+def test_hyperloglog_within_error_bound(n_distinct):
+    hll = HyperLogLog.from_memory(4096)
+    for i in range(n_distinct):
+        hll.add(f"diagnosis-{i}")
+    # Three standard errors covers >99% of estimates
+    assert abs(hll.count() - n_distinct) <= 3 * hll.relative_error * n_distinct
+
+def test_hyperloglog_ignores_duplicates_and_merges():
+    left = HyperLogLog(precision=12)
+    right = HyperLogLog(precision=12)
+    for i in range(20000):
+        left.add(i)
+        left.add(i)
+    for i in range(10000, 30000):
+        right.add(i)
+
+    union = left.merge(right).count()
+    assert abs(union - 30000) <= 3 * left.relative_error * 30000
+
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=10).merge(HyperLogLog(precision=12))
+
+def test_hyperloglog_sized_by_memory_budget():
+    assert len(HyperLogLog.from_memory(1024).registers) == 1024
+    assert len(HyperLogLog.from_memory(5000).registers) == 4096
+
+def test_space_saving_top_k_error_bounds():
+    stream = zipf_stream(50000, 5000)
+    summary = SpaceSaving(capacity=100)
+    for item in stream:
+        summary.add(item)
+
+    exact = exact_counts(stream)
+    for item, count, error in summary.top(20):
+        assert count - error <= exact[item] <= count
+        assert error <= summary.total / summary.capacity
+
+    # Every item above total / capacity must be tracked
+    threshold = summary.total / summary.capacity
+    heavy = {item for item, count in exact.items() if count > threshold}
+    assert heavy <= set(summary.counters)
+
+    true_top5 = sorted(exact, key=exact.get, reverse=True)[:5]
+    assert [item for item, _, _ in summary.top(5)] == true_top5
+
+def test_space_saving_merge_keeps_heavy_hitters():
+    stream = zipf_stream(40000, 3000)
+    left = SpaceSaving(capacity=100)
+    right = SpaceSaving(capacity=100)
+    for i, item in enumerate(stream):
+        (left if i % 2 else right).add(item)
+
+    merged = left.merge(right)
+    exact = exact_counts(stream)
+    assert merged.total == len(stream)
+    assert len(merged.counters) <= merged.capacity
+    for item, count, error in merged.top(10):
+        assert count - error <= exact[item] <= count
+    true_top3 = sorted(exact, key=exact.get, reverse=True)[:3]
+    assert [item for item, _, _ in merged.top(3)] == true_top3
@@ -0,0 +1,92 @@
+import json
+import os
+import pickle
+import pytest
+from streaming import Payload, iter_json_array, iter_ndjson
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+ROWS = [
+    {'visit_id': 1, 'diagnosis': 'Flu, mild', 'nested': {'a': [1, 2]}},
+    {'visit_id': 2, 'diagnosis': 'Café – "quoted" ]['},
+    {'visit_id': 3, 'diagnosis': None}
+]
+
+@pytest.mark.parametrize('size', [1, 2, 5, 64, 4096])
+def test_json_array_across_chunk_boundaries(size):
+    body = json.dumps(ROWS, indent=2).encode('utf-8')
+    assert list(iter_json_array(chunked(body, size))) == ROWS
+
+def test_json_array_of_scalars_split_mid_number():
+    assert list(iter_json_array([b'[12', b'34, 5', b'6]'])) == [1234, 56]
+
+def test_empty_json_array():
+    assert list(iter_json_array([b' [ ', b'] '])) == []
+
+@pytest.mark.parametrize('body', [b'{"error": "x"}', b'[{"a": 1}, {"b"', b'[1] [2]'])
+def test_json_array_rejects_malformed_bodies(body):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunked(body, 3)))
+
+@pytest.mark.parametrize('size', [1, 3, 4096])
+def test_ndjson_across_chunk_boundaries(size):
+    body = ''.join(json.dumps(row) + '\n' for row in ROWS).encode('utf-8')
+    assert list(iter_ndjson(chunked(body, size))) == ROWS
+    # A missing trailing newline still yields the last row
+    assert list(iter_ndjson(chunked(body.rstrip(b'\n'), size))) == ROWS
+
+def test_json_array_is_consumed_lazily():
+    def chunks():
+        yield b'[{"id": 1},'
+        raise AssertionError('second chunk should not be read yet')
+
+    rows = iter_json_array(chunks())
+    assert next(rows) == {'id': 1}
+
+def test_memory_stays_flat_as_dataset_grows():
+    import tracemalloc
+    from aggregators import PatientStats
+
+    def body(rows):
+        for start in range(0, rows, 1000):
+            yield ''.join(
+                json.dumps({'id': i, 'name': f'Patient {i}', 'age': i % 90}) + '\n'
+                for i in range(start, min(start + 1000, rows))
+            ).encode()
+
+    peaks = []
+    for rows in (10000, 100000):
+        stats = PatientStats()
+        tracemalloc.start()
+        for patient in iter_ndjson(body(rows)):
+            stats.add(patient)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert stats.result()['total_patients'] == rows
+
+    # Ten times the rows must not mean (anywhere near) ten times the memory
+    assert peaks[1] < 2 * peaks[0]
+
+def test_payload_spools_pages_beyond_max_memory():
+    body = json.dumps(ROWS).encode('utf-8')
+    ndjson = ''.join(json.dumps(row) + '\n' for row in ROWS).encode('utf-8')
+    payload = Payload(max_memory=len(body))
+    payload.start_page()
+    payload.write(body)
+    payload.end_page()
+    payload.start_page(ndjson=True)
+    for chunk in chunked(ndjson, 5):
+        payload.write(chunk)
+    payload.end_page()
+
+    assert payload.pages[0] == (False, body)
+    spooled = payload.pages[1][1]
+    assert os.path.exists(spooled)
+    assert payload.body is None
+
+    # Pickles as bytes and paths, for parsing in another process
+    restored = pickle.loads(pickle.dumps(payload))
+    assert list(restored.rows(chunk_size=3)) == ROWS + ROWS
+    payload.close()
+    assert not os.path.exists(spooled)
@@ -3,4 +3,5 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    # Development server; debug follows the config profile. Production: gunicorn -c gunicorn.conf.py wsgi:app
+    app.run(host='0.0.0.0', port=5001)
@@ -0,0 +1,11 @@
+"""
+Production WSGI entrypoint for the main API, served by gunicorn:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The production config profile is the default here (APP_CONFIG).
+"""
+import os
+from app import create_app
+
+app = create_app(os.environ.get('APP_CONFIG', 'production'))